@@ -18,6 +18,7 @@ import geoanalysis.geoqb.geoqb_workspace as gqws
 import geoanalysis.geoqb.data4good.HighResolutionPopulationDensityMapsAndDemographicEstimates as d4g_population
 import geoanalysis.geoqb.geoqb_tg as gqtg
 import geoanalysis.geoqb.geoqb_kafka as gqkafka
+import geoanalysis.geoqb.geoqb_stream_blender as gqstream
 import geoanalysis.geoqb.geoqb_layers as gql
 import geoanalysis.geoqb.cli.cli_helper as cli
 import plac
@@ -64,20 +65,19 @@ def validateStructure4GraphMapping( df ):
     return True
 
 
-def blendDataFromTopicToLayer( layerName, dataDF ):
-
-    print( "#.")
-
-    conn, graph_name = getConnection()
+def loadLayerNodes( conn, graph_name, layerName ):
 
-    dfSPOS, dfedgesNEG = gqtg.getLayer( conn, graph_name, WORKPATH=WORKPATH, overwrite=True,  s1=layerName, s2="POS" )
-    dfSNEG, dfedgesNEG = gqtg.getLayer( conn, graph_name, WORKPATH=WORKPATH, overwrite=True,  s1=layerName, s2="NEG" )
+    layers = gqtg.getLayerVariants( conn, graph_name, WORKPATH=WORKPATH, s1=layerName, variants=("POS","NEG") )
+    dfSPOS, dfedgesPOS = layers["POS"]
+    dfSNEG, dfedgesNEG = layers["NEG"]
 
     nodesPOS = dfSPOS.dropna(subset=['lat', 'lon'])
     nodesNEG = dfSNEG.dropna(subset=['lat', 'lon'])
 
-    allNodesTemp = pd.concat([nodesPOS, nodesNEG], axis=0)
+    return pd.concat([nodesPOS, nodesNEG], axis=0)
 
+
+def getObservationMappings():
     #
     # This is the mapping of a particular measurement to an h3place in the graph
     #
@@ -93,11 +93,52 @@ def blendDataFromTopicToLayer( layerName, dataDF ):
         mappings.append( mapping1 )
         i = i + 1
 
+    return mappings
+
+
+def blendDataFromTopicToLayer( layerName, dataDF ):
+
+    print( "#.")
+
+    conn, graph_name = getConnection()
+
+    allNodesTemp = loadLayerNodes( conn, graph_name, layerName )
+
+    mappings = getObservationMappings()
+
     print( f"> # of nodes in layer: {len(allNodesTemp)}" )
 
     gqtg.blendDataToLayerDataInTigerGraph( allNodesTemp, dataDF, mappings, path_offset, conn )
 
 
+#
+# Long running blender: all topics with the prefix are consumed and blended in micro-batches.
+#
+def streamDataFromTopicsToLayer( layerName, prefix ):
+
+    conn, graph_name = getConnection()
+
+    allNodesTemp = loadLayerNodes( conn, graph_name, layerName )
+    print( f"> # of nodes in layer: {len(allNodesTemp)}" )
+
+    consumer = gqkafka.createConsumer( client_id='geoqb_stream_blender', group_id=f'geoqb_stream_blender_{layerName}' )
+    consumer.subscribe( [ f"^{prefix}.*" ] )
+
+    blender = gqstream.StreamBlender( consumer, allNodesTemp, getObservationMappings(), conn, path_offset=path_offset,
+                                      batchSize=int( os.environ.get('GEOQB_STREAM_BATCH_SIZE', gqstream.STREAM_BATCH_SIZE) ),
+                                      batchSeconds=float( os.environ.get('GEOQB_STREAM_BATCH_SECONDS', gqstream.STREAM_BATCH_SECONDS) ),
+                                      verbose=True )
+
+    print(f"> Streaming data from topics <{prefix}*> to layer <{layerName}>, stop with CTRL-C ...")
+    try:
+        blender.run()
+    except KeyboardInterrupt:
+        blender.flush()
+    finally:
+        consumer.close()
+        blender.printMetrics()
+
+
 
 def start_blending_data_to_layer( asset="data4good", filters=["_", "POS"] ):
 
@@ -121,8 +162,9 @@ def start_blending_data_to_layer( asset="data4good", filters=["_", "POS"] ):
 
         conn, graph_name = getConnection()
 
-        dfSPOS, dfedgesNEG = gqtg.getLayer( conn, graph_name, WORKPATH=WORKPATH, overwrite=True,  s1=location, s2="POS" )
-        dfSNEG, dfedgesNEG = gqtg.getLayer( conn, graph_name, WORKPATH=WORKPATH, overwrite=True,  s1=location, s2="NEG" )
+        layers = gqtg.getLayerVariants( conn, graph_name, WORKPATH=WORKPATH, s1=location, variants=("POS","NEG") )
+        dfSPOS, dfedgesPOS = layers["POS"]
+        dfSNEG, dfedgesNEG = layers["NEG"]
 
         nodesPOS = dfSPOS.dropna(subset=['lat', 'lon'])
         nodesNEG = dfSNEG.dropna(subset=['lat', 'lon'])
@@ -155,7 +197,7 @@ def start_blending_data_to_layer( asset="data4good", filters=["_", "POS"] ):
 
 
 
-def main( cmd: ('(ls|asset|topic|init|clear)'), verbose=False, ):
+def main( cmd: ('(ls|asset|topic|stream|init|clear)'), verbose=False, ):
 
     print( f"\nGeoQB blend - is a tool for data blending for data from local data assets, streaming pods, and public linked data pods.\n" )
 
@@ -211,6 +253,15 @@ def main( cmd: ('(ls|asset|topic|init|clear)'), verbose=False, ):
         else:
             print(f"> Data from topic {topic} can't be blended." )
 
+    elif cmd=="stream":
+        print( f"CMD: {cmd} <verbose:{verbose}>\n")
+
+        prefix="GQ"
+
+        layerName = cli.selectLayer()
+
+        streamDataFromTopicsToLayer( layerName, prefix )
+
     elif cmd=="init":
         print( f"CMD: {cmd} <verbose:{verbose}>")
         print( "Initialize a new data asset. ( This feature is comming soon!)")
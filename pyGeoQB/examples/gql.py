@@ -95,6 +95,37 @@ def calc_impact_score_for_layer_stack( location_name ):
     print( f"> Calculated scores have been appended to {rfn} in {WORKPATH}.")
 
 
+def calc_impact_scores_for_layer_stacks( location_names ):
+
+    path_offset = gqws.prepareWorkspaceFolders()
+    WORKPATH = f"{path_offset}/sample_score/"
+
+    Path(WORKPATH).mkdir(parents=True, exist_ok=True)
+
+    conn, graph_name = getConnection()
+
+    import geoanalysis.geoqb.calc_impact_score as scorer
+    run = datetime.now().strftime("%Y%m%d-%H%M%S")
+    scorer.calc_variant_scores( location_names, conn, WORKPATH, graph_name, fn=f"impact-scores-{run}" )
+
+
+def calc_profile_scores_for_layer_stacks( location_names ):
+
+    path_offset = gqws.prepareWorkspaceFolders()
+    WORKPATH = f"{path_offset}/sample_score/"
+
+    Path(WORKPATH).mkdir(parents=True, exist_ok=True)
+
+    conn, graph_name = getConnection()
+
+    import geoanalysis.geoqb.calc_impact_score as scorer
+    run = datetime.now().strftime("%Y%m%d-%H%M%S")
+    for location_name in location_names:
+        df = scorer.calc_profile_scores( location_name, conn, WORKPATH, graph_name )
+        fn = gqws.writeFrame( df, f"{WORKPATH}profile-scores-{location_name}-{run}" )
+        print( f"> Profile scores of {location_name} have been written to {fn}.")
+
+
 
 
 def export_layer_stack(location_name, type="sophox", graph_name="OSMLayers_Demo6a", zoom=9, dryRun=False):
@@ -110,8 +141,9 @@ def export_layer_stack(location_name, type="sophox", graph_name="OSMLayers_Demo6
 
     conn, graph_name = getConnection()
 
-    dfSPOS, dfedgesNEG = gqtg.getLayer( conn, graph_name, WORKPATH=WORKPATH, overwrite=True,  s1=location_name, s2="POS" )
-    dfSNEG, dfedgesNEG = gqtg.getLayer( conn, graph_name, WORKPATH=WORKPATH, overwrite=True,  s1=location_name, s2="NEG" )
+    layers = gqtg.getLayerVariants( conn, graph_name, WORKPATH=WORKPATH, s1=location_name, variants=("POS","NEG") )
+    dfSPOS, dfedgesPOS = layers["POS"]
+    dfSNEG, dfedgesNEG = layers["NEG"]
 
     print( f"> Exported graph data is stored in {WORKPATH}.")
 
@@ -138,7 +170,7 @@ def export_all_layer_stack( type="sophox", graph_name="OSMLayers_Demo6a", zoom=9
 
 def ingest_layer_stack(location_name, type="sophox", zoom=9, dryRun=False):
 
-    temp_layers = sl.getKGC2022_DemoDataStack( location_name = location_name, l = 30, zoom=zoom, path_offset=path_offset, dryRun=dryRun )
+    temp_layers = sl.getKGC2022_DemoDataStack( location_name = location_name, l = 30, zoom=zoom, path_offset=path_offset, dryRun=dryRun, tiled=( type == "sophox-tiled" ) )
 
     conn, graph_name = getConnection()
 
@@ -156,9 +188,13 @@ def ingest_layer_stack(location_name, type="sophox", zoom=9, dryRun=False):
 
 
 
+#
+# type "sophox-tiled" queries the region in H3 tiles (gql.TiledSophoxLayer), for regions
+# which exceed the result limit of a single Sophox query.
+#
 def create_layer_stack(location_name, type="sophox", zoom=9, dryRun=False):
 
-    temp_layers = sl.getKGC2022_DemoDataStack( location_name = location_name, l = 30, zoom=zoom, path_offset=path_offset, dryRun=dryRun )
+    temp_layers = sl.getKGC2022_DemoDataStack( location_name = location_name, l = 30, zoom=zoom, path_offset=path_offset, dryRun=dryRun, tiled=( type == "sophox-tiled" ) )
 
     i = 0
     for key in temp_layers:
@@ -179,7 +215,7 @@ def getLayerNames(path_offset):
     return locs
 
 
-def main( cmd: ("(ls|create|rm|ingest|extract|extract-all|calc-impact-score|clusters)"), layer_name='*', verbose=False):
+def main( cmd: ("(ls|create|rm|ingest|extract|extract-all|calc-impact-score|calc-impact-scores|calc-profile-scores|clusters)"), layer_name='*', verbose=False):
 
     print( f"ENV: GEOQB_WORKSPACE: {path_offset}")
     print( f"CMD: {cmd} <verbose:{verbose}>")
@@ -229,7 +265,7 @@ def main( cmd: ("(ls|create|rm|ingest|extract|extract-all|calc-impact-score|clus
         else:
             print( f"> Continue with {location}.")
 
-        type = input("> Select layer type: (Sophox) " )
+        type = input("> Select layer type, sophox or sophox-tiled: (sophox) " )
         if len(type) == 0:
             type = "sophox"
         print(f"[{type}]")
@@ -307,6 +343,34 @@ def main( cmd: ("(ls|create|rm|ingest|extract|extract-all|calc-impact-score|clus
 
         calc_impact_score_for_layer_stack( location_name=location )
 
+    elif cmd=="calc-impact-scores":
+
+        #
+        # all locations of the workspace, or a comma separated list in layer_name
+        #
+        locs = getLayerNames(path_offset)
+        if layer_name != '*':
+            selected = [ l.strip() for l in layer_name.split(",") if l.strip() in locs ]
+        else:
+            selected = list( locs.keys() )
+        print( f"> Score {len(selected)} of {len(locs)} locations: {selected}" )
+
+        calc_impact_scores_for_layer_stacks( selected )
+
+    elif cmd=="calc-profile-scores":
+
+        #
+        # cell scores for the standard profiles, all locations or a comma separated list in layer_name
+        #
+        locs = getLayerNames(path_offset)
+        if layer_name != '*':
+            selected = [ l.strip() for l in layer_name.split(",") if l.strip() in locs ]
+        else:
+            selected = list( locs.keys() )
+        print( f"> Profile scores for {len(selected)} of {len(locs)} locations: {selected}" )
+
+        calc_profile_scores_for_layer_stacks( selected )
+
     elif cmd=="clusters":
 
         go = input("> Analyse the full graph ... (node2vec + k-means + word-clouds) " )
@@ -13,6 +13,7 @@ import glob
 import geoanalysis.geoqb.geoqb_workspace as gqws
 import geoanalysis.geoqb.geoqb_kafka as gqkafka
 import geoanalysis.geoqb.geoqb_profiles as gqprofile
+import geoanalysis.geoqb.geoqb_query_cache as gqcache
 import plac
 
 import geoanalysis.geoqb.data4good.HighResolutionPopulationDensityMapsAndDemographicEstimates as asset1
@@ -92,6 +93,7 @@ def main( cmd: ('(ls|init|describe|clear|delete)'), folder: ('(md|raw|stage)','o
 
     elif cmd=="describe":
         gqws.describeWorkspace( verbose=True )
+        gqcache.describeQueryCache( path_offset )
         gqkafka.describeCluster()
         gqprofile.describeSolidDatapod()
         print()
@@ -1,54 +1,12 @@
 import sys
 sys.path.append('./')
 
-from geopy import distance
-
 import math
 import os
 import pandas as pd
 import geoanalysis.geoqb.geoqb_tg as gqtg
 import geoanalysis.geoqb.geoqb_workspace as gqws
-
-def calcAverageDistanceForAllPoints1d( p1 ):
-    return 1,1,1
-#
-# p1, p2 : pairs of (lat,lon)
-#
-#  The default is the WGS-84 ellipsoid,
-#  https://geopy.readthedocs.io/en/stable/#module-geopy.distance
-def calcDistanceInMeters( p1, p2 ):
-    ##
-    # #  Some dummy points can disturb our calculations
-    ##
-    if ( p1[0] < 1 and p1[1] < 1):
-        return 0;
-
-    if ( p2[0] < 1 and p2[1] < 1):
-        return 0;
-
-    return distance.distance(p1, p2).km
-
-def calcAverageDistanceForAllPoints1( df ):
-    df1 = df[['lat','lon']]
-    df2 = df[['lat','lon']]
-    return calcAverageDistanceForAllPoints2( df1, df2 )
-
-def calcAverageDistanceForAllPoints2( df1, df2 ):
-    df1['key'] = 0
-    df2['key'] = 0
-
-    #dfX = df1.sort_values(by=['lat'])
-    #print( dfX )
-
-    # to obtain the cross join we will merge on
-    # the key and drop it.
-    joinResult = pd.merge(df1, df2, on ='key').drop("key", 1).apply(lambda x:  calcDistanceInMeters( (x['lon_x'],x['lat_x']),(x['lon_y'],x['lat_y'])) , axis=1).reset_index(name='dist')
-
-    mean = joinResult['dist'].mean()
-    count = joinResult['dist'].count()
-    max = joinResult['dist'].max()
-
-    return mean, count, max
+from geoanalysis.geoqb.calc_impact_score import calcAverageDistanceForAllPoints1
 
 
 #####################################################
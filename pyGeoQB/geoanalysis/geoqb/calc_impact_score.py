@@ -4,9 +4,16 @@ from geopy import distance
 
 import math
 import os
+import time
+import numpy as np
 import pandas as pd
 import geoanalysis.geoqb.geoqb_tg as gqtg
 import geoanalysis.geoqb.geoqb_workspace as gqws
+import geoanalysis.geoqb.geoqb_h3 as gqh3
+import geoanalysis.geoqb.geoqb_profiles as gqprofiles
+
+from statistics import NormalDist
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 def calcAverageDistanceForAllPoints1d( p1 ):
     return 1,1,1
@@ -27,58 +34,331 @@ def calcDistanceInMeters( p1, p2 ):
 
     return distance.distance(p1, p2).km
 
-def calcAverageDistanceForAllPoints1( df ):
-    df1 = df[['lat','lon']]
-    df2 = df[['lat','lon']]
-    return calcAverageDistanceForAllPoints2( df1, df2 )
+######################################################
+#  Blocked pairwise distances.
+#
+#  The n x n distance matrix is never built: the points are cut into blocks of blockSize,
+#  each pair of blocks is evaluated with NumPy and only sum, count and max are kept. For the
+#  distances within one point set only the upper triangle of blocks is computed.
+#
+#  method: "haversine" (sphere, default), "vincenty" (WGS-84, vectorized iteration) or
+#          "karney" (WGS-84 geodesic from geopy, exact but one call per pair)
+#
+#  The coordinates are passed as ( lat, lon ). Scores computed before these kernels passed
+#  ( lon, lat ) to geopy and used the WGS-84 ellipsoid, their mean and max distances are not
+#  comparable with the current ones.
+#
+DISTANCE_BLOCK_SIZE = int( os.environ.get('GEOQB_DISTANCE_BLOCK_SIZE', 2048) )
+DISTANCE_METHOD = os.environ.get('GEOQB_DISTANCE_METHOD', 'haversine')
 
-def calcAverageDistanceForAllPoints2( df1, df2 ):
-    df1['key'] = 0
-    df2['key'] = 0
+EARTH_RADIUS_KM = 6371.0088
 
-    #dfX = df1.sort_values(by=['lat'])
-    #print( dfX )
+WGS84_A = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_B = ( 1 - WGS84_F ) * WGS84_A
 
-    # to obtain the cross join we will merge on
-    # the key and drop it.
-    joinResult = pd.merge(df1, df2, on ='key').drop("key", 1).apply(lambda x:  calcDistanceInMeters( (x['lon_x'],x['lat_x']),(x['lon_y'],x['lat_y'])) , axis=1).reset_index(name='dist')
 
-    mean = joinResult['dist'].mean()
-    count = joinResult['dist'].count()
-    max = joinResult['dist'].max()
+def haversineKm( lat1, lon1, lat2, lon2 ):
+    lat1, lon1, lat2, lon2 = map( np.radians, ( lat1, lon1, lat2, lon2 ) )
+    a = np.sin( ( lat2 - lat1 ) / 2.0 ) ** 2 + np.cos( lat1 ) * np.cos( lat2 ) * np.sin( ( lon2 - lon1 ) / 2.0 ) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin( np.sqrt( np.clip( a, 0.0, 1.0 ) ) )
 
-    return mean, count, max
 
+def karneyKm( lat1, lon1, lat2, lon2 ):
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays( lat1, lon1, lat2, lon2 )
+    d = np.empty( lat1.shape )
+    for idx in np.ndindex( d.shape ):
+        d[idx] = distance.geodesic( ( lat1[idx], lon1[idx] ), ( lat2[idx], lon2[idx] ) ).km
+    return d
 
 
+def vincentyKm( lat1, lon1, lat2, lon2, maxIter=200, tol=1e-12 ):
 
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays( *map( np.radians, ( lat1, lon1, lat2, lon2 ) ) )
 
+    L = lon2 - lon1
+    U1 = np.arctan( ( 1 - WGS84_F ) * np.tan( lat1 ) )
+    U2 = np.arctan( ( 1 - WGS84_F ) * np.tan( lat2 ) )
+    sinU1, cosU1, sinU2, cosU2 = np.sin( U1 ), np.cos( U1 ), np.sin( U2 ), np.cos( U2 )
 
+    lam = L
+    converged = np.zeros( L.shape, dtype=bool )
 
-def calc_score( location_name, conn, WORKPATH, run, graph_name ):
+    with np.errstate( invalid='ignore', divide='ignore' ):
+        for i in range( maxIter ):
+            sinLam, cosLam = np.sin( lam ), np.cos( lam )
+            sinSigma = np.sqrt( ( cosU2 * sinLam ) ** 2 + ( cosU1 * sinU2 - sinU1 * cosU2 * cosLam ) ** 2 )
+            cosSigma = sinU1 * sinU2 + cosU1 * cosU2 * cosLam
+            sigma = np.arctan2( sinSigma, cosSigma )
+            sinAlpha = np.where( sinSigma == 0, 0.0, cosU1 * cosU2 * sinLam / sinSigma )
+            cos2Alpha = 1 - sinAlpha ** 2
+            cos2SigmaM = np.where( cos2Alpha == 0, 0.0, cosSigma - 2 * sinU1 * sinU2 / cos2Alpha )
+            C = WGS84_F / 16 * cos2Alpha * ( 4 + WGS84_F * ( 4 - 3 * cos2Alpha ) )
+            lamNext = L + ( 1 - C ) * WGS84_F * sinAlpha * ( sigma + C * sinSigma * ( cos2SigmaM + C * cosSigma * ( -1 + 2 * cos2SigmaM ** 2 ) ) )
+            converged = np.abs( lamNext - lam ) < tol
+            lam = lamNext
+            if converged.all():
+                break
 
-    fn1 = f"impact-score-0{run}.tsv"
+        u2 = cos2Alpha * ( WGS84_A ** 2 - WGS84_B ** 2 ) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * ( 4096 + u2 * ( -768 + u2 * ( 320 - 175 * u2 ) ) )
+        B = u2 / 1024 * ( 256 + u2 * ( -128 + u2 * ( 74 - 47 * u2 ) ) )
+        deltaSigma = B * sinSigma * ( cos2SigmaM + B / 4 * ( cosSigma * ( -1 + 2 * cos2SigmaM ** 2 )
+                     - B / 6 * cos2SigmaM * ( -3 + 4 * sinSigma ** 2 ) * ( -3 + 4 * cos2SigmaM ** 2 ) ) )
+        d = np.array( WGS84_B * A * ( sigma - deltaSigma ), dtype=np.float64 )
 
-    file = gqws.getFileHandle( path="sample_score/", fn=fn1, mode="a" ) ### MAKE an automatic counter for placehoder x
+    # nearly antipodal points do not converge, they get the exact geodesic
+    bad = ~converged | ~np.isfinite( d )
+    if bad.any():
+        d[bad] = karneyKm( np.degrees( lat1[bad] ), np.degrees( lon1[bad] ), np.degrees( lat2[bad] ), np.degrees( lon2[bad] ) )
 
-    try:
-        size = os.path.getsize( file.name )
-        print( f"> FILE SIZE: {size}")
-        if size < 1:
-            file.write("DURATION\tLOC\tzPOS\tzNEG\tzALl\tposM\tposM/allMAX\tmath.sqrt(posZ)\tposMAX\tallM\tallM/allMAX\tmath.sqrt(allZ)\tallMAX\tnegM\tnegM/allMAX\tmath.sqrt(negZ)\tnegMAX\n")
-            print( f"> Define table header ... <{file.name}>" )
-        else:
-            print( f"> Table is ready for appending data ... <{file.name}>" )
-    except:
-        pass
+    # a scalar for scalar arguments
+    return d[()]
+
+
+DISTANCE_METHODS = {
+    "haversine" : haversineKm,
+    "vincenty" : vincentyKm,
+    "karney" : karneyKm
+}
+
+
+#
+# Some dummy points near (0,0) can disturb our calculations, their distances count as 0.
+#
+def _validPoints( lat, lon ):
+    return ~( ( lat < 1 ) & ( lon < 1 ) )
+
+
+#
+# Mean, count and max of the distances (km) between all ordered pairs of the two point sets,
+# the second set defaults to the first one. With weights a point stands for weight points.
+#
+def pairwiseDistanceStats( lat1, lon1, lat2=None, lon2=None, method=None, blockSize=None, weights1=None, weights2=None ):
+
+    kernel = DISTANCE_METHODS[ method or DISTANCE_METHOD ]
+    blockSize = blockSize or DISTANCE_BLOCK_SIZE
+
+    lat1 = np.asarray( lat1, dtype=np.float64 )
+    lon1 = np.asarray( lon1, dtype=np.float64 )
+    w1 = np.ones( len( lat1 ) ) if weights1 is None else np.asarray( weights1, dtype=np.float64 )
+    symmetric = lat2 is None
+    if symmetric:
+        lat2, lon2, w2 = lat1, lon1, w1
+    else:
+        lat2 = np.asarray( lat2, dtype=np.float64 )
+        lon2 = np.asarray( lon2, dtype=np.float64 )
+        w2 = np.ones( len( lat2 ) ) if weights2 is None else np.asarray( weights2, dtype=np.float64 )
+
+    n1, n2 = len( lat1 ), len( lat2 )
+    count = int( round( w1.sum() * w2.sum() ) )
+    if count == 0:
+        return float( "nan" ), 0, float( "nan" )
+
+    valid1 = _validPoints( lat1, lon1 )
+    valid2 = _validPoints( lat2, lon2 )
+
+    total = 0.0
+    dmax = 0.0
+
+    for i in range( 0, n1, blockSize ):
+        bi = slice( i, i + blockSize )
+        for j in range( i if symmetric else 0, n2, blockSize ):
+            bj = slice( j, j + blockSize )
+            d = kernel( lat1[bi, None], lon1[bi, None], lat2[None, bj], lon2[None, bj] )
+            d = np.where( valid1[bi, None] & valid2[None, bj], d, 0.0 )
+            # off-diagonal blocks stand for both ( i, j ) and ( j, i )
+            weight = 2.0 if symmetric and i != j else 1.0
+            total = total + weight * ( w1[bi, None] * d * w2[None, bj] ).sum()
+            dmax = max( dmax, float( d.max() ) )
+
+    return float( total / count ), count, dmax
+
+
+######################################################
+#  Approximate distance statistics.
+#
+#  "sample" : mean over randomly drawn ordered pairs, the error is the half width of the
+#             confidence interval of the mean
+#  "h3"     : points are aggregated to the centroids of their H3 cells, cell pairs are weighted
+#             by the product of the counts. A point is at most r from its centroid, so the error
+#             of the mean is bounded by 2 * sum( count * r ) * nValid / n^2. The resolution is
+#             lowered until there are at most SCORE_MAX_CELLS cells.
+#
+#  The max is the largest distance between the vertices of the convex hull of the points
+#  (see _convexHull), it is exact for haversine distances.
+#
+SCORE_MODE = os.environ.get('GEOQB_SCORE_MODE', 'auto')
+SCORE_EXACT_MAX_POINTS = int( os.environ.get('GEOQB_SCORE_EXACT_MAX_POINTS', 20000) )
+SCORE_SAMPLES = int( os.environ.get('GEOQB_SCORE_SAMPLES', 200000) )
+SCORE_H3_RESOLUTION = int( os.environ.get('GEOQB_SCORE_H3_RESOLUTION', 10) )
+SCORE_MAX_CELLS = int( os.environ.get('GEOQB_SCORE_MAX_CELLS', 5000) )
+SCORE_CONFIDENCE = 0.95
+
+
+#
+# Andrew's monotone chain in the gnomonic projection centred on the points, returns the
+# indexes of the hull. Great circles are straight lines in this projection, so the hull is
+# the spherical convex hull and, as long as all distances are below a quarter of the great
+# circle, the pair with the largest haversine distance is a pair of hull vertices. The
+# WGS-84 distances differ from the spherical ones by less than the flattening, so with
+# vincenty or karney the result is within 0.7 % of the largest distance.
+#
+# Returns None for points more than 45 degrees away from their centre (the condition above
+# does not hold), the diameter is computed from all points then.
+#
+def _convexHull( lat, lon ):
+
+    phi, lam = np.radians( lat ), np.radians( lon )
+    v = np.stack( [ np.cos( phi ) * np.cos( lam ), np.cos( phi ) * np.sin( lam ), np.sin( phi ) ] )
+
+    center = v.mean( axis=1 )
+    if np.linalg.norm( center ) == 0:
+        return None
+    center = center / np.linalg.norm( center )
+
+    cosc = center @ v
+    if cosc.min() <= math.cos( math.pi / 4 ):
+        return None
+
+    east = np.cross( [ 0.0, 0.0, 1.0 ], center )
+    if np.linalg.norm( east ) < 1e-12:
+        east = np.array( [ 1.0, 0.0, 0.0 ] )
+    east = east / np.linalg.norm( east )
+    north = np.cross( center, east )
+
+    x = ( east @ v ) / cosc
+    y = ( north @ v ) / cosc
+    order = np.lexsort( ( y, x ) )
+
+    def cross( o, a, b ):
+        return ( x[a] - x[o] ) * ( y[b] - y[o] ) - ( y[a] - y[o] ) * ( x[b] - x[o] )
+
+    def chain( idx ):
+        h = []
+        for p in idx:
+            while len( h ) >= 2 and cross( h[-2], h[-1], p ) <= 0:
+                h.pop()
+            h.append( p )
+        return h
+
+    lower = chain( order )
+    upper = chain( order[::-1] )
+    return np.unique( np.array( lower[:-1] + upper[:-1] + [ order[0] ] ) )
+
+
+def hullDiameterKm( lat, lon, method=None ):
+    lat = np.asarray( lat, dtype=np.float64 )
+    lon = np.asarray( lon, dtype=np.float64 )
+    valid = _validPoints( lat, lon )
+    lat, lon = lat[valid], lon[valid]
+    if len( lat ) < 2:
+        return 0.0
+    hull = _convexHull( lat, lon )
+    if hull is None:
+        return pairwiseDistanceStats( lat, lon, method=method )[2]
+    return pairwiseDistanceStats( lat[hull], lon[hull], method=method )[2]
+
+
+def _sampledMean( lat, lon, valid, samples, confidence, method, seed ):
+
+    n = len( lat )
+    kernel = DISTANCE_METHODS[ method or DISTANCE_METHOD ]
+    rng = np.random.default_rng( seed )
+
+    i = rng.integers( 0, n, size=samples )
+    j = rng.integers( 0, n, size=samples )
+    d = np.where( valid[i] & valid[j], kernel( lat[i], lon[i], lat[j], lon[j] ), 0.0 )
+
+    z = NormalDist().inv_cdf( ( 1 + confidence ) / 2 )
+    return float( d.mean() ), float( z * d.std( ddof=1 ) / math.sqrt( samples ) )
+
+
+def _binnedMean( lat, lon, valid, res, method ):
+
+    n = len( lat )
+    lat, lon = lat[valid], lon[valid]
+    if len( lat ) == 0:
+        return 0.0, 0.0
+
+    points = pd.DataFrame( { 'cell' : gqh3.h3Index_batch( lat, lon, res ), 'lat' : lat, 'lon' : lon } )
+    while res > 0 and points['cell'].nunique() > SCORE_MAX_CELLS:
+        res = res - 1
+        points['cell'] = gqh3.h3Index_batch( lat, lon, res )
+
+    cells = points.groupby( 'cell' ).agg( lat=( 'lat', 'mean' ), lon=( 'lon', 'mean' ), z=( 'lat', 'size' ) )
+
+    centroids = cells.loc[ points['cell'] ]
+    r = haversineKm( lat, lon, centroids['lat'].to_numpy(), centroids['lon'].to_numpy() )
+    rCell = pd.Series( r ).groupby( points['cell'].to_numpy() ).max().reindex( cells.index ).to_numpy()
+
+    total = pairwiseDistanceStats( cells['lat'].to_numpy(), cells['lon'].to_numpy(), method=method,
+                                   weights1=cells['z'].to_numpy() )[0] * len( lat ) ** 2
+
+    error = 2.0 * ( cells['z'].to_numpy() * rCell ).sum() * len( lat )
+    return float( total / n ** 2 ), float( error / n ** 2 )
+
+
+#
+# Returns a dict with mean, count, max and the error bound of the mean (0 in exact mode).
+#
+def distanceStats( lat, lon, mode=None, samples=None, res=None, confidence=SCORE_CONFIDENCE, method=None, seed=None ):
+
+    lat = np.asarray( lat, dtype=np.float64 )
+    lon = np.asarray( lon, dtype=np.float64 )
+    n = len( lat )
+
+    mode = mode or SCORE_MODE
+    samples = samples or SCORE_SAMPLES
+    if mode == "auto":
+        mode = "exact" if n <= SCORE_EXACT_MAX_POINTS else "h3"
+    if mode == "sample" and n * n <= samples:
+        mode = "exact"
+
+    if n == 0 or mode == "exact":
+        mean, count, dmax = pairwiseDistanceStats( lat, lon, method=method )
+        return { "mode" : "exact", "mean" : mean, "count" : count, "max" : dmax, "error" : 0.0 }
+
+    valid = _validPoints( lat, lon )
+
+    if mode == "sample":
+        mean, error = _sampledMean( lat, lon, valid, samples, confidence, method, seed )
+    elif mode == "h3":
+        mean, error = _binnedMean( lat, lon, valid, res or SCORE_H3_RESOLUTION, method )
+    else:
+        raise ValueError( f"Unknown score mode {mode}, use exact, sample, h3 or auto." )
+
+    return { "mode" : mode, "mean" : mean, "count" : n * n, "max" : hullDiameterKm( lat, lon, method ), "error" : error }
+
+
+def calcAverageDistanceForAllPoints1( df, method=None ):
+    return pairwiseDistanceStats( df['lat'].to_numpy(), df['lon'].to_numpy(), method=method )
+
+def calcAverageDistanceForAllPoints2( df1, df2, method=None ):
+    return pairwiseDistanceStats( df1['lat'].to_numpy(), df1['lon'].to_numpy(),
+                                  df2['lat'].to_numpy(), df2['lon'].to_numpy(), method=method )
+
+
+
+
+
+
+
+#
+# mode: exact, sample, h3 or auto (exact for small layers), see distanceStats. Scores with
+# an approximated mean (the mode which was used, not the one requested) go to
+# impact-score-0{run}-approx.tsv with the error of each mean next to it.
+#
+def calc_score( location_name, conn, WORKPATH, run, graph_name, mode=None, samples=None, res=None ):
 
     from datetime import datetime
 
     t1 = datetime.now()
 
     print( f"************** Customized Impact Score for area around {location_name} **************")
-    dfNodesPOS, dfEdgesPOS = gqtg.getLayer( conn, graph_name, WORKPATH=WORKPATH, overwrite=False,  s1=location_name, s2="POS" )
-    dfNodesNEG, dfEdgesNEG = gqtg.getLayer( conn, graph_name, WORKPATH=WORKPATH, overwrite=False,  s1=location_name, s2="NEG" )
+    layers = gqtg.getLayerVariants( conn, graph_name, WORKPATH=WORKPATH, overwrite=False, s1=location_name, variants=( "POS", "NEG" ) )
+    dfNodesPOS, dfEdgesPOS = layers["POS"]
+    dfNodesNEG, dfEdgesNEG = layers["NEG"]
     #dfNodesALL, dfEdgesALL = gqtg.getLayer( conn, graph_name, WORKPATH=WORKPATH, overwrite=False,  s1=loc, s2="AllTags" )
 
     dfNodesALL = pd.concat([dfNodesPOS,dfNodesNEG])
@@ -91,39 +371,274 @@ def calc_score( location_name, conn, WORKPATH, run, graph_name ):
     print ( "NEG", len(dfNodesNEG) )
     print ( "ALL", len(dfNodesALL) )
 
-    z = len(dfNodesALL)
-    tEstimate = 0.0003 * z*z + 0.0404 * z - 25.793
 
-    print()
-    print( f"Expected processing time: {tEstimate} s")
+    pos = distanceStats( dfNodesPOS['lat'], dfNodesPOS['lon'], mode=mode, samples=samples, res=res )
+    neg = distanceStats( dfNodesNEG['lat'], dfNodesNEG['lon'], mode=mode, samples=samples, res=res )
+    allStats = distanceStats( dfNodesALL['lat'], dfNodesALL['lon'], mode=mode, samples=samples, res=res )
+
+    posM, posZ, posMAX = pos["mean"], pos["count"], pos["max"]
+    negM, negZ, negMAX = neg["mean"], neg["count"], neg["max"]
+    allM, allZ, allMAX = allStats["mean"], allStats["count"], allStats["max"]
 
+    print(  "POS", posM, posM/allMAX, math.sqrt(posZ), posMAX, f"+/- {pos['error']:.4f} ({pos['mode']})" )
+    print(  "ALL", allM, allM/allMAX, math.sqrt(allZ), allMAX, f"+/- {allStats['error']:.4f} ({allStats['mode']})" )
+    print(  "NEG", negM, negM/allMAX, math.sqrt(negZ), negMAX, f"+/- {neg['error']:.4f} ({neg['mode']})" )
 
-    posM, posZ, posMAX = calcAverageDistanceForAllPoints1( dfNodesPOS )
+    approx = any( st["mode"] != "exact" for st in ( pos, allStats, neg ) )
 
-    negM, negZ, negMAX = calcAverageDistanceForAllPoints1( dfNodesNEG )
+    fn1 = f"impact-score-0{run}-approx.tsv" if approx else f"impact-score-0{run}.tsv"
 
-    allM, allZ, allMAX = calcAverageDistanceForAllPoints1( dfNodesALL )
+    file = gqws.getFileHandle( path="sample_score/", fn=fn1, mode="a" ) ### MAKE an automatic counter for placehoder x
 
-    print(  "POS", posM, posM/allMAX, math.sqrt(posZ), posMAX )
-    print(  "ALL", allM, allM/allMAX, math.sqrt(allZ), allMAX )
-    print(  "NEG", negM, negM/allMAX, math.sqrt(negZ), negMAX )
+    try:
+        size = os.path.getsize( file.name )
+        print( f"> FILE SIZE: {size}")
+        if size < 1:
+            header = "DURATION\tLOC\tzPOS\tzNEG\tzALl\tposM\tposM/allMAX\tmath.sqrt(posZ)\tposMAX\tallM\tallM/allMAX\tmath.sqrt(allZ)\tallMAX\tnegM\tnegM/allMAX\tmath.sqrt(negZ)\tnegMAX"
+            if approx:
+                header = header + "\tMODE\tposErr\tallErr\tnegErr"
+            file.write( header + "\n" )
+            print( f"> Define table header ... <{file.name}>" )
+        else:
+            print( f"> Table is ready for appending data ... <{file.name}>" )
+    except:
+        pass
 
     t2 = datetime.now()
 
     duration = t2-t1
 
-    file.write(  f"{duration}\t{location_name}\t{len(dfNodesPOS)}\t{len(dfNodesNEG)}\t{len(dfNodesALL)}\t{posM}\t{posM/allMAX}\t{math.sqrt(posZ)}\t{posMAX}\t{allM}\t{allM/allMAX}\t{math.sqrt(allZ)}\t{allMAX}\t{negM}\t{negM/allMAX}\t{math.sqrt(negZ)}\t{negMAX}\n"  )
+    line = f"{duration}\t{location_name}\t{len(dfNodesPOS)}\t{len(dfNodesNEG)}\t{len(dfNodesALL)}\t{posM}\t{posM/allMAX}\t{math.sqrt(posZ)}\t{posMAX}\t{allM}\t{allM/allMAX}\t{math.sqrt(allZ)}\t{allMAX}\t{negM}\t{negM/allMAX}\t{math.sqrt(negZ)}\t{negMAX}"
+    if approx:
+        line = line + f"\t{allStats['mode']}\t{pos['error']}\t{allStats['error']}\t{neg['error']}"
+    file.write( line + "\n" )
     file.flush()
 
     file.close()
 
     print( f"> PROCESSING TIME: {duration} ")
-    print( f"> ESTIMATED TIME : {tEstimate} s")
 
     return file.name
 
 
 
+######################################################
+#  Batch impact scores (calc_score) for many locations.
+#
+#  A variant pair names the layer variants which are scored as positive and negative layer,
+#  the distance statistics are the ones of calc_score. These pairs are not the weight
+#  profiles of geoqb_profiles, the profile weighted scores are computed by
+#  calc_profile_scores. The layers of all locations are fetched by a thread pool (the export
+#  is I/O bound), the scores are computed by a process pool. The result is one table with a
+#  row per location and pair, including the fetch and scoring time of each row.
+#
+SCORE_VARIANT_PAIRS = { "POS/NEG" : ( "POS", "NEG" ) }
+SCORE_FETCH_WORKERS = int( os.environ.get('GEOQB_SCORE_FETCH_WORKERS', 4) )
+SCORE_WORKERS = int( os.environ.get('GEOQB_SCORE_WORKERS', os.cpu_count() or 1) )
+
+
+def _coordinates( dfNodes ):
+    dfNodes = dfNodes[['lat','lon']].dropna( subset=['lat', 'lon'] )
+    return dfNodes['lat'].to_numpy( dtype=np.float64 ), dfNodes['lon'].to_numpy( dtype=np.float64 )
+
+
+def _fetchLocation( conn, graph_name, WORKPATH, location_name, variants ):
+    t0 = time.time()
+    layers = gqtg.getLayerVariants( conn, graph_name, WORKPATH=WORKPATH, overwrite=False, s1=location_name, variants=variants, verbose=False )
+    return { v : _coordinates( layers[v][0] ) for v in variants }, time.time() - t0
+
+
+def _scoreTask( task ):
+
+    location_name, pair, pos, neg, mode, samples, res = task
+
+    t0 = time.time()
+    allPoints = ( np.concatenate( [ pos[0], neg[0] ] ), np.concatenate( [ pos[1], neg[1] ] ) )
+
+    row = { "location" : location_name, "pair" : pair, "zPOS" : len( pos[0] ), "zNEG" : len( neg[0] ), "zALL" : len( allPoints[0] ) }
+
+    stats = { "pos" : distanceStats( *pos, mode=mode, samples=samples, res=res ),
+              "all" : distanceStats( *allPoints, mode=mode, samples=samples, res=res ),
+              "neg" : distanceStats( *neg, mode=mode, samples=samples, res=res ) }
+
+    allMAX = stats["all"]["max"]
+    for k, st in stats.items():
+        row[f"{k}M"] = st["mean"]
+        row[f"{k}M_allMAX"] = st["mean"] / allMAX if allMAX else float( "nan" )
+        row[f"{k}MAX"] = st["max"]
+        row[f"{k}Err"] = st["error"]
+        row[f"{k}Mode"] = st["mode"]
+
+    row["score_s"] = time.time() - t0
+    return row
+
+
+#
+# pairs: { name : ( positive variant, negative variant ) }, default SCORE_VARIANT_PAIRS
+# Returns the result table, it is written to <workspace>/sample_score/<fn> if fn is given.
+#
+def calc_variant_scores( location_names, conn, WORKPATH, graph_name, pairs=None, mode=None, samples=None, res=None,
+                         fetchWorkers=None, maxWorkers=None, fn=None, storage=None, verbose=True ):
+
+    pairs = pairs or SCORE_VARIANT_PAIRS
+    variants = tuple( sorted( { v for pair in pairs.values() for v in pair } ) )
+
+    t0 = time.time()
+
+    fetched = {}
+    failed = []
+
+    with ThreadPoolExecutor( max_workers=fetchWorkers or SCORE_FETCH_WORKERS ) as pool:
+        futures = { pool.submit( _fetchLocation, conn, graph_name, WORKPATH, loc, variants ) : loc for loc in location_names }
+        for f, loc in futures.items():
+            try:
+                fetched[loc] = f.result()
+            except Exception as e:
+                print( f"!!! Layers for {loc} could not be fetched: {e}" )
+                failed.append( { "location" : loc, "error" : str( e ) } )
+
+    if verbose:
+        print( f"> Layers of {len(fetched)} location(s) fetched in {time.time()-t0:.1f} s, {len(failed)} failed." )
+
+    tasks = [ ( loc, name, layers[pair[0]], layers[pair[1]], mode, samples, res )
+              for loc, ( layers, fetch_s ) in fetched.items()
+              for name, pair in pairs.items() ]
+
+    rows = []
+    with ProcessPoolExecutor( max_workers=maxWorkers or SCORE_WORKERS ) as pool:
+        for task, f in [ ( t, pool.submit( _scoreTask, t ) ) for t in tasks ]:
+            try:
+                row = f.result()
+            except Exception as e:
+                row = { "location" : task[0], "pair" : task[1], "error" : str( e ) }
+            row["fetch_s"] = fetched[task[0]][1]
+            rows.append( row )
+            if verbose:
+                print( f"> {row['location']} [{row['pair']}] : {row.get('posM')} / {row.get('allM')} / {row.get('negM')}" )
+
+    result = pd.DataFrame( rows + failed )
+
+    if fn is not None:
+        folder = os.path.join( gqws.getWorkspaceFolder(), "sample_score" )
+        os.makedirs( folder, exist_ok=True )
+        fn = gqws.writeFrame( result, os.path.join( folder, fn ), storage=storage )
+        if verbose:
+            print( f"> Scores for {len(location_names)} location(s) written to {fn}." )
+
+    if verbose:
+        print( f"> PROCESSING TIME: {time.time()-t0:.1f} s" )
+
+    return result
+
+
+
+######################################################
+#  Profile weighted scores per H3 cell.
+#
+#  The hasOSMTag edges of the layers are counted into a cell x layer matrix M (tagCount per
+#  edge). A profile is a weight vector with one weight per layer (category), all profiles are
+#  the columns of W and the scores of all cells for all profiles are M @ W.
+#
+#  categories: the layer of the k-th weight, a layer_id belongs to the first category it
+#              contains. Without categories every layer_id is its own category (sorted),
+#              calc_profile_scores uses the standard categories of gqprofiles.
+#
+
+def _edgeColumn( dfEdges, name ):
+    for c in ( "attributes." + name, name ):
+        if c in dfEdges.columns:
+            return dfEdges[c]
+    return pd.Series( [ None ] * len( dfEdges ), index=dfEdges.index )
+
+
+def layerCountMatrix( dfEdges, categories=None, edgeTypes=( "hasOSMTag", ) ):
+
+    e = dfEdges[ dfEdges["e_type"].isin( edgeTypes ) ] if len( dfEdges ) > 0 else dfEdges
+    layerIds = _edgeColumn( e, "layer_id" )
+    e = e[ layerIds.notna() ]
+    layerIds = layerIds[ layerIds.notna() ].astype( str )
+
+    if categories is None:
+        categories = sorted( layerIds.unique().tolist() )
+
+    if len( e ) == 0:
+        return pd.DataFrame( np.zeros( ( 0, len( categories ) ) ), index=pd.Index( [], name="h3index" ), columns=categories )
+
+    # the lookup runs once per layer_id, not per edge
+    uniqueIds = layerIds.unique()
+    lookup = {}
+    for lid in uniqueIds:
+        lookup[lid] = next( ( k for k, c in enumerate( categories ) if c in lid ), -1 )
+    col = layerIds.map( lookup ).to_numpy( dtype=np.int64 )
+
+    unmatched = [ lid for lid in uniqueIds if lookup[lid] < 0 ]
+    if len( unmatched ) > 0:
+        print( f"> {len(unmatched)} layer(s) without category are not scored: {unmatched[:5]}" )
+
+    cell = np.where( e["from_type"].to_numpy() == "h3place", e["from_id"].to_numpy(), e["to_id"].to_numpy() )
+    counts = pd.to_numeric( _edgeColumn( e, "tagCount" ), errors="coerce" ).fillna( 1.0 ).to_numpy( dtype=np.float64 )
+
+    keep = col >= 0
+    codes, cells = pd.factorize( cell[keep] )
+    K = len( categories )
+    M = np.bincount( codes * K + col[keep], weights=counts[keep], minlength=len( cells ) * K ).reshape( len( cells ), K )
+
+    return pd.DataFrame( M, index=pd.Index( cells, name="h3index" ), columns=categories )
+
+
+#
+# Accepts { key : weights }, { key : ( name, weights ) } (getStandardProfiles) or a list of
+# ( name, weights ) / defineProfilesFor tuples, returns { name : weights }.
+#
+def _profileWeights( profiles ):
+
+    items = profiles.items() if isinstance( profiles, dict ) else [ ( None, p ) for p in profiles ]
+
+    weights = {}
+    for key, p in items:
+        if isinstance( p, tuple ) and len( p ) == 6:
+            p = p[5]
+        if isinstance( p, tuple ) and len( p ) == 2 and isinstance( p[0], str ):
+            key, p = p
+        weights[key] = list( p )
+    return weights
+
+
+def profileScores( counts, profiles ):
+
+    weights = _profileWeights( profiles )
+
+    for name, w in weights.items():
+        if len( w ) != counts.shape[1]:
+            raise ValueError( f"Profile {name} has {len(w)} weights for {counts.shape[1]} layers {list(counts.columns)}." )
+
+    W = np.array( list( weights.values() ), dtype=np.float64 ).T
+    return pd.DataFrame( counts.to_numpy() @ W, index=counts.index, columns=list( weights.keys() ) )
+
+
+#
+# Scores of all cells of a location for all profiles (default: the standard profiles of
+# gqprofiles), with the cell centroids and the layer counts.
+#
+def calc_profile_scores( location_name, conn, WORKPATH, graph_name, profiles=None, categories=None, variants=( "POS", "NEG" ) ):
+
+    if profiles is None:
+        profiles = gqprofiles.getStandardProfiles()
+
+    layers = gqtg.getLayerVariants( conn, graph_name, WORKPATH=WORKPATH, overwrite=False, s1=location_name, variants=variants )
+    dfEdges = pd.concat( [ layers[v][1] for v in variants ], ignore_index=True )
+
+    if categories is None:
+        categories = gqprofiles.getStandardCategories()
+
+    counts = layerCountMatrix( dfEdges, categories )
+    scores = profileScores( counts, profiles )
 
+    lat, lon = gqh3.h3Centroids_batch( scores.index.to_series() )
+    result = pd.concat( [ scores, counts.add_prefix( "z_" ) ], axis=1 )
+    result.insert( 0, "lon", lon )
+    result.insert( 0, "lat", lat )
 
+    print( f"> {len(result)} cells of {location_name} scored for {scores.shape[1]} profile(s) over {counts.shape[1]} layer(s)." )
 
+    return result.reset_index()
@@ -43,7 +43,7 @@ def getDumpFileName( SUFFIX="" ):
 # The staged data file is used to blend the input data.
 # Small datasets can be handled easily with Pandas, and larger data will be processed via PySpqrk.
 #
-def getDataFrame_linked_by_h3Index( dfIndexesToEnrich, indexColumn="h3index", res=9, dumpFile=True, SUFFIX="-snip" ):
+def getDataFrame_linked_by_h3Index( dfIndexesToEnrich, indexColumn="h3index", res=9, dumpFile=True, SUFFIX="-snip", intCells=None ):
 
     print( dfIndexesToEnrich )
     FN = FULL_DS_STAGE_PATH + FILE_NAMES[0]
@@ -52,10 +52,22 @@ def getDataFrame_linked_by_h3Index( dfIndexesToEnrich, indexColumn="h3index", re
     print( enrichmentData )
 
     print( f">>> Calc h3index ...")
-    enrichmentData["h3index"] = enrichmentData.apply( lambda x : gqh3.h3Index_lat_lon_level_NO_LABEL( x["Lat"], x["Lon"], res ), axis = 1 )
-    print( enrichmentData )
-
-    joined = pd.merge( dfIndexesToEnrich, enrichmentData, left_on='Id', right_on='h3index' )
+    cells = gqh3.h3Index_batch( enrichmentData["Lat"].to_numpy(), enrichmentData["Lon"].to_numpy(), res, n_jobs=0 )
+
+    if gqh3.useIntCells( intCells ):
+        #
+        # join on uint64 cells, the string ids of the layer are kept for the upserts
+        #
+        if 'h3cell' not in dfIndexesToEnrich.columns:
+            dfIndexesToEnrich = dfIndexesToEnrich.assign( h3cell=gqh3.h3CellColumn( dfIndexesToEnrich['Id'], dfIndexesToEnrich['v_type'] ) )
+        enrichmentData["h3cell"] = cells
+        print( enrichmentData )
+        joined = pd.merge( dfIndexesToEnrich, enrichmentData, on='h3cell' )
+        joined["h3index"] = joined["Id"]
+    else:
+        enrichmentData["h3index"] = gqh3.h3CellsToStrings( cells )
+        print( enrichmentData )
+        joined = pd.merge( dfIndexesToEnrich, enrichmentData, left_on='Id', right_on='h3index' )
 
     print( f">>> Add Metadata ...")
     enrichmentData = joined.drop_duplicates(subset='h3index', keep="last")
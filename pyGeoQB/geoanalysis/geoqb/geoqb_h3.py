@@ -1,12 +1,29 @@
 from h3 import h3
+from h3.api import numpy_int as h3int
+
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
-import overpass
 import os
 
 overPass_URL1=os.environ.get('overpass_endpoint')
 
+#
+# The Overpass client is created on first use.
 # "https://overpass-api.de/api/interpreter"
-api = overpass.API(endpoint=overPass_URL1)
+#
+@lru_cache( maxsize=None )
+def getOverpassAPI():
+  import overpass
+  return overpass.API(endpoint=overPass_URL1)
+
+# gqh3.api still works, it is resolved by getOverpassAPI()
+def __getattr__( name ):
+  if name == "api":
+    return getOverpassAPI()
+  raise AttributeError( f"module {__name__} has no attribute {name}" )
 
 
 #
@@ -48,11 +65,122 @@ def lat_lon_from_h3Index( h, type, expected_type ):
         geo = ( None, None )
     return geo
 
+#
+# Memoized cell centroids.
+#
+# h3Centroid caches the (lat,lon) of a cell (hex string or uint64) in a bounded LRU.
+# h3Centroids_batch resolves each distinct cell of an array once and broadcasts the
+# coordinates back to all rows; rows with another vertex type get NaN.
+#
+H3_CENTROID_CACHE_SIZE = 262144
+
+@lru_cache( maxsize=H3_CENTROID_CACHE_SIZE )
+def h3Centroid( h ):
+    if isinstance( h, str ):
+        return h3.h3_to_geo( h )
+    return h3int.h3_to_geo( int( h ) )
+
+def h3Centroids_batch( indexes, types=None, expected_type="h3place" ):
+
+    indexes = pd.Series( indexes )
+
+    lat = np.full( len(indexes), np.nan )
+    lon = np.full( len(indexes), np.nan )
+
+    if types is not None:
+        mask = ( pd.Series( types ).to_numpy() == expected_type )
+    else:
+        mask = np.ones( len(indexes), dtype=bool )
+
+    codes, uniques = pd.factorize( indexes[mask] )
+
+    geo = np.array( [ h3Centroid( h ) for h in uniques.tolist() ], dtype=np.float64 ).reshape( -1, 2 )
+
+    lat[mask] = geo[codes, 0]
+    lon[mask] = geo[codes, 1]
+
+    return lat, lon
+
 def h3Index_lat_lon_level_NO_LABEL( lat, lon, resolution ):
   h3index = h3.geo_to_h3(lat, lon, resolution)
   return h3index
 
 
+#
+# Batch H3 indexing for arrays of coordinates.
+#
+# The cells are calculated with the integer API of h3, which avoids the string
+# formatting per point. Large inputs can be split into chunks which are processed
+# by a pool of worker processes (n_jobs > 1, n_jobs=0 uses all available cores).
+#
+H3_BATCH_CHUNK_SIZE = 250000
+
+def _h3Index_chunk( args ):
+    lats, lons, resolution = args
+    geo_to_h3 = h3int.geo_to_h3
+    return np.fromiter( ( geo_to_h3( la, lo, resolution ) for la, lo in zip( lats.tolist(), lons.tolist() ) ),
+                        dtype=np.uint64, count=len(lats) )
+
+def h3CellsToStrings( cells ):
+    cells = np.asarray( cells, dtype=np.uint64 )
+    # a layer has many rows per cell, each cell is formatted once
+    uniques, inverse = np.unique( cells, return_inverse=True )
+    return np.array( [ format( c, 'x' ) for c in uniques.tolist() ], dtype=object )[ inverse.reshape( -1 ) ]
+
+def h3StringsToCells( indexes ):
+    return np.fromiter( ( int( str( s ), 16 ) for s in indexes ), dtype=np.uint64, count=len(indexes) )
+
+#
+# Vertex ids exported from the graph mix h3place, osmplace and osmtag ids. Only
+# the h3place ids are converted, all other rows get the cell id 0.
+#
+def h3CellColumn( ids, types=None, expected_type="h3place" ):
+    ids = np.asarray( ids, dtype=object )
+    if types is None:
+        return h3StringsToCells( ids )
+    mask = np.asarray( types, dtype=object ) == expected_type
+    cells = np.zeros( len(ids), dtype=np.uint64 )
+    cells[mask] = h3StringsToCells( ids[mask] )
+    return cells
+
+#
+# Pipeline-wide switch to carry H3 cells as uint64 between the processing steps
+# (GEOQB_H3_INT_CELLS=true). Strings are only created at the TigerGraph / CSV boundary.
+#
+H3_INT_CELLS = str( os.environ.get('GEOQB_H3_INT_CELLS') ).lower() in ( "1", "true", "yes" )
+
+def useIntCells( intCells=None ):
+    if intCells is None:
+        return H3_INT_CELLS
+    return intCells
+
+def h3Index_batch( lats, lons, resolution, as_string=False, n_jobs=1, chunk_size=H3_BATCH_CHUNK_SIZE ):
+
+    lats = np.asarray( lats, dtype=np.float64 )
+    lons = np.asarray( lons, dtype=np.float64 )
+
+    if lats.shape != lons.shape:
+        raise ValueError( f"lat/lon arrays differ in shape: {lats.shape} vs. {lons.shape}" )
+
+    z = len(lats)
+
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+
+    if n_jobs == 1 or z <= chunk_size:
+        cells = _h3Index_chunk( ( lats, lons, resolution ) )
+    else:
+        chunks = [ ( lats[i:i+chunk_size], lons[i:i+chunk_size], resolution ) for i in range( 0, z, chunk_size ) ]
+        with ProcessPoolExecutor( max_workers=n_jobs ) as pool:
+            parts = list( pool.map( _h3Index_chunk, chunks ) )
+        cells = np.concatenate( parts ) if len(parts) > 0 else np.empty( 0, dtype=np.uint64 )
+
+    if as_string:
+        return h3CellsToStrings( cells )
+
+    return cells
+
+
 def get_listOfIndexes_zoom_in_N_neighbors( index, N, verbose=False):
 
     res = h3.h3_get_resolution(index)
@@ -103,7 +231,7 @@ def getLocationCoordinatesAndH3Index( location, resolution, verbose = False ):
 
   print( ">>> Location-Name to Coordinates Query via OverPass : " + location_nodeQuery )
 
-  response = api.get( location_nodeQuery )
+  response = getOverpassAPI().get( location_nodeQuery )
 
   #
   # What format is this?
@@ -130,80 +258,96 @@ def getLocationCoordinatesAndH3Index( location, resolution, verbose = False ):
 
 
 def getHexHistograms( data, resolution ):
-  X = data
-  z = len(X)
-
-  counts = {}
-  i = 0
-  for loc in X:
-    i = i + 1
-    #print( (str(i * 100.0 / z) + " % - ", loc ) )
-    index = h3Index_lat_lon_level( loc[1], loc[0], resolution )
-    INDEX = index.split("_")[1]
-    v = 1
-    if INDEX in counts.keys():
-      v = counts[INDEX]
-      v = v + 1
-    counts[INDEX] = v
+
+  counts = getHexCounters( data, resolutions=[resolution] )[resolution]
 
   print( resolution, len( counts ) )
-  return counts
+  return dict( zip( h3CellsToStrings( counts["h3index"].to_numpy() ), counts["z"].tolist() ) )
 
 
 
 def getLinks_and_Counters( coords_WithTags, resolution=6, verbose = False ):
 
-  links = {}
-  z = len(coords_WithTags)
-  #print( z )
-  #print( type(coords_WithTags) )
-
   if verbose:
     print(coords_WithTags)
-    #print( type( coords_WithTags ) )
 
-  counts = {}
-  i = 0
+  links, counts = getLinks_and_Counters_DF( coords_WithTags, resolutions=[resolution] )[resolution]
+
+  linkCells = h3CellsToStrings( links["h3index"].to_numpy() )
+  linksDict = dict( zip( zip( linkCells, links["osmtag"].astype(object) ), links["z"].tolist() ) )
+  countsDict = dict( zip( h3CellsToStrings( counts["h3index"].to_numpy() ), counts["z"].tolist() ) )
 
-  # XX = coords_WithTags.tolist()
-  XX = coords_WithTags
+  print( resolution, len( countsDict ) )
 
-  for loc in XX:
-      #print( "---" + str( loc ) + "---" )
-      #print( "***" + str(type( loc )) + "***" )
-      #print( "---" + str( loc ) + "---" )
-      i = i + 1
+  return linksDict, countsDict
 
-      #print( (str(i * 100.0 / z) + " % - ", loc ) )
-      index = h3Index_lat_lon_level( loc[1], loc[0], resolution )
-      INDEX = index.split("_")[1]
 
-      v = 1
-      if INDEX in counts.keys():
-        v = counts[INDEX]
-        v = v + 1
-        # print( "INDEX: " + INDEX)
+#
+# Single pass aggregation of (cell, tag) co-occurrences and per-cell counts.
+#
+# The tags are flattened and interned once, every requested resolution is indexed
+# with h3Index_batch (H3 cells do not nest exactly, so coarser cells are not derived
+# from the fine cells via h3_to_parent). Cells stay uint64 and tags are pandas
+# categoricals, so the resulting frames can be passed to links_to_DF directly.
+#
+# Returns { res : ( linksDF[h3index, osmtag, z], countsDF[h3index, z] ) }
+#
+def _cellsPerResolution( lats, lons, resolutions ):
+    return { res : h3Index_batch( lats, lons, res ) for res in sorted( set( resolutions ) ) }
 
-      counts[INDEX] = v
+def _countCells( cells ):
+    uniqueCells, z = np.unique( cells, return_counts=True )
+    return pd.DataFrame( { "h3index" : uniqueCells, "z" : z } )
 
-      #print( loc[2] )
-      #print( type(loc[2]) )
+def getHexCounters( coords, resolutions=(6,) ):
 
-      for tagKV in loc[2]:
+    lons = np.fromiter( ( float( loc[0] ) for loc in coords ), dtype=np.float64, count=len(coords) )
+    lats = np.fromiter( ( float( loc[1] ) for loc in coords ), dtype=np.float64, count=len(coords) )
 
-        tag = tagKV
-        # tag = tagKV+":"+loc[2][tagKV]   # works with OSM query data only ...
+    cells = _cellsPerResolution( lats, lons, resolutions )
 
-        k = (INDEX,tag)
-        z = 1
-        if k in links.keys():
-          z = links[k]
-          z = z + 1
-        links[k] = z
+    return { res : _countCells( cells[res] ) for res in cells }
 
-  print( resolution, len( counts ) )
+def getLinks_and_Counters_DF( coords_WithTags, resolutions=(6,) ):
+
+    z = len(coords_WithTags)
+
+    lons = np.empty( z, dtype=np.float64 )
+    lats = np.empty( z, dtype=np.float64 )
+    tagPoint = []
+    tagValues = []
+
+    for i, loc in enumerate( coords_WithTags ):
+        lons[i] = loc[0]
+        lats[i] = loc[1]
+        for tag in loc[2]:
+            tagPoint.append( i )
+            tagValues.append( tag )
+
+    tagPoint = np.asarray( tagPoint, dtype=np.int64 )
+    tagCodes, tagNames = pd.factorize( pd.Series( tagValues, dtype=object ) )
+
+    cells = _cellsPerResolution( lats, lons, resolutions )
+
+    result = {}
+    for res in cells:
+
+        counts = _countCells( cells[res] )
+
+        pairs = np.empty( len(tagPoint), dtype=[ ("h3index", np.uint64), ("tag", np.int64) ] )
+        pairs["h3index"] = cells[res][tagPoint]
+        pairs["tag"] = tagCodes
+        uniquePairs, pairCounts = np.unique( pairs, return_counts=True )
+
+        links = pd.DataFrame( {
+            "h3index" : uniquePairs["h3index"],
+            "osmtag" : pd.Categorical.from_codes( uniquePairs["tag"], categories=tagNames ),
+            "z" : pairCounts
+        } )
+
+        result[res] = ( links, counts )
 
-  return links, counts
+    return result
 
 
 def output_h3_id_attributes(h3_id):
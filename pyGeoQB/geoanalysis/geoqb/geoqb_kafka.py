@@ -3,6 +3,8 @@ import json
 import os
 import pandas as pd
 import sys
+import time
+import threading
 import flat_table
 
 
@@ -23,27 +25,138 @@ schema_registry_url=os.environ.get('schema_registry_url')
 basic_auth_credentials_source=os.environ.get('basic_auth_credentials_source')
 basic_auth_user_info=os.environ.get('basic_auth_user_info')
 
-# Create Producer instance
-producer = Producer({
-        'bootstrap.servers': bootstrap_servers,
-        'sasl.mechanisms': sasl_mechanisms,
-        'security.protocol': security_protocol,
-        'sasl.username': sasl_username,
-        'sasl.password': sasl_password
-})
+#
+# Producer batching: messages are collected for up to linger.ms and sent in compressed batches
+#
+PRODUCER_LINGER_MS = int( os.environ.get('GEOQB_KAFKA_LINGER_MS', 50) )
+PRODUCER_BATCH_BYTES = int( os.environ.get('GEOQB_KAFKA_BATCH_BYTES', 1024 * 1024) )
+PRODUCER_COMPRESSION = os.environ.get('GEOQB_KAFKA_COMPRESSION', 'lz4')
+PRODUCER_QUEUE_MESSAGES = int( os.environ.get('GEOQB_KAFKA_QUEUE_MESSAGES', 500000) )
+
+#
+# Clients are created on first use, importing this module does not connect to the cluster.
+#
+_producer = None
+_adminClient = None
+_clientsLock = threading.Lock()
+
+def getProducer():
+    global _producer
+    with _clientsLock:
+        if _producer is None:
+            _producer = Producer({
+                'bootstrap.servers': bootstrap_servers,
+                'sasl.mechanisms': sasl_mechanisms,
+                'security.protocol': security_protocol,
+                'sasl.username': sasl_username,
+                'sasl.password': sasl_password,
+                'linger.ms': PRODUCER_LINGER_MS,
+                'batch.size': PRODUCER_BATCH_BYTES,
+                'compression.type': PRODUCER_COMPRESSION,
+                'queue.buffering.max.messages': PRODUCER_QUEUE_MESSAGES
+            })
+        return _producer
+
+def getAdminClient():
+    global _adminClient
+    with _clientsLock:
+        if _adminClient is None:
+            _adminClient = AdminClient({
+                'bootstrap.servers': bootstrap_servers,
+                'sasl.mechanisms': 'PLAIN',
+                'security.protocol': 'SASL_SSL',
+                'sasl.username': sasl_username,
+                'sasl.password': sasl_password
+            })
+        return _adminClient
+
+# gqkafka.producer still works, it is resolved by getProducer()
+def __getattr__( name ):
+    if name == "producer":
+        return getProducer()
+    raise AttributeError( f"module {__name__} has no attribute {name}" )
 
-# Create Producer instance
 consumer = None
 
 
+#
+# Publishes ( key, value ) pairs, a value which is not a string is serialized as JSON.
+# Delivery reports are counted in a callback, the queue is flushed once at the end.
+# With flush=False the messages stay in the producer queue and go out with the next
+# batch (linger.ms), the counts only include the reports received so far.
+#
+def publishRecords( records, topic, verbose=True, flush=True ):
+
+    stats = { "topic" : topic, "produced" : 0, "delivered" : 0, "failed" : 0, "errors" : [] }
+
+    def onDelivery( err, msg ):
+        if err is not None:
+            stats["failed"] += 1
+            if len( stats["errors"] ) < 10:
+                stats["errors"].append( str( err ) )
+        else:
+            stats["delivered"] += 1
+
+    producer = getProducer()
+
+    t0 = time.time()
+
+    for key, value in records:
+        if not isinstance( value, str ):
+            value = json.dumps( value )
+        while True:
+            try:
+                producer.produce( topic, key=key, value=value, on_delivery=onDelivery )
+                break
+            except BufferError:
+                # local queue is full, wait for deliveries to make room
+                producer.poll( 0.5 )
+        stats["produced"] += 1
+        producer.poll( 0 )
+
+    if flush:
+        producer.flush()
+        # messages without a delivery report are lost as well
+        stats["failed"] += stats["produced"] - stats["delivered"] - stats["failed"]
+
+    stats["seconds"] = time.time() - t0
+
+    if verbose:
+        print( f">>> {stats['delivered']} of {stats['produced']} messages delivered to topic {topic} in {stats['seconds']:.2f} s, {stats['failed']} failed." )
+        for e in stats["errors"]:
+            print( f"  ! {e}" )
+
+    return stats
+
+
+#
+# The rows of a DataFrame as JSON messages, keyed by the column keyColumn.
+#
+def publishDataFrame( df, topic, keyColumn='id', verbose=True ):
+    values = df.to_json( orient='records', lines=True ).splitlines()
+    keys = df[keyColumn].astype( str ).tolist() if keyColumn in df.columns else [ None ] * len( df )
+    return publishRecords( zip( keys, values ), topic, verbose=verbose )
+
+
 #
 # This function exports the OSM nodes data into a Kafka topic.
 #
-def publishToTopic(row, topic):
+# A single row is only queued, it is sent with the next producer batch. Callers which
+# publish row by row call flushProducer() at the end, a DataFrame is published and flushed
+# in one call.
+#
+def publishToTopic(row, topic, verbose=False):
+  if isinstance( row, pd.DataFrame ):
+      return publishDataFrame( row, topic, verbose=verbose )
   json_vdata = json.dumps( row.to_dict() )
   print( json_vdata )
-  producer.produce(topic, key=str(row['id']), value=json_vdata )
-  producer.flush()
+  return publishRecords( [ ( str(row['id']), json_vdata ) ], topic, verbose=verbose, flush=False )
+
+
+def flushProducer( timeout=None ):
+  if _producer is None:
+      return 0
+  return _producer.flush() if timeout is None else _producer.flush( timeout )
 
 
 
@@ -55,13 +168,7 @@ def getTopicsForPrefix( prefix ):
      https://github.com/confluentinc/confluent-kafka-python/blob/master/examples/adminapi.py
      """
 
-    a = AdminClient({
-        'bootstrap.servers': bootstrap_servers,
-        'sasl.mechanisms': 'PLAIN',
-        'security.protocol': 'SASL_SSL',
-        'sasl.username': sasl_username,
-        'sasl.password': sasl_password
-    })
+    a = getAdminClient()
 
     t=[]
 
@@ -84,21 +191,33 @@ def getTopicsForPrefix( prefix ):
 
 
 
-def readAndPrint_N_messages_from_topic( topic, N ):
-
-    topics = [ topic ]
+#
+# Consumer with manual offset commits, extra settings override the defaults
+# (e.g. bootstrap.servers of a local broker).
+#
+def createConsumer( client_id='geoqb_blender_tool', group_id='geoqb_blender_tool_cg_01', **settings ):
 
-    consumer = Consumer( {
+    config = {
         'bootstrap.servers': bootstrap_servers,
         'sasl.mechanisms': sasl_mechanisms,
         'security.protocol': security_protocol,
         'sasl.username': sasl_username,
         'sasl.password': sasl_password,
-        'client.id':'geoqb_blender_tool',
-        'group.id':'geoqb_blender_tool_cg_01',
+        'client.id': client_id,
+        'group.id': group_id,
         'enable.auto.commit': False,
         'auto.offset.reset': 'earliest'
-    })
+    }
+    config.update( { k.replace( "_", "." ) : v for k, v in settings.items() } )
+
+    return Consumer( { k : v for k, v in config.items() if v is not None } )
+
+
+def readAndPrint_N_messages_from_topic( topic, N ):
+
+    topics = [ topic ]
+
+    consumer = createConsumer()
 
     consumer.subscribe( topics )
 
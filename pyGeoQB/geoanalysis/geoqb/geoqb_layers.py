@@ -8,6 +8,20 @@ import geoanalysis.geoqb.geoqb_plots as gqplots
 
 import geoanalysis.geoqb.geoqb_osm_pandas as gqosm
 
+import geoanalysis.geoqb.geoqb_workspace as gqws
+
+import geoanalysis.geoqb.geoqb_tiling as gqtiling
+
+import geoanalysis.geoqb.geoqb_tg_loader as gqtgloader
+
+import geoanalysis.geoqb.geoqb_tg as gqtg
+
+import geoanalysis.geoqb.geoqb_tg_queries as gqqueries
+
+import geoanalysis.geoqb.geoqb_query_cache as gqcache
+
+import os
+
 import json
 
 import pandas as pd
@@ -108,7 +122,7 @@ SELECT ?osmid ?distance ?loc ?tag ?osmt WHERE {
 #
 # All data by tags... Sophox
 #
-def getGenericTagsQuery( center, location_name, l, tag_cat, tags, query_label ):
+def getGenericTagsQuery( center, location_name, l, tag_cat, tags, query_label, radius="15" ):
     r = l * 0.5
     lon_lat = str(center[1])+" "+str(center[0])
     q1='''
@@ -118,10 +132,10 @@ SELECT ?osmid ?distance ?loc ?tag WHERE {
   SERVICE wikibase:around { 
       ?osmid osmm:loc ?loc . 
       bd:serviceParam wikibase:center "Point(___lon_lat___)"^^geo:wktLiteral . 
-      bd:serviceParam wikibase:radius "15" . 
+      bd:serviceParam wikibase:radius "___radius___" . 
       bd:serviceParam wikibase:distance ?distance .
   } 
-  FILTER(?distance < 15)
+  FILTER(?distance < ___radius___)
 } 
     '''
 
@@ -131,6 +145,7 @@ SELECT ?osmid ?distance ?loc ?tag WHERE {
         tagsLine = "VALUES ?tag { ___tags___ }".replace("___tag_cat___",tag_cat).replace("___tags___" , tags)
 
     query = q1.replace("___lon_lat___", lon_lat)
+    query = query.replace("___radius___", str(radius))
     query = query.replace("___VALUES___", tagsLine)
     query = query.replace("___tag_cat___", tag_cat)
 
@@ -430,26 +445,27 @@ class LayerSpecification:
         return self.query, self.title, self.qn
 
     def getJSONDataFromWeb(self, path_offset):
-        return gqplots.reloadOrDumpNamedQueryAsJSON( self.query, self.qn, self.title, path_offset, self.fnRawOSMResponse, forceReload=True )
+        return gqplots.reloadOrDumpNamedQueryAsJSON( self.query, self.qn, self.title, path_offset, self.fnRawOSMResponse, forceReload=True, useCache=False )
 
     def getJSONData(self, path_offset, forceReload=True):
-        return gqplots.reloadOrDumpNamedQueryAsJSON( self.query, self.qn, self.title, path_offset, self.fnRawOSMResponse, forceReload=True )
+        return gqplots.reloadOrDumpNamedQueryAsJSON( self.query, self.qn, self.title, path_offset, self.fnRawOSMResponse, forceReload=forceReload )
 
     def plotLayerData(self, path_offset):
         self.jsonData = self.getJSONData(path_offset)
         self.coords = gqplots.plotNamedQuery( self.jsonData, self.qn, self.title, path_offset=path_offset )
         return self.coords
 
-    def persistDataFrames(self, path_offset):
+    def persistDataFrames(self, path_offset, intCells=None, storage=None):
 
         #print( "*#-> 0")
-        self.links, self.tag_counts = gqh3.getLinks_and_Counters( coords_WithTags = self.coords, resolution=self.zoom )
+        self.links, self.tag_counts = gqh3.getLinks_and_Counters_DF( coords_WithTags = self.coords, resolutions=[self.zoom] )[self.zoom]
         #print(self.links )
         #print(self.tag_counts )
 
         print( "> 1 - START")
         #print( path_offset )
-        h3places_nodes = gqosm.nodes_to_DF( self.coords , self.fnPlaces, path_offset, resolution=self.zoom )
+        h3places_nodes = gqosm.nodes_to_DF( self.coords , self.fnPlaces, path_offset, resolution=self.zoom, intCells=intCells, storage=storage )
+        self.persisted = { path_offset + self.fnPlaces : h3places_nodes }
         print( "> 1 - END")
 
 
@@ -482,7 +498,7 @@ class LayerSpecification:
 
         print( "> 2 - START")
 
-        gqosm.links_to_DF( self.links, self.fnLinks, path_offset, layer_id=self.qn )
+        self.persisted[ path_offset + self.fnLinks ] = gqosm.links_to_DF( self.links, self.fnLinks, path_offset, layer_id=self.qn, intCells=intCells, storage=storage )
 
         print( "> 2 - END")
 
@@ -540,86 +556,125 @@ class LayerSpecification:
             print( self.toJSON() )
         f.close()
 
-    def stageLayerDataInTigerGraph(self, path_offset, conn):
+    #
+    # The frames written by persistDataFrames are reused, other runs read the files. The cells
+    # are uint64 with intCells and strings otherwise, a file with the other type is converted once.
+    #
+    def _stagedFrame(self, fn, intCells, storage):
 
-        print(">>> Places: "+path_offset + self.fnPlaces)
-        places = pd.read_csv(path_offset + self.fnPlaces)
-        expected_type = "h3place"
-        places ['latCell'] = places.apply( lambda x : gqh3.lat_lon_from_h3Index2( x["h3index"] )[0], axis = 1 )
-        places ['lonCell'] = places.apply( lambda x : gqh3.lat_lon_from_h3Index2( x["h3index"] )[1], axis = 1 )
+        df = getattr( self, "persisted", {} ).get( fn )
+        if df is None:
+            df = gqws.readFrame( fn, dtype={'h3index':str}, storage=storage )
+        df = df.copy()
 
+        if intCells and df['h3index'].dtype != 'uint64':
+            df['h3index'] = gqh3.h3StringsToCells( df['h3index'] )
+        elif not intCells and df['h3index'].dtype == 'uint64':
+            df['h3index'] = gqh3.h3CellsToStrings( df['h3index'].to_numpy() )
 
-#
-        #  only h3Places are loaded ... OSM-tags are added to the h3Place!!!
-        #
-        zN1 = conn.upsertVertexDataFrame(
-            df=places, vertexType='h3place', v_id='h3index',
-            attributes={'resolution':'res','lat':'latCell','lon':'lonCell' })
+        return df
 
-        zN2 = conn.upsertVertexDataFrame(
-            df=places, vertexType='osmplace', v_id='osmid',
-            attributes={ 'lat':'lat','lon':'lon'})
+    def stageLayerDataInTigerGraph(self, path_offset, conn, intCells=None, storage=None, chunkSize=None, maxWorkers=None, mode=None):
 
-        print(">>> Links : "+path_offset + self.fnLinks)
-        tagLinks = pd.read_csv( path_offset + self.fnLinks )
+        intCells = gqh3.useIntCells( intCells )
 
+        print(">>> Places: "+path_offset + self.fnPlaces)
+        placeCells = self._stagedFrame( path_offset + self.fnPlaces, intCells, storage )
+
+        print(">>> Links : "+path_offset + self.fnLinks)
+        linkCells = self._stagedFrame( path_offset + self.fnLinks, intCells, storage )
 
         #
-        #  only edges are loaded...
+        # strings are only created for the upserts, the verification joins on the cells as they are
         #
-        zE1 = conn.upsertEdgeDataFrame(
-          df=tagLinks,
-          sourceVertexType='osmtag',
-          edgeType='hasOSMTag',
-          targetVertexType='h3place',
-          from_id='osmtag',
-          to_id='h3index',
-          attributes={'tagCount':'z', 'layer_id':'layer_id'} )
+        if intCells:
+            places = placeCells.assign( h3index=gqh3.h3CellsToStrings( placeCells['h3index'].to_numpy() ) )
+            tagLinks = linkCells.assign( h3index=gqh3.h3CellsToStrings( linkCells['h3index'].to_numpy() ) )
+        else:
+            places, tagLinks = placeCells, linkCells
 
+        places ['latCell'], places ['lonCell'] = gqh3.h3Centroids_batch( placeCells["h3index"] )
         places['layer_id'] = self.qn
 
-        zE2 = conn.upsertEdgeDataFrame(
-            df=places,
-            sourceVertexType='osmplace',
-            edgeType='located_on_h3_cell',
-            targetVertexType='h3place',
-            from_id='osmid',
-            to_id='h3index',
-            attributes={ 'layer_id':'layer_id' } )
+        #
+        #  only h3Places are loaded ... OSM-tags are added to the h3Place!!!
+        #  the edges are loaded after the vertices they point to
+        #
+        jobs = [
+            gqtgloader.vertexJob( "h3place", places, vertexType='h3place', v_id='h3index',
+                                  attributes={'resolution':'res','lat':'latCell','lon':'lonCell' } ),
+            gqtgloader.vertexJob( "osmplace", places, vertexType='osmplace', v_id='osmid',
+                                  attributes={ 'lat':'lat','lon':'lon'} ),
+            gqtgloader.vertexJob( "osmtag", tagLinks[['osmtag']].drop_duplicates(), vertexType='osmtag', v_id='osmtag',
+                                  attributes={ 'tagname':'osmtag' } ),
+            gqtgloader.edgeJob( "hasOSMTag", tagLinks,
+                                sourceVertexType='osmtag', edgeType='hasOSMTag', targetVertexType='h3place',
+                                from_id='osmtag', to_id='h3index',
+                                attributes={'tagCount':'z', 'layer_id':'layer_id'},
+                                dependsOn=[ "h3place", "osmtag" ] ),
+            gqtgloader.edgeJob( "located_on_h3_cell", places,
+                                sourceVertexType='osmplace', edgeType='located_on_h3_cell', targetVertexType='h3place',
+                                from_id='osmid', to_id='h3index',
+                                attributes={ 'layer_id':'layer_id' },
+                                dependsOn=[ "h3place", "osmplace" ] )
+        ]
 
+        #
+        #  the layer index links the layer to its cells, the layer is extracted from there
+        #
+        if gqqueries.hasLayerIndex( conn ):
+            layer = pd.DataFrame( { 'layer_id' : [ self.qn ], 'location' : [ self.location_name ] } )
+            members = pd.DataFrame( { 'h3index' : pd.concat( [ places['h3index'], tagLinks['h3index'] ] ).unique() } )
+            members['layer_id'] = self.qn
+            jobs.append( gqtgloader.vertexJob( "osmlayer", layer, vertexType='osmlayer', v_id='layer_id',
+                                               attributes={ 'layer_id':'layer_id', 'location':'location' } ) )
+            jobs.append( gqtgloader.edgeJob( "layer_member", members,
+                                             sourceVertexType='osmlayer', edgeType='layer_member', targetVertexType='h3place',
+                                             from_id='layer_id', to_id='h3index', attributes={},
+                                             dependsOn=[ "h3place", "osmlayer" ] ) )
 
-        print( "UPLOAD STATS: " + str( zN1 ) + " - " + str( zN2 ) + " nodes, " + str(zE1) + " - " + str( zE2 ) + " edges. " )
+        target = gqtgloader.getIngestTarget( conn, gqtg.OSM_GLOBAL_TYPES_GSQL, mode=mode, session=gqtg.getKeepAliveSession() )
+        stats = gqtgloader.upsertJobs( target, jobs, chunkSize=chunkSize, maxWorkers=maxWorkers )
+        zN1, zN2, zN3, zE1, zE2 = [ s["upserted"] for s in stats[:5] ]
 
-        gqosm.verifyNodeAndLinks( places , tagLinks, True )
+        print( "UPLOAD STATS: " + str( zN1 ) + " - " + str( zN2 ) + " - " + str( zN3 ) + " nodes, " + str(zE1) + " - " + str( zE2 ) + " edges. " )
 
+        gqosm.verifyNodeAndLinks( placeCells , linkCells, True )
 
 
 
-    def stageLayerDataInKafkaTopic(self, path_offset = ".", topic_name = "OSM_nodes_stage" ):
 
-        data = self.getJSONData( path_offset );
+    #
+    # ( key, record ) pairs for the OSM nodes of the layer, records carry the layer metadata.
+    #
+    def iterKafkaRecords(self, path_offset = "." ):
 
-        kdata = {}
-        kdata['location_name'] = self.location_name
-        kdata['query'] = self.query
-        kdata['run_id'] = self.run_id
+        data = self.getJSONData( path_offset, forceReload=False )
 
-        json_kdata = json.dumps(kdata)
+        if isinstance( data, tuple ):
+            # Sophox layers return the name of the dump file
+            elements = gqsophox.iterSophoxRecords( data[1] )
+        else:
+            elements = ( e for e in data['elements'] if e['type'] == 'node' )
+
+        for e in elements:
+            record = dict( e )
+            record['location_name'] = self.location_name
+            record['layer'] = self.qn
+            record['run_id'] = self.run_id
+            yield ( str( e.get( 'id', e.get( 'osmid' ) ) ), record )
 
-        vdata = {}
-        vdata['location_name'] = self.location_name
-        vdata['query'] = self.query
-        vdata['z'] = len(data)
-        vdata['json_data'] = data
-        vdata['md'] = self.toJSON()
+    def stageLayerDataInKafkaTopic(self, path_offset = ".", topic_name = "OSM_nodes_stage" ):
 
-        json_vdata = json.dumps(vdata)
+        import geoanalysis.geoqb.geoqb_kafka as gqk
 
         print( self )
+
+        stats = gqk.publishRecords( self.iterKafkaRecords( path_offset ), topic_name )
+
         print( ">>> Uploaded to Kafka topic ... " + topic_name )
 
-        # gqk.producer.produce( topic_name, key=json_kdata, value=json_vdata )
-        # gqk.producer.flush()
+        return stats
 
     def setLayerWeight(self, weight ):
         self.layerWeight = weight
@@ -705,47 +760,28 @@ class SophoxLayer(LayerSpecification):
 
     def getTagCoordsFromJSON( self, fn, dryRun = False, verbose = False ):
 
-        coords = []
-
         if dryRun:
             print( "*** DRYRUN-MODE: SKIP Loading JSON data from FILENAME: " + fn )
-            return coords
+            return []
 
         print( "*** Load JSON data from FILENAME: " + fn )
 
-        f = open( fn )
-        data = json.load( f )
-
-        # print( ">>> DATA: <<<"  )
-        # print( len(data) )
-        # print( "###***^^^")
+        coords = list( self.iterTagCoordsFromJSON( fn ) )
 
         if verbose:
-            print( data )
-            print( len(data) )
-
-        for record in data:
-            #print( record )
-            #print( len(record) )
-            #print( type(record) )
-            p = record['loc']
-            if p is not None:
-                z=len(p)
-                #print( type(p) )
-                point = p[6:z-1]
-                co = point.split(" ")
-                tag = record['tag']
-                osmid = record['osmid']
-                # amenity = record['amenity']
-                lon = co[0]
-                lat = co[1]
-                tags = []
-                tags.append( tag )
-                coords.append( ( float(lon), float(lat), tags, osmid) )
-
-        #print( coords )
+            print( coords )
+            print( len(coords) )
+
         return coords
 
+    #
+    # The Sophox dump is parsed as a stream of records, the coordinates come in batches.
+    #
+    def iterTagCoordsFromJSON( self, fn ):
+        for lon, lat, tag, osmid in gqsophox.iterSophoxCoordBatches( fn ):
+            for co in zip( lon.tolist(), lat.tolist(), tag.tolist(), osmid.tolist() ):
+                yield ( co[0], co[1], [ co[2] ], co[3] )
+
     def printQueryStack(self, file ):
         file.write( "#\n# " + self.qn + "\n#\n")
         file.write( "#defaultView:Map" )
@@ -755,6 +791,63 @@ class SophoxLayer(LayerSpecification):
 
 
 
+#
+# A Sophox layer for large areas (e.g. a federal state). The region around the center
+# with radius l/2 km is split into H3 tiles which are queried in parallel, see geoqb_tiling.
+#
+class TiledSophoxLayer(SophoxLayer):
+
+    def setTiling(self, targetCount=gqtiling.TILE_TARGET_COUNT, maxWorkers=gqtiling.TILE_MAX_WORKERS, resolution=None ):
+        self.tileTargetCount = targetCount
+        self.tileMaxWorkers = maxWorkers
+        self.tileResolution = resolution
+
+    def setSelectionFilter(self, query_label = "LABEL", tag_cat = "amenity", tags='"kindergarten"' ):
+        super().setSelectionFilter( query_label=query_label, tag_cat=tag_cat, tags=tags )
+        self.tag_cat = tag_cat
+        self.tags = tags
+
+    #
+    # The tile file name contains a hash of the query, a dump of the same cell with another
+    # LIMIT or radius is not reused.
+    #
+    def fetchTile(self, path_offset, cell, radius_km, limit, forceReload=False ):
+        query, title, qn = getGenericTagsQuery( gqh3.lat_lon_from_h3Index2( cell ), self.location_name, self.l, self.tag_cat, self.tags, self.qn, radius=round( radius_km, 3 ) )
+        query = query + "LIMIT " + str(limit) + "\n"
+        queryHash = gqcache.getQueryKey( query, "" )[:16]
+        fnTile = "raw/tiles/" + self.qn + "_" + cell + "_" + queryHash + "_raw_sophox.json"
+        data, fn = gqsophox.reloadOrDumpNamedQueryAsJSON( query, qn + "_" + cell, title, path_offset, fnTile, forceReload=forceReload, dryRun=False )
+        return list( gqsophox.iterSophoxRecords( fn ) )
+
+    def getJSONData(self, path_offset, forceReload=True, dryRun = False ):
+
+        fileName = path_offset + "/" + self.fnRawSophoxResponse
+
+        if dryRun:
+            return "", fileName
+
+        if not forceReload and os.path.exists( fileName ):
+            print("***### Load data from Sophox-Dump-File: " + fileName + ".")
+            return "---DATA---", fileName
+
+        if not hasattr( self, "tileTargetCount" ):
+            self.setTiling()
+
+        os.makedirs( path_offset + "/raw/tiles", exist_ok=True )
+
+        records = gqtiling.fetchTiledRecords(
+            self.center, self.l * 0.5,
+            lambda cell, radius_km, limit: self.fetchTile( path_offset, cell, radius_km, limit, forceReload=forceReload ),
+            targetCount=self.tileTargetCount, resolution=self.tileResolution, maxWorkers=self.tileMaxWorkers )
+
+        f = open( fileName, "w" )
+        json.dump( records, f )
+        f.close()
+
+        return "---DATA---", fileName
+
+
+
 class MultiSophoxLayer(SophoxLayer):
 
     def addQueryToStack( self, key, query ):
@@ -775,12 +868,11 @@ class MultiSophoxLayer(SophoxLayer):
     def addSheet( self, sheet, path_offset ):
         temp = copy.deepcopy(sheet)
         data, fn = temp.getJSONData( path_offset, forceReload=False )
-        self.addTagCoords( sheet.getTagCoordsFromJSON( fn ) )
+        self.addTagCoords( sheet.iterTagCoordsFromJSON( fn ) )
         self.addQueryToStack( sheet.qn, sheet.query )
 
     def addTagCoords( self , coords ):
-        for co in coords:
-            self.coordsAll.append( co )
+        self.coordsAll.extend( coords )
 
     def getTagCoordsFromJSON( self ):
         return self.coordsAll
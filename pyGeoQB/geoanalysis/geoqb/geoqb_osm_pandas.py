@@ -1,6 +1,7 @@
 import osmium as osm
 import pandas as pd
 import geoanalysis.geoqb.geoqb_h3 as gqh3
+import geoanalysis.geoqb.geoqb_workspace as gqws
 import time
 import json
 import overpass
@@ -96,7 +97,7 @@ def keep_osm_data_n( fn_n ):
   df_osm = df_osm.sort_values(by=['type', 'id', 'ts'])
   df_osm['lat'] = df_osm['location'].apply( lambda x: x.lat )
   df_osm['lon'] = df_osm['location'].apply( lambda x: x.lon )
-  df_osm['h3'] = df_osm['location'].apply( gqh3.h3Index)
+  df_osm['h3'] = "h3(10)_" + pd.Series( gqh3.h3Index_batch( df_osm['lat'].to_numpy(), df_osm['lon'].to_numpy(), 10, as_string=True ), index=df_osm.index )
   #print( df_osm )
   #print( df_osm.iloc[0])
   return df_osm
@@ -224,6 +225,9 @@ def keep_osm_data_w( fn_w ):
 
 def dumpPOIsIntoXMLandKafka(location_name, l, ts, run_id, zoom, topicQMD, path_offset):
 
+  # Kafka is only needed here, the module works without confluent_kafka
+  import geoanalysis.geoqb.geoqb_kafka as gqk
+
   lat, lon, myBBCenter_h3index, q, r = gqh3.getLocationCoordinatesAndH3Index( location_name, zoom)
   center = (lat,lon)
 
@@ -266,6 +270,9 @@ def dumpPOIsIntoXMLandKafka(location_name, l, ts, run_id, zoom, topicQMD, path_o
   vdata = {}
   vdata['runId'] = run_id
 
+  # query metadata, published in one batch after the three queries
+  records = []
+
   # https://wiki.openstreetmap.org/wiki/Overpass_API
 
   #
@@ -278,7 +285,7 @@ def dumpPOIsIntoXMLandKafka(location_name, l, ts, run_id, zoom, topicQMD, path_o
   vdata['query'] = query
   vdata['z'] = len(node_data)
   json_vdata = json.dumps(vdata)
-  gqk.producer.produce(topicQMD, key=json_kdata, value=json_vdata )
+  records.append( ( json_kdata, json_vdata ) )
   print( len(node_data) )
   #
   # files go into folder /content ...
@@ -298,7 +305,7 @@ def dumpPOIsIntoXMLandKafka(location_name, l, ts, run_id, zoom, topicQMD, path_o
   vdata['query'] = query
   vdata['z'] = len(way_data)
   json_vdata = json.dumps(vdata)
-  gqk.producer.produce(topicQMD, key=json_kdata, value=json_vdata )
+  records.append( ( json_kdata, json_vdata ) )
   print( len(way_data) )
   #
   # files go into folder /content ...
@@ -319,7 +326,7 @@ def dumpPOIsIntoXMLandKafka(location_name, l, ts, run_id, zoom, topicQMD, path_o
   vdata['query'] = query
   vdata['z'] = len(relation_data)
   json_vdata = json.dumps(vdata)
-  gqk.producer.produce(topicQMD, key=json_kdata, value=json_vdata )
+  records.append( ( json_kdata, json_vdata ) )
   print( len(relation_data) )
   #
   # files go into folder /content ...
@@ -331,30 +338,48 @@ def dumpPOIsIntoXMLandKafka(location_name, l, ts, run_id, zoom, topicQMD, path_o
 
   #keep_osm_data_r( fn_r )
 
+  gqk.publishRecords( records, topicQMD )
+
   time.sleep(2)
 
 
 
 
-def links_to_DF( links, fn, path_offset, layer_id ):
+def links_to_DF( links, fn, path_offset, layer_id, intCells=None, storage=None ):
 
-  #print( type(links) )
-  #print( len(links))
+  #
+  # links is either the legacy dict {(h3index,osmtag):z} or the columnar frame
+  # created by gqh3.getLinks_and_Counters_DF
+  #
+  if isinstance( links, pd.DataFrame ):
+    linksDF = links[['h3index', 'osmtag', 'z']].copy()
+    linksDF['layer_id'] = layer_id
+  else:
+    links2=[]
 
-  links2=[]
+    for l in links:
+      links2.append( (l[0],l[1],links[l],layer_id) )
 
-  for l in links:
-    #print( l, links[l] )
-    links2.append( (l[0],l[1],links[l],layer_id) )
+    linksDF = pd.DataFrame.from_records(links2, columns=['h3index', 'osmtag', 'z', 'layer_id'])
 
-  linksDF = pd.DataFrame.from_records(links2, columns=['h3index', 'osmtag', 'z', 'layer_id'])
+  intCells = gqh3.useIntCells( intCells )
 
-  linksDF.to_csv( path_offset + fn, index=False)
+  if intCells and linksDF['h3index'].dtype != 'uint64':
+    linksDF['h3index'] = gqh3.h3StringsToCells( linksDF['h3index'] )
+  elif not intCells and linksDF['h3index'].dtype == 'uint64':
+    linksDF['h3index'] = gqh3.h3CellsToStrings( linksDF['h3index'].to_numpy() )
+
+  #
+  # a CSV file always contains the H3 cells as strings, Parquet keeps the uint64 cells
+  #
+  gqws.writeFrame( linksDF, path_offset + fn, storage=storage, metadata={ 'layer_id' : layer_id } )
+
+  return linksDF
 
 
 import pandas as pd
 
-def nodes_to_DF( X, fn, path_offset, resolution ):
+def nodes_to_DF( X, fn, path_offset, resolution, intCells=None, storage=None ):
 
   #print( type(X) )
   #print( len(X) )
@@ -362,7 +387,11 @@ def nodes_to_DF( X, fn, path_offset, resolution ):
 
   df = pd.DataFrame(X, columns = ["lon","lat","tags","osmid"])
 
-  df["h3index"] = df.apply( lambda x : gqh3.h3Index_lat_lon_level_NO_LABEL( x["lat"], x["lon"], resolution ), axis = 1 )
+  cells = gqh3.h3Index_batch( df["lat"].to_numpy(), df["lon"].to_numpy(), resolution )
+  if gqh3.useIntCells( intCells ):
+    df["h3index"] = cells
+  else:
+    df["h3index"] = gqh3.h3CellsToStrings( cells )
   df["res"] = resolution
 
   print(df)
@@ -370,7 +399,8 @@ def nodes_to_DF( X, fn, path_offset, resolution ):
   #print(df.columns)
 
   df = df[["h3index","res","lat","lon","osmid" ]]
-  df.to_csv( path_offset + fn, index=False)
+  gqws.writeFrame( df, path_offset + fn, storage=storage, metadata={ 'resolution' : resolution } )
+
   return df
 
 
@@ -379,6 +409,14 @@ def nodes_to_DF( X, fn, path_offset, resolution ):
 
 def verifyNodeAndLinks( dfNodes, dfTagLinks, verbose=False ):
 
+  #
+  # join on uint64 cells if one side carries them already
+  #
+  if dfNodes['h3index'].dtype == 'uint64' and dfTagLinks['h3index'].dtype != 'uint64':
+    dfTagLinks = dfTagLinks.assign( h3index=gqh3.h3StringsToCells( dfTagLinks['h3index'] ) )
+  elif dfTagLinks['h3index'].dtype == 'uint64' and dfNodes['h3index'].dtype != 'uint64':
+    dfNodes = dfNodes.assign( h3index=gqh3.h3StringsToCells( dfNodes['h3index'] ) )
+
   dfNodes = dfNodes.drop_duplicates(subset=['h3index'])
   index = dfNodes.index
   number_of_rows = len(index)
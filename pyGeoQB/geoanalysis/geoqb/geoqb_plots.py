@@ -8,6 +8,8 @@ import matplotlib.pyplot as plt
 import requests
 import json
 
+import geoanalysis.geoqb.geoqb_query_cache as gqcache
+
 
 def visualize_hexagons(hexagons, zoom=6 , color="red", folium_map=None):
 
@@ -227,7 +229,11 @@ def plotBoundingBoxPOIs( path_offset, run_id, coords, title, bins ):
   plt.close( fig )
 
 
-def reloadOrDumpNamedQueryAsJSON( query, nq, title, path_offset, fnRawOSMResponse, forceReload=True ):
+#
+# forceReload skips the dump file of the named query, the query cache is still used
+# for identical queries unless useCache is False.
+#
+def reloadOrDumpNamedQueryAsJSON( query, nq, title, path_offset, fnRawOSMResponse, forceReload=True, useCache=True ):
 
     data = ""
 
@@ -257,6 +263,14 @@ def reloadOrDumpNamedQueryAsJSON( query, nq, title, path_offset, fnRawOSMRespons
     #overpass_url = "http://overpass-api.de/api/interpreter"
     overpass_url = "https://overpass.kumi.systems/api/interpreter"
 
+    cache = gqcache.getQueryCache( path_offset )
+
+    if useCache and cache.getInto( query, overpass_url, fileName ):
+        print("Load data from query cache into File: " + fileName + ".")
+        with open(fileName) as json_file:
+            data = json.load(json_file)
+        return data
+
     print( query )
     print( nq )
     print( title )
@@ -273,6 +287,8 @@ def reloadOrDumpNamedQueryAsJSON( query, nq, title, path_offset, fnRawOSMRespons
     json.dump(data, f2)
     f2.close()
 
+    cache.putFile( query, overpass_url, fileName, data=data )
+
     return data
 
 
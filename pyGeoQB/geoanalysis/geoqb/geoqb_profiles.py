@@ -4,6 +4,10 @@ context = ssl.create_default_context()
 
 import httpx
 import os
+import json
+import time
+import hashlib
+import threading
 
 from solid.solid_api import SolidAPI
 from rdflib import Graph, Namespace, OWL, RDF
@@ -131,28 +135,40 @@ def getStandardProfiles():
     return prof
 
 
-def put_custom_profile_into_pod( profile_name, values):
+######################################################
+#  Profile store for a SOLID datapod.
+#
+#  One login per store, the session cookie of the httpx client is reused for all requests.
+#  Parsed profiles are kept for ttl seconds (in memory and, with a cache folder, on disk),
+#  after that the pod is asked with If-None-Match / If-Modified-Since and a 304 keeps the
+#  cached weights. A batch run over many locations hits the pod once per profile.
+#
+#  Entries are keyed by the user and the URL of the profile, so stores for other pods or
+#  users which share a cache folder do not see each others profiles. Requests for
+#  different profiles run in parallel, requests for the same profile wait for each other.
+#
+PROFILE_CACHE_TTL = int( os.environ.get('GEOQB_PROFILE_CACHE_TTL', 3600) )
+PROFILE_PATH = "/public/ecolytiq-sustainability-profile/"
 
-    SOLID_USERNAME = os.environ.get('SOLID_USERNAME')
-    SOLID_PASSWORD = os.environ.get('SOLID_PASSWORD')
 
-    SOLID_IDP = os.environ.get('SOLID_IDP')
-    SOLID_POD_ENDPOINT = os.environ.get('SOLID_POD_ENDPOINT')
+def parseProfile( text ):
 
-    print(f">>>--------------------------------------------<<<")
-    print(f">>> Linked-Open-Data Cloud - the cloud of PODs <<<")
-    print(f">>>--------------------------------------------<<<")
-    print(f">>>")
-    print(f">>>")
-    print(f">>> SOLID datapod [{SOLID_POD_ENDPOINT}] is used with IDP: [{SOLID_IDP}] for user: [{SOLID_USERNAME}]")
-    print(f">>>")
-    print(f">>>")
-    print("* Login ...")
-    auth = Auth2()
-    #auth = Auth()
-    api = SolidAPI(auth)
-    auth.login(SOLID_IDP, SOLID_USERNAME, SOLID_PASSWORD)
-    print( f"*       ... DONE")
+    g = Graph()
+    g.parse(data=text, format="turtle")
+
+    layer_weights = {}
+
+    for s, p, o in g:
+
+        parts = s.split("weight_for_layer_")
+
+        if parts[0] == "http://geoqb.com/layer/general#":
+            layer_weights[parts[1]] = float(o.value)
+
+    return layer_weights
+
+
+def serializeProfile( values ):
 
     g = Graph()
 
@@ -161,14 +177,170 @@ def put_custom_profile_into_pod( profile_name, values):
     g.bind('geoqb',geolayer)
 
     for v in values :
-        print( v )
         rel = URIRef('http://geoqb.com/layer/general#weight_for_layer_' + v)
         g.add((rel, RDF.value, Literal( str( values[v] ) )))
 
-    newData = g.serialize(format='n3')
+    return g.serialize(format='n3')
+
+
+class ProfileStore:
+
+    def __init__( self, idp, username, password, endpoint, ttl=PROFILE_CACHE_TTL, cacheFolder=None, auth=None ):
+        self.idp = idp
+        self.username = username
+        self.password = password
+        self.endpoint = endpoint
+        self.ttl = ttl
+        self.cacheFolder = cacheFolder
+        self.auth = auth
+        self.api = None
+        self.profiles = {}
+        self.profileLocks = {}
+        self.lock = threading.RLock()
+        self.stats = { "hits" : 0, "notModified" : 0, "downloads" : 0, "logins" : 0 }
+        if cacheFolder is not None:
+            os.makedirs( cacheFolder, exist_ok=True )
+
+    def profileUrl( self, profile_name ):
+        return f"{self.endpoint}{PROFILE_PATH}" + profile_name + ".ttl"
+
+    #
+    # stale is the api which got the 401, if another thread has logged in since then its
+    # session is used.
+    #
+    def login( self, force=False, stale=None ):
+        with self.lock:
+            if self.api is not None and ( not force or ( stale is not None and self.api is not stale ) ):
+                return self.api
+            print(f">>> SOLID datapod [{self.endpoint}] is used with IDP: [{self.idp}] for user: [{self.username}]")
+            print("* Login ...")
+            if self.auth is None or force:
+                self.auth = Auth2()
+            self.api = SolidAPI(self.auth)
+            self.auth.login(self.idp, self.username, self.password)
+            self.stats["logins"] += 1
+            print( f"*       ... DONE")
+            return self.api
+
+    def _cacheKey( self, profile_name ):
+        text = str( self.username ) + "\n" + self.profileUrl( profile_name )
+        return hashlib.sha256( text.encode( "utf-8" ) ).hexdigest()
+
+    def _cacheFile( self, key ):
+        return os.path.join( self.cacheFolder, key + ".json" )
+
+    def _profileLock( self, key ):
+        with self.lock:
+            if key not in self.profileLocks:
+                self.profileLocks[key] = threading.Lock()
+            return self.profileLocks[key]
+
+    def _count( self, name ):
+        with self.lock:
+            self.stats[name] += 1
+
+    def _cached( self, key ):
+        entry = self.profiles.get( key )
+        if entry is None and self.cacheFolder is not None:
+            try:
+                with open( self._cacheFile( key ) ) as f:
+                    entry = json.load( f )
+                self.profiles[key] = entry
+            except ( IOError, ValueError ):
+                entry = None
+        return entry
+
+    def _store( self, key, entry ):
+        self.profiles[key] = entry
+        if self.cacheFolder is not None:
+            tmp = self._cacheFile( key ) + ".tmp"
+            with open( tmp, "w" ) as f:
+                json.dump( entry, f )
+            os.replace( tmp, self._cacheFile( key ) )
+
+    def _drop( self, key ):
+        self.profiles.pop( key, None )
+        if self.cacheFolder is not None and os.path.exists( self._cacheFile( key ) ):
+            os.remove( self._cacheFile( key ) )
+
+    def _get( self, url, headers ):
+        api = self.login()
+        r = self.auth.client.get( url, headers=headers )
+        if r.status_code in ( 401, 403 ):
+            # the session expired, login again
+            self.login( force=True, stale=api )
+            r = self.auth.client.get( url, headers=headers )
+        return r
+
+    def getProfile( self, profile_name, maxAge=None ):
+
+        maxAge = self.ttl if maxAge is None else maxAge
+        key = self._cacheKey( profile_name )
+
+        with self._profileLock( key ):
+
+            entry = self._cached( key )
+            if entry is not None and time.time() - entry["fetched"] < maxAge:
+                self._count( "hits" )
+                return dict( entry["weights"] )
+
+            headers = {}
+            if entry is not None:
+                if entry.get( "etag" ):
+                    headers["If-None-Match"] = entry["etag"]
+                if entry.get( "lastModified" ):
+                    headers["If-Modified-Since"] = entry["lastModified"]
+
+            r = self._get( self.profileUrl( profile_name ), headers )
+
+            if r.status_code == 304 and entry is not None:
+                self._count( "notModified" )
+                entry["fetched"] = time.time()
+            else:
+                r.raise_for_status()
+                self._count( "downloads" )
+                entry = { "url" : self.profileUrl( profile_name ),
+                          "username" : self.username,
+                          "weights" : parseProfile( r.text ),
+                          "etag" : r.headers.get( "ETag" ),
+                          "lastModified" : r.headers.get( "Last-Modified" ),
+                          "fetched" : time.time() }
+
+            self._store( key, entry )
+            return dict( entry["weights"] )
+
+    def putProfile( self, profile_name, values ):
+        key = self._cacheKey( profile_name )
+        with self._profileLock( key ):
+            api = self.login()
+            resp = api.put_file( self.profileUrl( profile_name ), serializeProfile( values ), 'text/plain' )
+            # the next read validates against the new version
+            self._drop( key )
+            return resp
+
+
+_profileStore = None
+_profileStoreLock = threading.Lock()
+
+def getProfileStore():
+    global _profileStore
+    with _profileStoreLock:
+        if _profileStore is None:
+            workspace = os.environ.get('GEOQB_WORKSPACE')
+            _profileStore = ProfileStore( os.environ.get('SOLID_IDP'),
+                                          os.environ.get('SOLID_USERNAME'),
+                                          os.environ.get('SOLID_PASSWORD'),
+                                          os.environ.get('SOLID_POD_ENDPOINT'),
+                                          cacheFolder=os.path.join( workspace, "cache", "profiles" ) if workspace else None )
+        return _profileStore
+
+
+def put_custom_profile_into_pod( profile_name, values):
+
+    for v in values :
+        print( v )
 
-    profile_url = f"{SOLID_POD_ENDPOINT}/public/ecolytiq-sustainability-profile/" + profile_name + ".ttl"
-    resp = api.put_file(profile_url, newData, 'text/plain')
+    resp = getProfileStore().putProfile( profile_name, values )
 
     print( resp )
 
@@ -186,49 +358,11 @@ def describeSolidDatapod():
 
 def get_custom_profile_from_pod( profile_name ):
 
-    SOLID_USERNAME = os.environ.get('SOLID_USERNAME')
-    SOLID_PASSWORD = os.environ.get('SOLID_PASSWORD')
-
-    SOLID_IDP = os.environ.get('SOLID_IDP')
-    SOLID_POD_ENDPOINT = os.environ.get('SOLID_POD_ENDPOINT')
-
-    print(f">>>--------------------------------------------<<<")
-    print(f">>> Linked-Open-Data Cloud - the cloud of PODs <<<")
-    print(f">>>--------------------------------------------<<<")
-    print(f">>>")
-    print(f">>>")
-    print(f">>> SOLID datapod [{SOLID_POD_ENDPOINT}] is used with IDP: [{SOLID_IDP}] for user: [{SOLID_USERNAME}]")
-    print(f">>>")
-    print(f">>>")
-    print("* Login ...")
-    auth = Auth2()
-    #auth = Auth()
-    api = SolidAPI(auth)
-    auth.login(SOLID_IDP, SOLID_USERNAME, SOLID_PASSWORD)
-    print( f"*       ... DONE")
-
-    profile_url = f"{SOLID_POD_ENDPOINT}/public/ecolytiq-sustainability-profile/" + profile_name + ".ttl"
-    resp = api.get(profile_url)
-
-    g = Graph()
-    g.parse(data=resp.text, format="turtle")
+    layer_weights = getProfileStore().getProfile( profile_name )
 
-    layer_weights = {}
-
-    for s, p, o in g:
-
-        #print(s, p, o)
-
-        parts = s.split("weight_for_layer_")
-
-        if parts[0] == "http://geoqb.com/layer/general#":
-            layer_weights[parts[1]] = float(o.value)
-            print( str(parts[1]) + " => " + str( layer_weights[parts[1]] ) )
+    for k, w in layer_weights.items():
+        print( str(k) + " => " + str( w ) )
 
     print( "Profile loading done." )
 
     return layer_weights
-
-
-
-
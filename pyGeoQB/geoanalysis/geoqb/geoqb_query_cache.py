@@ -0,0 +1,222 @@
+import os
+import re
+import json
+import time
+import atexit
+import shutil
+import hashlib
+import threading
+
+######################################################
+#  Content addressed cache for remote query results (Sophox, Overpass).
+#
+#  A result is stored under the hash of the endpoint and the normalized query text,
+#  so identical queries are served from the cache no matter which layer (or which
+#  layer name) asked for them. The cache lives in the "cache" folder of the workspace
+#  and is described by an index file with TTLs, sizes and hit/miss statistics.
+#
+#  Lookups only update the index in memory, it is written when results are added or
+#  evicted, and when the process exits (flush).
+#
+#  GEOQB_CACHE_TTL        : seconds a result stays valid (default 7 days)
+#  GEOQB_CACHE_MAX_BYTES  : size limit, least recently used entries are evicted (default 1 GB)
+#
+
+DEFAULT_TTL = int( os.environ.get('GEOQB_CACHE_TTL', 7 * 24 * 3600) )
+DEFAULT_MAX_BYTES = int( os.environ.get('GEOQB_CACHE_MAX_BYTES', 1024 * 1024 * 1024) )
+
+INDEX_FILE_NAME = "index.json"
+
+
+def normalizeQuery( query ):
+    return re.sub( r'\s+', ' ', query ).strip()
+
+def getQueryKey( query, endpoint ):
+    text = str( endpoint ) + "\n" + normalizeQuery( query )
+    return hashlib.sha256( text.encode( 'utf-8' ) ).hexdigest()
+
+
+#
+# Only complete results are cached. Overpass reports timeouts and memory limits in a "remark"
+# next to an empty or truncated element list, empty results are not cached either, so the
+# query is sent again the next time.
+#
+def isCacheableResult( data ):
+    if isinstance( data, dict ):
+        remark = str( data.get( "remark", "" ) ).lower()
+        if "error" in remark or "timed out" in remark:
+            return False
+        if "elements" in data:
+            return len( data["elements"] ) > 0
+        if "results" in data:
+            return len( data["results"].get( "bindings", [] ) ) > 0
+        return False
+    if isinstance( data, list ):
+        return len( data ) > 0
+    return False
+
+
+class QueryCache:
+
+    def __init__( self, folder, ttl=DEFAULT_TTL, maxBytes=DEFAULT_MAX_BYTES ):
+        self.folder = folder
+        self.ttl = ttl
+        self.maxBytes = maxBytes
+        self.lock = threading.RLock()
+        os.makedirs( self.folder, exist_ok=True )
+        self.indexFile = os.path.join( self.folder, INDEX_FILE_NAME )
+        self.index = self._loadIndex()
+        self.dirty = False
+
+    def _loadIndex( self ):
+        try:
+            with open( self.indexFile ) as f:
+                index = json.load( f )
+        except ( IOError, ValueError ):
+            index = {}
+        index.setdefault( "entries", {} )
+        index.setdefault( "stats", { "hits" : 0, "misses" : 0, "expired" : 0, "evictions" : 0 } )
+        return index
+
+    def _saveIndex( self ):
+        tmp = self.indexFile + "." + str( os.getpid() ) + ".tmp"
+        with open( tmp, "w" ) as f:
+            json.dump( self.index, f, indent=2 )
+        os.replace( tmp, self.indexFile )
+        self.dirty = False
+
+    #
+    # Writes access times and hit/miss statistics collected by get().
+    #
+    def flush( self ):
+        with self.lock:
+            if self.dirty:
+                self._saveIndex()
+
+    def _entryFile( self, key ):
+        return os.path.join( self.folder, key[:2], key + ".json" )
+
+    def _drop( self, key ):
+        entry = self.index["entries"].pop( key, None )
+        if entry is not None:
+            try:
+                os.remove( self._entryFile( key ) )
+            except OSError:
+                pass
+
+    #
+    # Returns the path of the cached result, or None if there is no valid entry.
+    #
+    def get( self, query, endpoint ):
+        key = getQueryKey( query, endpoint )
+        with self.lock:
+            entry = self.index["entries"].get( key )
+            now = time.time()
+            if entry is not None and now - entry["created"] > entry.get( "ttl", self.ttl ):
+                self._drop( key )
+                self.index["stats"]["expired"] += 1
+                entry = None
+            if entry is None or not os.path.exists( self._entryFile( key ) ):
+                self.index["stats"]["misses"] += 1
+                self.dirty = True
+                return None
+            entry["lastAccess"] = now
+            entry["hits"] = entry.get( "hits", 0 ) + 1
+            self.index["stats"]["hits"] += 1
+            self.dirty = True
+            return self._entryFile( key )
+
+    #
+    # Copy a cached result into the file a layer expects; True on a cache hit.
+    #
+    def getInto( self, query, endpoint, fileName ):
+        cached = self.get( query, endpoint )
+        if cached is None:
+            return False
+        shutil.copyfile( cached, fileName )
+        return True
+
+    #
+    # data is the parsed result if the caller has it already, otherwise the file is read.
+    # Returns None if the result is not cached.
+    #
+    def putFile( self, query, endpoint, fileName, ttl=None, data=None ):
+        if data is None:
+            try:
+                with open( fileName ) as f:
+                    data = json.load( f )
+            except ( IOError, ValueError ):
+                data = None
+        if not isCacheableResult( data ):
+            print( "!!! Result of " + normalizeQuery( query )[:80] + " is empty or incomplete, it is not cached." )
+            return None
+        key = getQueryKey( query, endpoint )
+        with self.lock:
+            target = self._entryFile( key )
+            os.makedirs( os.path.dirname( target ), exist_ok=True )
+            shutil.copyfile( fileName, target )
+            now = time.time()
+            self.index["entries"][key] = {
+                "endpoint" : endpoint,
+                "query" : normalizeQuery( query ),
+                "size" : os.path.getsize( target ),
+                "created" : now,
+                "lastAccess" : now,
+                "ttl" : self.ttl if ttl is None else ttl,
+                "hits" : 0
+            }
+            self._evict()
+            self._saveIndex()
+            return target
+
+    def _evict( self ):
+        entries = self.index["entries"]
+        total = sum( e["size"] for e in entries.values() )
+        for key in sorted( entries, key=lambda k: entries[k]["lastAccess"] ):
+            if total <= self.maxBytes:
+                break
+            total = total - entries[key]["size"]
+            self._drop( key )
+            self.index["stats"]["evictions"] += 1
+
+    def clear( self ):
+        with self.lock:
+            for key in list( self.index["entries"].keys() ):
+                self._drop( key )
+            self._saveIndex()
+
+    def getStats( self ):
+        with self.lock:
+            stats = dict( self.index["stats"] )
+            stats["entries"] = len( self.index["entries"] )
+            stats["bytes"] = sum( e["size"] for e in self.index["entries"].values() )
+            return stats
+
+
+_caches = {}
+_cachesLock = threading.Lock()
+
+def flushQueryCaches():
+    with _cachesLock:
+        caches = list( _caches.values() )
+    for cache in caches:
+        cache.flush()
+
+atexit.register( flushQueryCaches )
+
+def getQueryCache( path_offset ):
+    folder = os.path.abspath( os.path.join( path_offset, "cache" ) )
+    with _cachesLock:
+        if folder not in _caches:
+            _caches[folder] = QueryCache( folder )
+        return _caches[folder]
+
+
+def describeQueryCache( path_offset ):
+    stats = getQueryCache( path_offset ).getStats()
+    print( "\n>>> Query result cache for Sophox and Overpass requests." )
+    print( f" > entries   : {stats['entries']} ({stats['bytes']/1024/1024:.2f} MB)" )
+    print( f" > hits      : {stats['hits']} " )
+    print( f" > misses    : {stats['misses']} " )
+    print( f" > expired   : {stats['expired']} " )
+    print( f" > evictions : {stats['evictions']} " )
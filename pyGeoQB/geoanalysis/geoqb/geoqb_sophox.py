@@ -1,10 +1,61 @@
 
 import sparql
 import os
+import re
 import json
-
-
-def reloadOrDumpNamedQueryAsJSON( query, nq, title, path_offset, fnRawOSMResponse, forceReload=True, dryRun = True ):
+import time
+import threading
+
+import numpy as np
+import pandas as pd
+
+import geoanalysis.geoqb.geoqb_query_cache as gqcache
+
+
+#
+# Concurrent requests are limited per endpoint (sophox_max_concurrency), failed
+# requests are retried with exponential backoff.
+#
+SOPHOX_MAX_CONCURRENCY = int( os.environ.get('sophox_max_concurrency', 4) )
+SOPHOX_RETRIES = int( os.environ.get('sophox_retries', 3) )
+SOPHOX_BACKOFF = float( os.environ.get('sophox_backoff', 2.0) )
+
+_endpointSlots = {}
+_endpointSlotsLock = threading.Lock()
+
+def getEndpointSlot( endpoint, limit=None ):
+    with _endpointSlotsLock:
+        if endpoint not in _endpointSlots:
+            _endpointSlots[endpoint] = threading.BoundedSemaphore( limit or SOPHOX_MAX_CONCURRENCY )
+        return _endpointSlots[endpoint]
+
+#
+# The endpoint slot is held for one attempt only, other requests can use it while we back off.
+#
+def callWithRetry( fn, retries=None, backoff=None, label="", slot=None ):
+    retries = SOPHOX_RETRIES if retries is None else retries
+    backoff = SOPHOX_BACKOFF if backoff is None else backoff
+    attempt = 0
+    while True:
+        try:
+            if slot is None:
+                return fn()
+            with slot:
+                return fn()
+        except Exception as e:
+            attempt = attempt + 1
+            if attempt > retries:
+                raise
+            wait = backoff * ( 2 ** ( attempt - 1 ) )
+            print( f"!!! Request {label} failed ({e}), retry {attempt}/{retries} in {wait:.1f} s." )
+            time.sleep( wait )
+
+
+#
+# forceReload skips the dump file of the named query, the query cache is still used
+# for identical queries unless useCache is False.
+#
+def reloadOrDumpNamedQueryAsJSON( query, nq, title, path_offset, fnRawOSMResponse, forceReload=True, dryRun = True, useCache = True ):
 
     data = ""
 
@@ -37,26 +88,30 @@ def reloadOrDumpNamedQueryAsJSON( query, nq, title, path_offset, fnRawOSMRespons
 
     sophox_endpoint = os.environ.get('sophox_endpoint')
 
-    s = sparql.Service(sophox_endpoint, "utf-8", "GET")
+    cache = gqcache.getQueryCache( path_offset )
 
-    result = sparql.query(sophox_endpoint, query)
+    if useCache and cache.getInto( query, sophox_endpoint, fileName ):
+        print("***### Load data from query cache into Sophox-Dump-File: " + fileName + ".")
+        return "---DATA---", fileName
 
-    print( f">>> Columns in result set: {result.variables}" )
+    def runQuery():
+        result = sparql.query(sophox_endpoint, query)
+        rows = []
+        for row in result.fetchall():
+            r2 = sparql.unpack_row(row, convert=None, convert_type={})
+            rows.append(r2)
+        return result.variables, rows
+
+    variables, rows = callWithRetry( runQuery, label=nq, slot=getEndpointSlot( sophox_endpoint ) )
+
+    print( f">>> Columns in result set: {variables}" )
 
     print( f">>> {query}" )
     print( f">>> {nq}" )
     print( f">>> {title}" )
 
-    data = []
-
-    for row in result.fetchall():
-        r2 = sparql.unpack_row(row, convert=None, convert_type={})
-        data.append(r2)
-
-    import pandas as pd
-
     # create DataFrame using data
-    df = pd.DataFrame(data, columns = result.variables)
+    df = pd.DataFrame(rows, columns = variables)
 
     data = df.to_json(orient = 'records')
 
@@ -64,4 +119,79 @@ def reloadOrDumpNamedQueryAsJSON( query, nq, title, path_offset, fnRawOSMRespons
     f2.write( data )
     f2.close()
 
+    cache.putFile( query, sophox_endpoint, fileName, data=rows )
+
     return data, fileName
+
+
+#
+# Streaming access to a Sophox dump file.
+#
+# The dump is a JSON array of records (see reloadOrDumpNamedQueryAsJSON). The records
+# are decoded one by one from a fixed size read buffer, so the memory usage does not
+# depend on the size of the file.
+#
+_WS_SEP = re.compile( r'[\s,]*' )
+
+def iterSophoxRecords( fileName, bufferSize=65536 ):
+
+    decoder = json.JSONDecoder()
+
+    with open( fileName ) as f:
+
+        buf = f.read( bufferSize ).lstrip()
+        if not buf.startswith( "[" ):
+            raise ValueError( f"Sophox dump file {fileName} does not contain a JSON array." )
+        pos = 1
+
+        while True:
+            pos = _WS_SEP.match( buf, pos ).end()
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode( buf, pos )
+            except json.JSONDecodeError:
+                chunk = f.read( bufferSize )
+                if not chunk:
+                    raise
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            yield record
+            pos = end
+
+
+#
+# Parse a list of WKT points "Point(lon lat)" in one go.
+#
+def parseWKTPoints( points ):
+    xy = pd.Series( points, dtype=object ).str.extract( r'Point\(\s*(\S+)\s+([^\s)]+)\s*\)' ).astype( float )
+    return xy[0].to_numpy(), xy[1].to_numpy()
+
+
+#
+# Columnar batches of ( lon, lat, tag, osmid ) for all records with a location.
+#
+def iterSophoxCoordBatches( fileName, batchSize=50000 ):
+
+    locs = []
+    tags = []
+    osmids = []
+
+    def flush():
+        lon, lat = parseWKTPoints( locs )
+        return lon, lat, np.array( tags, dtype=object ), np.array( osmids, dtype=object )
+
+    for record in iterSophoxRecords( fileName ):
+        p = record['loc']
+        if p is None:
+            continue
+        locs.append( p )
+        tags.append( record['tag'] )
+        osmids.append( record['osmid'] )
+        if len(locs) >= batchSize:
+            yield flush()
+            locs, tags, osmids = [], [], []
+
+    if len(locs) > 0:
+        yield flush()
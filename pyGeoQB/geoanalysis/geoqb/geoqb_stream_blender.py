@@ -0,0 +1,232 @@
+import time
+
+import pandas as pd
+
+from confluent_kafka import KafkaError, KafkaException, TopicPartition
+
+import geoanalysis.geoqb.geoqb_tg as gqtg
+
+######################################################
+#  Continuous blending of sensor topics into a layer.
+#
+#  Messages are collected into micro-batches which are closed after batchSize messages or
+#  batchSeconds, whatever comes first. The keys of a batch are joined against the cells of
+#  the layer (cached once per blender), matching records go through the blending path of
+#  gqtg.blendDataToLayerDataInTigerGraph. Offsets are committed after the batch is in the
+#  graph, a failed batch is retried with exponential backoff and, if it still fails, the
+#  blender stops without committing so the batch is consumed again after a restart.
+#
+#  Tombstones (messages without value) are skipped and counted, their offsets are committed
+#  with the next batch.
+#
+#  The consumer is any object with the confluent_kafka Consumer API (poll, commit, close,
+#  assignment, position, get_watermark_offsets), e.g. one connected to a local broker.
+#
+STREAM_BATCH_SIZE = 1000
+STREAM_BATCH_SECONDS = 5.0
+STREAM_BATCH_RETRIES = 2
+STREAM_BATCH_BACKOFF = 2.0
+
+
+class StreamBlender:
+
+    def __init__( self, consumer, layer, mappings, conn, path_offset=".", res=9, mode=None,
+                  batchSize=STREAM_BATCH_SIZE, batchSeconds=STREAM_BATCH_SECONDS, batchRetries=STREAM_BATCH_RETRIES,
+                  batchBackoff=STREAM_BATCH_BACKOFF, blend=None, verbose=True ):
+
+        self.consumer = consumer
+        self.mappings = mappings
+        self.conn = conn
+        self.path_offset = path_offset
+        self.res = res
+        self.mode = mode
+        self.batchSize = batchSize
+        self.batchSeconds = batchSeconds
+        self.batchRetries = batchRetries
+        self.batchBackoff = batchBackoff
+        self.blend = blend or gqtg.blendDataToLayerDataInTigerGraph
+        self.verbose = verbose
+
+        # cached layer index, the cells are looked up by the message keys
+        self.layer = layer.drop_duplicates( subset='Id', keep="last" ).set_index( 'Id', drop=False )
+
+        self.batch = []
+        self.batchStarted = None
+        self.offsets = {}
+        self.running = False
+
+        self.metrics = {
+            "messages" : 0,
+            "matched" : 0,
+            "unmatched" : 0,
+            "tombstones" : 0,
+            "batches" : 0,
+            "failedBatches" : 0,
+            "observations" : 0,
+            "started" : None,
+            "lastBatchSeconds" : 0.0,
+            "lag" : None
+        }
+
+    #
+    # quoted cell ids like in the sample topic: "891e34d61d3ffff"
+    #
+    @staticmethod
+    def cellOfKey( key ):
+        return key[1:len(key)-1]
+
+    def _append( self, msg ):
+
+        tp = ( msg.topic(), msg.partition() )
+        self.offsets[tp] = max( self.offsets.get( tp, -1 ), msg.offset() )
+
+        self.metrics["messages"] += 1
+
+        value = msg.value()
+        if value is None:
+            self.metrics["tombstones"] += 1
+            return
+
+        key = msg.key().decode( 'UTF-8' ) if msg.key() is not None else ""
+        val = value.decode( 'UTF-8' )
+        headers = msg.headers()
+
+        if len( self.batch ) == 0:
+            self.batchStarted = time.time()
+
+        self.batch.append( ( key, "<no headers>" if headers is None else headers, val ) )
+
+    def _batchDue( self ):
+        if len( self.batch ) == 0:
+            return False
+        return len( self.batch ) >= self.batchSize or time.time() - self.batchStarted >= self.batchSeconds
+
+    #
+    # Join of the message keys against the cached layer index.
+    #
+    def _joinLayer( self, df ):
+
+        cells = df["key"].map( self.cellOfKey )
+        matched = cells.isin( self.layer.index )
+
+        self.metrics["matched"] += int( matched.sum() )
+        self.metrics["unmatched"] += int( ( ~matched ).sum() )
+
+        return self.layer.loc[ cells[matched].unique() ].reset_index( drop=True ), df[matched]
+
+    def _commit( self ):
+        self.consumer.commit( offsets=[ TopicPartition( t, p, o + 1 ) for ( t, p ), o in self.offsets.items() ],
+                              asynchronous=False )
+        self.offsets = {}
+
+    def flush( self ):
+
+        if len( self.batch ) == 0:
+            # only tombstones since the last batch
+            if len( self.offsets ) > 0:
+                self._commit()
+            return
+
+        t0 = time.time()
+        layer, df = self._joinLayer( pd.DataFrame( self.batch, columns=['key', 'header', 'records'] ) )
+
+        stats = []
+        attempt = 0
+        while len( df ) > 0:
+            try:
+                stats = self.blend( layer, df, self.mappings, self.path_offset, self.conn,
+                                    res=self.res, dumpFile=False, mode=self.mode )
+                break
+            except Exception as e:
+                attempt = attempt + 1
+                if attempt > self.batchRetries:
+                    self.metrics["failedBatches"] += 1
+                    raise
+                wait = self.batchBackoff * ( 2 ** ( attempt - 1 ) )
+                print( f"!!! Blending a batch of {len(df)} messages failed ({e}), retry {attempt}/{self.batchRetries} in {wait:.1f} s." )
+                time.sleep( wait )
+
+        self._commit()
+
+        self.metrics["batches"] += 1
+        self.metrics["observations"] += sum( s["upserted"] for s in stats if s["job"].startswith( "observed_at" ) )
+        self.metrics["lastBatchSeconds"] = time.time() - t0
+        self.metrics["lag"] = self.getLag()
+
+        self.batch = []
+
+        if self.verbose:
+            self.printMetrics()
+
+    #
+    # Messages between the current position of the consumer (the next offset it reads) and
+    # the end of the assigned partitions.
+    #
+    def getLag( self ):
+        try:
+            assignment = self.consumer.assignment()
+            if len( assignment ) == 0:
+                return None
+            lag = 0
+            for tp in self.consumer.position( assignment ):
+                low, high = self.consumer.get_watermark_offsets( tp, cached=True )
+                if tp.offset >= 0 and high >= 0:
+                    lag = lag + max( 0, high - tp.offset )
+            return lag
+        except Exception:
+            return None
+
+    def getMetrics( self ):
+        m = dict( self.metrics )
+        elapsed = time.time() - m["started"] if m["started"] else 0
+        m["messagesPerSecond"] = round( m["messages"] / elapsed, 1 ) if elapsed > 0 else None
+        m["observationsPerSecond"] = round( m["observations"] / elapsed, 1 ) if elapsed > 0 else None
+        m["pending"] = len( self.batch )
+        return m
+
+    def printMetrics( self ):
+        m = self.getMetrics()
+        print( f">>> batch {m['batches']}: {m['messages']} messages ({m['messagesPerSecond']}/s), "
+               f"{m['observations']} observations ({m['observationsPerSecond']}/s), "
+               f"{m['unmatched']} outside the layer, {m['tombstones']} tombstones, lag {m['lag']}, last batch {m['lastBatchSeconds']:.2f} s" )
+
+    #
+    # Consumes until stop() is called, maxMessages are blended or no message arrived for idleSeconds.
+    #
+    def run( self, maxMessages=None, idleSeconds=None, pollTimeout=1.0 ):
+
+        self.running = True
+        self.metrics["started"] = time.time()
+        lastMessage = time.time()
+
+        try:
+            while self.running:
+
+                msg = self.consumer.poll( timeout=pollTimeout )
+
+                if msg is None:
+                    pass
+                elif msg.error():
+                    if msg.error().code() != KafkaError._PARTITION_EOF:
+                        raise KafkaException( msg.error() )
+                else:
+                    self._append( msg )
+                    lastMessage = time.time()
+
+                if self._batchDue():
+                    self.flush()
+
+                if maxMessages is not None and self.metrics["messages"] >= maxMessages:
+                    break
+                if idleSeconds is not None and time.time() - lastMessage >= idleSeconds:
+                    break
+
+            self.flush()
+
+        finally:
+            self.running = False
+
+        return self.getMetrics()
+
+    def stop( self ):
+        self.running = False
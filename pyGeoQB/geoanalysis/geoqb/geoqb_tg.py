@@ -1,16 +1,156 @@
-import flat_table
 import pyTigerGraph as tg
 
 import geoanalysis.geoqb.geoqb_tg_layer_tag_histogram as gqtaghisto
 import geoanalysis.geoqb.geoqb_tg_layer_extract as gqtaglayerextract
 import geoanalysis.geoqb.geoqb_osm_pandas as gqosm
 import geoanalysis.geoqb.geoqb_h3 as gqh3
+import geoanalysis.geoqb.geoqb_tg_loader as gqtgloader
+import geoanalysis.geoqb.geoqb_tg_queries as gqqueries
 
 import pandas as pd
 
 from string import Template
-from datetime import datetime
 import json
+import os
+import time
+import threading
+
+import requests
+
+######################################################
+#  Pooled TigerGraph connections.
+#
+#  One connection per (host, graph, user) is created and shared by all callers and
+#  threads. The REST++ token is requested once and refreshed in the background
+#  TG_TOKEN_REFRESH_MARGIN seconds before its lifetime ends; the new token is written
+#  into the shared connection object, so callers holding a reference keep working.
+#
+#  pyTigerGraph sends each request with requests.request(), which opens a new TCP/TLS
+#  connection per call. The bulk REST++ calls of the upserts and loading jobs are sent
+#  through one keep-alive requests.Session instead (GEOQB_TG_KEEP_ALIVE=false disables this),
+#  see gqtgloader.getIngestTarget.
+#
+TG_TOKEN_LIFETIME = int( os.environ.get('GEOQB_TG_TOKEN_LIFETIME', 3600) )
+TG_TOKEN_REFRESH_MARGIN = int( os.environ.get('GEOQB_TG_TOKEN_REFRESH_MARGIN', 300) )
+TG_KEEP_ALIVE = str( os.environ.get('GEOQB_TG_KEEP_ALIVE', 'true') ).lower() in ( "1", "true", "yes" )
+TG_POOL_SIZE = 16
+
+
+_keepAliveSession = None
+_keepAliveSessionLock = threading.Lock()
+
+def getKeepAliveSession():
+
+    global _keepAliveSession
+
+    if not TG_KEEP_ALIVE:
+        return None
+
+    with _keepAliveSessionLock:
+        if _keepAliveSession is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter( pool_connections=TG_POOL_SIZE, pool_maxsize=TG_POOL_SIZE )
+            session.mount( "https://", adapter )
+            session.mount( "http://", adapter )
+            _keepAliveSession = session
+        return _keepAliveSession
+
+
+class TGConnectionManager:
+
+    def __init__( self, tokenLifetime=TG_TOKEN_LIFETIME, refreshMargin=TG_TOKEN_REFRESH_MARGIN ):
+        self.tokenLifetime = tokenLifetime
+        self.refreshMargin = refreshMargin
+        self.lock = threading.RLock()
+        self.entries = {}
+
+    def _requestToken( self, entry ):
+        tokenConn = tg.TigerGraphConnection( host=entry["hostname"], graphname=entry["graph_name"],
+                                             username=entry["username"], password=entry["password"] )
+        result = tokenConn.getToken( entry["secret"], str( self.tokenLifetime ) )
+        expires = time.time() + self.tokenLifetime
+        if isinstance( result, ( tuple, list ) ) and len(result) > 1 and isinstance( result[1], ( int, float ) ):
+            expires = min( expires, float( result[1] ) )
+        token = result[0] if isinstance( result, ( tuple, list ) ) else result
+        return token, expires
+
+    def _applyToken( self, entry, token, expires ):
+        conn = entry["conn"]
+        if conn is None:
+            entry["conn"] = tg.TigerGraphConnection( host=entry["hostname"], graphname=entry["graph_name"],
+                                                     username=entry["username"], password=entry["password"],
+                                                     apiToken=token )
+        else:
+            conn.apiToken = token
+            if hasattr( conn, "authHeader" ):
+                conn.authHeader = { "Authorization" : "Bearer " + token }
+        entry["token"] = token
+        entry["expires"] = expires
+
+    def _scheduleRefresh( self, key, delay=None ):
+        entry = self.entries[key]
+        if entry["timer"] is not None:
+            entry["timer"].cancel()
+        if delay is None:
+            delay = max( 0.0, entry["expires"] - self.refreshMargin - time.time() )
+        timer = threading.Timer( delay, self._refresh, args=( key, ) )
+        timer.daemon = True
+        timer.start()
+        entry["timer"] = timer
+
+    def _refresh( self, key ):
+        with self.lock:
+            entry = self.entries.get( key )
+            if entry is None:
+                return
+            try:
+                token, expires = self._requestToken( entry )
+            except Exception as e:
+                # the old token is still valid for a while, try again later
+                print( f">>> Token refresh for graph {entry['graph_name']} failed: {e}" )
+                self._scheduleRefresh( key, delay=60.0 )
+                return
+            self._applyToken( entry, token, expires )
+            self._scheduleRefresh( key )
+
+    def getConnection( self, graph_name, hostname, username, password, secret ):
+
+        key = ( hostname, graph_name, username )
+
+        with self.lock:
+
+            entry = self.entries.get( key )
+
+            if entry is None:
+                entry = { "hostname" : hostname, "graph_name" : graph_name, "username" : username,
+                          "password" : password, "secret" : secret,
+                          "conn" : None, "token" : None, "expires" : 0.0, "timer" : None }
+                token, expires = self._requestToken( entry )
+                self._applyToken( entry, token, expires )
+                self.entries[key] = entry
+                self._scheduleRefresh( key )
+
+            elif time.time() > entry["expires"] - self.refreshMargin:
+                # the timer did not fire in time (e.g. the process was suspended)
+                token, expires = self._requestToken( entry )
+                self._applyToken( entry, token, expires )
+                self._scheduleRefresh( key )
+
+            return entry["conn"], entry["token"]
+
+    def close( self ):
+        with self.lock:
+            for entry in self.entries.values():
+                if entry["timer"] is not None:
+                    entry["timer"].cancel()
+            self.entries = {}
+
+
+_connectionManager = TGConnectionManager()
+
+def getConnectionManager():
+    return _connectionManager
+
 
 #
 # Create a TigerGraph Application
@@ -19,12 +159,15 @@ import json
 # Manage the API-Key and secret
 # Provide the configuration details for the connection
 #
+# Connections are pooled, repeated calls for the same graph return the same connection.
+#
 def initTG( graph_name="OSMLayers_Demo",
             secretalias = "???",
             secret = "???",
             hostname="https://geoqb.i.tgcloud.io/",
             username="???",
-            password="???"
+            password="???",
+            verbose=True
           ):
 
   #
@@ -33,15 +176,14 @@ def initTG( graph_name="OSMLayers_Demo",
   #  https://osmtg.i.tgcloud.io/#/graph-explorer
   #
 
-  api_token = tg.TigerGraphConnection(host=hostname, graphname=graph_name, username=username, password=password).getToken( secret, "3600" )[0]
-
-  conn = tg.TigerGraphConnection(host=hostname, graphname=graph_name, password=password, apiToken=api_token)
+  conn, api_token = _connectionManager.getConnection( graph_name, hostname, username, password, secret )
 
-  print( "---------------------------------------------" )
-  print( "API-Token  : ", api_token )
-  print( "Version    : ", tg.__version__ )
-  print( "Connection : ", conn )
-  print( "---------------------------------------------" )
+  if verbose:
+    print( "---------------------------------------------" )
+    print( "API-Token  : ", api_token )
+    print( "Version    : ", tg.__version__ )
+    print( "Connection : ", conn )
+    print( "---------------------------------------------" )
 
   return conn,api_token
 
@@ -107,64 +249,41 @@ def getStats( conn, name ):
     return statsForOSMGraph( conn, name, verbose=False )
 
 
-def getLayer( conn, name, verbose=True, res = 9, WORKPATH="./temp/", overwrite=False, s1=" ", s2=" " ):
-    return gqtaglayerextract.getTagLayerForParaForOSMGraph( conn, name, WORKPATH=WORKPATH, res=res, overwrite=overwrite, s1=s1, s2=s2 )
+def getLayer( conn, name, verbose=True, res = 9, WORKPATH="./temp/", overwrite=False, s1=" ", s2=" ", intCells=None ):
+    return gqtaglayerextract.getTagLayerForParaForOSMGraph( conn, name, WORKPATH=WORKPATH, res=res, overwrite=overwrite, s1=s1, s2=s2, intCells=intCells )
+
+#
+# Layer variants (POS and NEG by default) from one export, re-fetched only if the layer changed.
+#
+def getLayerVariants( conn, name, verbose=True, res = 9, WORKPATH="./temp/", overwrite=False, s1=" ", variants=("POS","NEG"), intCells=None ):
+    return gqtaglayerextract.getTagLayerVariantsForOSMGraph( conn, name, WORKPATH=WORKPATH, res=res, overwrite=overwrite, verbose=verbose, s1=s1, variants=variants, intCells=intCells )
 
 def getFullGraph2( conn, name, verbose=True, WORKPATH="./temp/", res = 9, overwrite=False ):
     return gqtaglayerextract.getTagLayerForResolutionForOSMGraph( conn, name, res=res, overwrite=overwrite, WORKPATH=WORKPATH )
 
+#
+# Returns { 'placeCnt6' : .., 'placeCnt9' : .., 'placeCnt12' : .., 'placesPerResolution' : { res : count } }
+#
 def statsForOSMGraph( conn, name, verbose=True ):
 
-    valueStructure = {
-      'graph_name' : name
-    }
-
-    gsqlStatement ='''
-
-USE GRAPH $graph_name
-
-INTERPRET QUERY () SYNTAX v2 {
-
-  SumAccum<int> @@placeCnt6= 0;
-  SumAccum<int> @@placeCnt9= 0;
-  SumAccum<int> @@placeCnt12= 0;
-
-  Result_all = SELECT s
-            FROM h3place:s
-            ACCUM CASE WHEN s.resolution == 9 THEN
-                            @@placeCnt9 += 1
-                       WHEN s.resolution == 6 THEN
-                            @@placeCnt6 += 1
-                       WHEN s.resolution == 12 THEN
-                            @@placeCnt12 += 1
-                     END;
-
-  PRINT @@placeCnt6;
-  PRINT @@placeCnt9;
-  PRINT @@placeCnt12; 
-  
-}
-
-'''
-
-    gsqlTemplate = Template(gsqlStatement)
-    gsqlScript = gsqlTemplate.substitute(valueStructure)
-
     if verbose:
-        print( gsqlScript )
+        print( gqqueries.getQueryGSQL( "geoqb_place_stats", name ) )
 
-    result = conn.gsql(gsqlScript, options=[])
-    return result
+    return gqqueries.runQuery( conn, "geoqb_place_stats", graph_name=name )
 
+def countPlacesForResolution( conn, name, res ):
+    return gqqueries.runQuery( conn, "geoqb_place_count", { 'res' : res }, graph_name=name )
 
-def showTagHistogramForOSMGraph( conn, graph_name, verbose=True ):
-    return gqtaghisto.getTagHistogramForOSMGraph(  conn, graph_name, verbose )
 
+def showTagHistogramForOSMGraph( conn, graph_name, verbose=True, res=9 ):
+    return gqtaghisto.getTagHistogramForOSMGraph(  conn, graph_name, verbose=verbose, res=res )
 
 
-def setupOSMGlobalTypes( conn ):
 
-    gsqlStatement ='''
+#
+# The global vertex and edge types, the loading jobs in geoqb_tg_loader are generated from this definition.
+#
+OSM_GLOBAL_TYPES_GSQL = '''
 Use global
 CREATE VERTEX osmtag(PRIMARY_ID tagname STRING, tagname STRING, tagvalue STRING, osmid STRING) WITH STATS="OUTDEGREE_BY_EDGETYPE"
 CREATE VERTEX h3place(PRIMARY_ID h3index STRING, h3index STRING, resolution INT DEFAULT "6", lat DOUBLE, lon DOUBLE) WITH STATS="OUTDEGREE_BY_EDGETYPE"
@@ -173,9 +292,49 @@ CREATE VERTEX osmplace(PRIMARY_ID osmid STRING, lat DOUBLE, lon DOUBLE) WITH STA
 CREATE UNDIRECTED EDGE hasOSMTag(FROM osmtag, TO h3place, tagCount UINT DEFAULT "1", layer_id STRING)
 CREATE UNDIRECTED EDGE h3_grid_link(FROM h3place, TO h3place, layer_id STRING DEFAULT "all")
 CREATE UNDIRECTED EDGE located_on_h3_cell(FROM osmplace, TO h3place, layer_id STRING, res INT DEFAULT "6")
+
+CREATE VERTEX osmlayer(PRIMARY_ID layer_id STRING, layer_id STRING, location STRING) WITH STATS="OUTDEGREE_BY_EDGETYPE"
+CREATE UNDIRECTED EDGE layer_member(FROM osmlayer, TO h3place)
 '''
 
-    print(conn.gsql(gsqlStatement, options=[]))
+#
+# Layer index: every staged layer is an osmlayer vertex linked to its h3places, so a layer
+# is extracted by traversing from the matching osmlayer vertices instead of scanning all
+# edges for their layer_id (see geoqb_tg_layer_extract).
+#
+def setupOSMGlobalTypes( conn ):
+
+    print(conn.gsql(OSM_GLOBAL_TYPES_GSQL, options=[]))
+
+#
+# Adds the layer index types to an existing graph and links the layers which are already
+# loaded (one pass over the layer edges).
+#
+def addLayerIndexToOSMGraph( conn, name ):
+
+    valueStructure = {
+      'graph_name' : name
+    }
+
+    gsqlStatement ='''
+Use global
+CREATE VERTEX osmlayer(PRIMARY_ID layer_id STRING, layer_id STRING, location STRING) WITH STATS="OUTDEGREE_BY_EDGETYPE"
+CREATE UNDIRECTED EDGE layer_member(FROM osmlayer, TO h3place)
+CREATE GLOBAL SCHEMA_CHANGE JOB geoqb_add_layer_index_$graph_name {
+  ALTER GRAPH $graph_name ADD VERTEX osmlayer;
+  ALTER GRAPH $graph_name ADD UNDIRECTED EDGE layer_member;
+}
+RUN GLOBAL SCHEMA_CHANGE JOB geoqb_add_layer_index_$graph_name
+DROP JOB geoqb_add_layer_index_$graph_name'''
+
+    gsqlTemplate = Template(gsqlStatement)
+    gsqlScript = gsqlTemplate.substitute(valueStructure)
+    print(conn.gsql(gsqlScript, options=[]))
+
+    gqqueries.resetLayerIndex( name )
+    gqtaglayerextract._graphsWithoutLayerIndex.discard( name )
+
+    return gqqueries.runQuery( conn, "geoqb_build_layer_index", graph_name=name )
 
 
 
@@ -186,11 +345,14 @@ Use global
 DROP EDGE hasOSMTag
 DROP EDGE h3_grid_link
 DROP EDGE located_on_h3_cell
+DROP EDGE layer_member
+DROP VERTEX osmlayer
 DROP VERTEX osmtag
 DROP VERTEX h3place
 DROP VERTEX osmplace
 '''
     print(conn.gsql(gsqlStatement, options=[]))
+    gqqueries.resetLayerIndex()
 
 
 
@@ -219,18 +381,19 @@ def setupOSMGraph( conn, name ):
 
     gsqlStatement ='''
 Use global
-CREATE GRAPH $graph_name (osmtag, osmplace, h3place, hasOSMTag, h3_grid_link, located_on_h3_cell)'''
+CREATE GRAPH $graph_name (osmtag, osmplace, h3place, hasOSMTag, h3_grid_link, located_on_h3_cell, osmlayer, layer_member)'''
 
     gsqlTemplate = Template(gsqlStatement)
     gsqlScript = gsqlTemplate.substitute(valueStructure)
     print(conn.gsql(gsqlScript, options=[]))
+    gqqueries.resetLayerIndex( name )
 
 
-def installQueries( conn ):
-    print( "> W.I.P. ")
+def installQueries( conn, name=None ):
+    return gqqueries.installQueries( conn, name, verbose=True )
 
-def runInstalledQuery( conn, qKey ):
-    print( "> W.I.P. ")
+def runInstalledQuery( conn, qKey, params=None ):
+    return gqqueries.runQuery( conn, qKey, params )
 
 def cleanData( conn, name ):
     print( "> W.I.P. : clean data ...")
@@ -241,124 +404,92 @@ def cleanData( conn, name ):
 # dataDF  - this is the dataframe with the observations to be blended.
 #
 #
-def blendDataToLayerDataInTigerGraph( layer, dataDF,mappings, path_offset, conn, res = 9, dumpFile = True ):
-
-
-    print( layer )
-    print( "##..")
-
-    layer ['latCell'] = layer.apply( lambda x : gqh3.lat_lon_from_h3Index2( x["Id"] )[0], axis = 1 )
-    layer ['lonCell'] = layer.apply( lambda x : gqh3.lat_lon_from_h3Index2( x["Id"] )[1], axis = 1 )
-    print( "###...")
-
-    #FN = "./temp.tsv"  #DS_STAGE_PATH + FILE_NAMES[0]
-    #print( f">>> Read data file: {FN}")
-    #enrichmentData = pd.read_csv( FN, sep=",", compression="zip" )
-
-    enrichmentData = dataDF
-    print( enrichmentData )
-    print( "####....")
-
-    print( f">>> Calc h3index ...")
-    enrichmentData["k"] = enrichmentData.apply( lambda x : x["key"][1:len(x["key"])-1], axis = 1 )
-
-    enrichmentData["t"] = enrichmentData.apply( lambda x : datetime.utcfromtimestamp( json.loads(x["records"])['t'] ).strftime('%Y-%m-%d %H:%M:%S') , axis = 1 )
-
-    enrichmentData["temp"] = enrichmentData.apply( lambda x :  json.loads(x["records"])['temp'] , axis = 1 )
-    enrichmentData["p"] = enrichmentData.apply( lambda x : json.loads(x["records"])['p'] , axis = 1 )
-    enrichmentData["dp"] = enrichmentData.apply( lambda x : json.loads(x["records"])['dp'] , axis = 1 )
+def blendDataToLayerDataInTigerGraph( layer, dataDF,mappings, path_offset, conn, res = 9, dumpFile = True, mode = None,
+                                      chunkSize = None, maxWorkers = None ):
 
-    enrichmentData = flat_table.normalize(enrichmentData)
+    print( f">>> Blend {len(dataDF)} records into a layer with {len(layer)} nodes ...")
 
-    joined = pd.merge( layer, enrichmentData, left_on='Id', right_on='k' )
+    cells, facts, observations = prepareBlendFrames( layer, dataDF, mappings, res )
 
-    print( f">>> Add Metadata ...")
-    enrichmentData = joined.drop_duplicates(subset='Id', keep="last")
-    enrichmentData["res"] = res
-
-    cols = ["Id","t","Lat","Lon","res"]
-    colMaps = {}
-
-###
-    #    Loop over mappings
-    i = 1
-    for m in mappings:
-        print( m )
-
-        K1 = f"source{i}"
-        K2 = f"factID{i}"
-
-        enrichmentData[K1] = m[2]
-        enrichmentData[K2] = m[3]
-
-        colMaps[ m[0] ] = f"v_cn{i}"
-
-        cols.append( f"v_cn{i}")
-        cols.append( f"source{i}")
-        cols.append( f"factID{i}")
-        i=i+1
-
-    print( colMaps )
-    print( cols )
-    enrichmentData.rename( columns=colMaps, inplace=True)
-
-    # enrichmentData = enrichmentData[cols]
-
-    print( enrichmentData )
-
-    zN1t = 0;
-
-    #if dumpFile :
-    #fn = getDumpFileName( SUFFIX=SUFFIX )
-    fn = "./tempDUMP.tsv"
-    enrichmentData.to_csv( fn , index=True, sep ='\t')
+    if len( cells ) == 0 or len( observations ) == 0:
+        print( ">>> No observations for cells of the layer, nothing to blend." )
+        return []
 
+    if dumpFile :
+        fn = "./tempDUMP.tsv"
+        cells.to_csv( fn , index=True, sep ='\t')
 
     #
     #  only h3Places are loaded ... we make sure that the h3place-nodes are available in the graph.
     #
-    zN1 = conn.upsertVertexDataFrame(
-        df=enrichmentData, vertexType='h3place', v_id='Id',
-        attributes={'resolution':'res','lat':'Lat','lon':'Lon' })
-
-    zN1t = zN1t + zN1
+    #  With mode="loadingjob" the cells are posted to a loading job, the fact vertices and
+    #  observed_at edges are not part of OSM_GLOBAL_TYPES_GSQL and are always upserted.
+    #  The observations of all mappings are loaded concurrently once cells and facts exist.
+    #
+    jobs = [
+        gqtgloader.vertexJob( "h3place", cells, vertexType='h3place', v_id='Id',
+                              attributes={'resolution':'res','lat':'Lat','lon':'Lon' } ),
+        gqtgloader.vertexJob( "fact", facts, vertexType='fact', v_id='factID',
+                              attributes={'source':'source' } )
+    ]
+
+    for factID, df in observations:
+        jobs.append( gqtgloader.edgeJob( "observed_at:" + factID, df,
+                                         sourceVertexType='h3place', edgeType='observed_at', targetVertexType='fact',
+                                         from_id='Id', to_id='factID',
+                                         attributes={ 'value':'value', 'time':'t' },
+                                         dependsOn=[ "h3place", "fact" ] ) )
+
+    target = gqtgloader.getIngestTarget( conn, OSM_GLOBAL_TYPES_GSQL, mode=mode, session=getKeepAliveSession() )
+    stats = gqtgloader.upsertJobs( target, jobs, chunkSize=chunkSize, maxWorkers=maxWorkers )
+
+    zEt = sum( s["upserted"] for s in stats[2:] )
+    print( f"UPLOAD STATS: {zEt} 'observation' edges added to the graph." )
 
-########
+    return stats
 
-    zN2t = 0
-    zEt = 0
 
-    i = 1
-    while i <= len(mappings):
+#
+# Builds the payloads for all mappings in one pass.
+#
+# dataDF has a quoted cell id in "key" and a JSON document in "records" with the epoch
+# time "t" and the measured values, each record is parsed once. A mapping is a tuple
+# ( value key in the record, long name, source, fact id ).
+#
+# Returns the cells of the layer with observations (Id, t, Lat, Lon, res, values), the fact
+# vertices (factID, source) and a list of ( factID, observations[Id, factID, value, t] ).
+# An empty batch has no observations. Mappings whose value key is in none of the records
+# are reported and dropped.
+#
+def prepareBlendFrames( layer, dataDF, mappings, res = 9 ):
 
-        factIDs = f"factID{i}"
-        sourceS = f"source{i}"
-        v_cnS = f"v_cn{i}"
+    if len( dataDF ) == 0:
+        return layer.iloc[0:0].assign( res=res ), pd.DataFrame( columns=[ "factID", "source" ] ), []
 
-        zN2 = conn.upsertVertexDataFrame(
-            df=enrichmentData, vertexType='fact', v_id=factIDs,
-            attributes={'source':sourceS } )
-        zN2t = zN2t + zN2
+    records = pd.DataFrame.from_records( [ json.loads( r ) if isinstance( r, str ) else r for r in dataDF["records"].tolist() ],
+                                         index=dataDF.index )
 
-        print( "+++***+++")
+    missing = [ m for m in mappings if m[0] not in records.columns ]
+    if len( missing ) > 0:
+        print( f"!!! The records have no values for {', '.join( m[0] for m in missing )}, these mappings are dropped." )
+        mappings = [ m for m in mappings if m[0] in records.columns ]
 
-        print( enrichmentData.columns )
-        zE = conn.upsertEdgeDataFrame(
-            df=enrichmentData,
-            sourceVertexType='h3place',
-            edgeType='observed_at',
-            targetVertexType='fact',
-            from_id='Id',
-            to_id=factIDs,
-            attributes={ 'value':v_cnS, 'time':'t' } )
+    data = pd.DataFrame( { "k" : dataDF["key"].astype( str ).str.slice( 1, -1 ) }, index=dataDF.index )
+    data["t"] = pd.to_datetime( records["t"], unit="s", utc=True ).dt.strftime( '%Y-%m-%d %H:%M:%S' )
+    for m in mappings:
+        data[ m[0] ] = records[ m[0] ]
 
-        print( "---+++***+++---")
-        i = i + 1
+    joined = pd.merge( layer, data, left_on='Id', right_on='k' )
+    cells = joined.drop_duplicates( subset='Id', keep="last" ).reset_index( drop=True )
+    cells["res"] = res
 
-        zEt = zEt + zE
+    facts = pd.DataFrame( { "factID" : [ m[3] for m in mappings ], "source" : [ m[2] for m in mappings ] } ).drop_duplicates( subset="factID", keep="last" )
 
+    # mappings which share a fact id go into one frame, there is one upsert job per fact
+    perFact = {}
+    for m in mappings:
+        perFact.setdefault( m[3], [] ).append( pd.DataFrame( { "Id" : cells["Id"], "factID" : m[3], "value" : cells[ m[0] ], "t" : cells["t"] } ) )
 
-########
-    print( f"UPLOAD STATS: {zEt} 'observation' edges added to the graph." )
+    observations = [ ( factID, pd.concat( frames, ignore_index=True ) ) for factID, frames in perFact.items() ]
 
-    return
+    return cells, facts, observations
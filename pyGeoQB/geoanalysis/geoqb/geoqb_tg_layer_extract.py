@@ -1,19 +1,21 @@
 from string import Template
 import pandas as pd
 
-import flat_table
-
 import geoanalysis.geoqb.geoqb_h3 as gqh3
+import geoanalysis.geoqb.geoqb_tg_queries as gqqueries
 
 import matplotlib.pyplot as plt
 
 from os.path import exists
 
+import os
+import json
+import hashlib
+
 import networkx as nx
 
 import pylab as plt #import Matplotlib plotting interface
 
-import json
 
 persistentQuery2b='''
 
@@ -57,49 +59,207 @@ CREATE QUERY loadAll(/* Parameters here */) FOR GRAPH  {
 }
 '''
 
+#
+# Change marker of the layers for graphs without the layer index (see getLayerMarker).
+# The paged exports are registered queries (geoqb_tg_queries), they are installed on first
+# use or together with layerMarker by installPagedExportQueries.
+#
+persistentQuery2c='''
+
+USE GRAPH $graph_name
+
+CREATE QUERY layerMarker(STRING lID1) FOR GRAPH $graph_name {
+
+    MapAccum<STRING, INT> @@edgesPerLayer;
+
+    start = ANY;
+
+    tmp = SELECT s FROM start:s -(:e)-> :t
+    WHERE instr ( e.layer_id, lID1 ) >= 0
+    accum
+    @@edgesPerLayer += ( e.layer_id -> 1 );
+
+    PRINT @@edgesPerLayer;
+
+}
+
+INSTALL QUERY layerMarker
+'''
+
+EXPORT_PAGES = int( os.environ.get('GEOQB_EXPORT_PAGES', 8) )
+EXPORT_PAGE_SEEDS = int( os.environ.get('GEOQB_EXPORT_PAGE_SEEDS', 5000) )
+EXPORT_SIZE_LIMIT = 120*1024*1024
+
+
+class ExportSizeLimitError( Exception ):
+    pass
+
+
+def installPagedExportQueries( conn, graph_name ):
+    gsqlScript = Template( persistentQuery2c ).substitute( { 'graph_name' : graph_name } )
+    print( conn.gsql( gsqlScript, options=[] ) )
+    return gqqueries.installQueries( conn, graph_name, verbose=True )
+
+
+def _isSizeLimitError( e ):
+    m = str( e ).lower()
+    return "size" in m and ( "limit" in m or "exceed" in m )
+
 
+#
+# Columnar frames with the layout of flat_table.normalize (index, v_id, v_type, attributes.*).
+#
+NODE_COLUMNS = [ "v_id", "v_type" ]
+EDGE_COLUMNS = [ "e_type", "directed", "from_id", "from_type", "to_id", "to_type" ]
+
+def _recordsToFrame( records, offset=0, baseColumns=() ):
+
+    z = len( records )
+    columns = { k : [None] * z for k in baseColumns }
+
+    for i, r in enumerate( records ):
+        for k, v in r.items():
+            if isinstance( v, dict ):
+                for ak, av in v.items():
+                    columns.setdefault( k + "." + ak, [None] * z )[i] = av
+            else:
+                columns.setdefault( k, [None] * z )[i] = v
+
+    df = pd.DataFrame( columns )
+    df.insert( 0, "index", range( offset, offset + z ) )
+    return df
+
+
+def _checkResult( result, queryName ):
+    if not isinstance( result, list ) or len( result ) < 2 or "nodes1" not in result[0] or "@@edgeset" not in result[1]:
+        raise ValueError( f"Unexpected result of query {queryName}: {str( result )[:200]}" )
+    return result[0]["nodes1"], result[1]["@@edgeset"]
+
+
+#
+# Splits the seed cells into at least numPages pages of at most EXPORT_PAGE_SEEDS cells.
+# The h3 indexes are sorted, so the cells of a page are runs which share their H3 parents.
+#
+def seedPages( seeds, numPages=None ):
+
+    seeds = sorted( set( seeds ) )
+    if len( seeds ) == 0:
+        return []
+
+    n = max( numPages or EXPORT_PAGES, -( -len( seeds ) // EXPORT_PAGE_SEEDS ) )
+    size = -( -len( seeds ) // n )
+    return [ seeds[i:i+size] for i in range( 0, len( seeds ), size ) ]
+
+
+#
+# Yields ( nodes, edges ) per page of seed cells. A page which exceeds the response size
+# limit is split in two halves until it fits or holds a single cell.
+#
+def iterExportPages( conn, queryName, params, seeds, numPages=None, sizeLimit=EXPORT_SIZE_LIMIT ):
+
+    queue = seedPages( seeds, numPages )
+
+    while len( queue ) > 0:
+
+        page = queue.pop( 0 )
+        pageParams = dict( params )
+        pageParams['seeds'] = page
+
+        try:
+            result = gqqueries.runQuery( conn, queryName, pageParams, sizeLimit=sizeLimit, usePost=True )
+        except Exception as e:
+            if not _isSizeLimitError( e ):
+                raise
+            if len( page ) < 2:
+                raise ExportSizeLimitError( f"The page of cell {page[0]} of {queryName} exceeds the size limit of {sizeLimit} bytes." )
+            print( f">>> Page of {len( page )} cells of {queryName} exceeds the size limit, splitting it." )
+            half = len( page ) // 2
+            queue[0:0] = [ page[:half], page[half:] ]
+            continue
+
+        yield _checkResult( result, queryName )
+
+
+#
+# Streams all pages into a node and an edge frame. Vertices and undirected edges seen on
+# more than one page are kept once.
+#
+def exportGraphFrames( conn, queryName, params, seeds, numPages=None, verbose=True ):
+
+    nodeFrames = []
+    edgeFrames = []
+    nNodes = 0
+    nEdges = 0
+
+    for i, ( nodes, edges ) in enumerate( iterExportPages( conn, queryName, params, seeds, numPages ) ):
+        nodeFrames.append( _recordsToFrame( nodes, nNodes, NODE_COLUMNS ) )
+        edgeFrames.append( _recordsToFrame( edges, nEdges, EDGE_COLUMNS ) )
+        nNodes = nNodes + len( nodes )
+        nEdges = nEdges + len( edges )
+        if verbose:
+            print( f">   page {i}: {len( nodes )} nodes, {len( edges )} edges" )
+
+    dfS = pd.concat( nodeFrames, ignore_index=True ) if len( nodeFrames ) > 0 else _recordsToFrame( [], 0, NODE_COLUMNS )
+    dfedges = pd.concat( edgeFrames, ignore_index=True ) if len( edgeFrames ) > 0 else _recordsToFrame( [], 0, EDGE_COLUMNS )
+
+    if len( nodeFrames ) > 1:
+        dfS = dfS[ ~dfS.duplicated( subset=[ "v_type", "v_id" ] ) ].reset_index( drop=True )
+        dfS["index"] = range( len( dfS ) )
+
+    if len( dfedges ) > 0:
+        a = dfedges["from_id"].astype( str )
+        b = dfedges["to_id"].astype( str )
+        key = pd.DataFrame( { "e_type" : dfedges["e_type"], "a" : a.where( a <= b, b ), "b" : b.where( a <= b, a ) } )
+        dfedges = dfedges[ ~key.duplicated() ].reset_index( drop=True )
+        dfedges["index"] = range( len( dfedges ) )
+
+    return dfS, dfedges
 
-def getTagLayerForParaForOSMGraph( conn, graph_name, res = 9 , WORKPATH="./temp/", overwrite=False, verbose=True, s1 = " ", s2 = " " ):
 
-    path_to_buffer_file = WORKPATH + graph_name +"_"+str(res) + "_OSM_tag_layer_" + s1 + "_" + s2 + "_data.json"
-    path_to_edgelist_file = WORKPATH + graph_name +"_"+str(res) + "_OSM_tag_layer_" + s1 + "_" + s2 + "_edge_list.csv"
-    path_to_nodelist_file = WORKPATH + graph_name +"_"+str(res) + "_OSM_tag_layer_" + s1 + "_" + s2 + "_node_list.csv"
-    t = ""
+def _isMissingPagedQueryError( e ):
+    return gqqueries.isMissingQueryError( e ) or isinstance( e, gqqueries.QueryInstallError )
 
-    file_exists = exists(path_to_buffer_file)
-    if not file_exists or overwrite:
 
-        valueStructure = {
-            'graph_name' : graph_name,
-            'res' : str(res),
-            'lID1' : s1,
-            'lID2' : s2
-        }
+#
+# Paged export seeded with all h3places. Graphs on which the paged queries can not be
+# installed fall back to the single legacy query (loadLayer / loadAll).
+#
+def _exportLayer( conn, pagedQuery, params, legacyQuery, legacyParams, numPages=None, verbose=True ):
+    try:
+        seeds = gqqueries.runQuery( conn, "geoqb_place_ids" )
+        return exportGraphFrames( conn, pagedQuery, params, seeds, numPages, verbose=verbose )
+    except ExportSizeLimitError:
+        raise
+    except Exception as e:
+        if not _isMissingPagedQueryError( e ):
+            raise
+        print( f">>> Query {pagedQuery} is not available ({str( e )[:120]}), using {legacyQuery}." )
 
-        params = valueStructure
+    return _exportLegacy( conn, legacyQuery, legacyParams )
 
-        preInstalledResult = conn.runInstalledQuery("loadLayer", params, sizeLimit=120*1024*1024)
-        print( type(preInstalledResult) )
-        print( len(preInstalledResult) )
 
-        f = open( path_to_buffer_file, "w")
-        f.write( json.dumps( preInstalledResult ) )
-        f.flush()
-        f.close()
+def _exportLegacy( conn, legacyQuery, params ):
+    try:
+        result = conn.runInstalledQuery( legacyQuery, params if len( params ) > 0 else None, sizeLimit=EXPORT_SIZE_LIMIT )
+    except Exception as e:
+        if _isSizeLimitError( e ):
+            raise ExportSizeLimitError( f"{legacyQuery} exceeds the size limit of {EXPORT_SIZE_LIMIT} bytes, install the paged export queries (gqqueries.installQueries)." )
+        raise
 
-    #print( t )
+    nodes, edges = _checkResult( result, legacyQuery )
+    return _recordsToFrame( nodes, 0, NODE_COLUMNS ), _recordsToFrame( edges, 0, EDGE_COLUMNS )
 
-#    print( "*******")
 
-    f2 = open( path_to_buffer_file, "r")
-    data = json.load(f2)
 
-#    print( "###############")
-    dfS = pd.DataFrame(data[0]["nodes1"])
-    dfS = flat_table.normalize(dfS)
+def _layerFileNames( WORKPATH, graph_name, res, s1, s2 ):
+    base = WORKPATH + graph_name +"_"+str(res) + "_OSM_tag_layer_" + s1 + "_" + s2
+    return base + "_node_list.csv", base + "_edge_list.csv"
+
+
+def _finishLayerFrames( dfS, dfedges, path_to_nodelist_file, path_to_edgelist_file ):
+
     expected_type = "h3place"
-    dfS ['lat'] = dfS.apply( lambda x : gqh3.lat_lon_from_h3Index( x["v_id"], x["v_type"], expected_type )[0], axis = 1 )
-    dfS ['lon'] = dfS.apply( lambda x : gqh3.lat_lon_from_h3Index( x["v_id"], x["v_type"], expected_type )[1], axis = 1 )
+    dfS ['lat'], dfS ['lon'] = gqh3.h3Centroids_batch( dfS["v_id"], dfS["v_type"], expected_type )
     dfS = dfS.rename(columns={
         'v_id':'Id',
         'attributes.lat':'Lat',
@@ -108,66 +268,235 @@ def getTagLayerForParaForOSMGraph( conn, graph_name, res = 9 , WORKPATH="./temp/
 
     dfS.to_csv(path_to_nodelist_file, index=False, sep ='\t')
 
-    #print( dfnetwork )
- #   print( "### NETWORK ###")
-  #  print( "###############")
-
-
-   # print( "\n###############")
-
-    dfedges = pd.DataFrame(data[1]["@@edgeset"])
-
     dfedges = dfedges.rename(columns={
         'from_id':'Source',
         'to_id':'Target'
     })
 
-    dfedges = flat_table.normalize(dfedges)
     dfedges.to_csv(path_to_edgelist_file, index=False, sep ='\t')
-    #print( "###  EDGES  ###")
-    #print( "###############")
 
     return dfS, dfedges
 
 
+#
+# Layer extraction through the layer index (osmlayer / layer_member, see geoqb_tg).
+#
+# The cost of the indexed queries depends on the size of the selected layers. If the graph
+# has no layer index, or the layers were loaded before it existed (no result), the export
+# falls back to the queries which scan all edges for their layer_id.
+#
+_graphsWithoutLayerIndex = set()
 
+def _isMissingLayerIndexError( e ):
+    return _isMissingPagedQueryError( e ) or gqqueries.isMissingSchemaError( e )
 
-def getTagLayerForResolutionForOSMGraph( conn, graph_name, WORKPATH="./temp/", res = 9 , overwrite=False, verbose=True ):
+def _exportIndexedLayer( conn, s1, s2a, s2b, numPages=None, verbose=True ):
 
-    path_to_buffer_file = WORKPATH + graph_name +"_"+str(res) + "_OSM_tag_layer_data.json"
-    path_to_edgelist_file = WORKPATH + graph_name +"_"+str(res) + "_OSM_tag_layer_edge_list.csv"
-    path_to_nodelist_file = WORKPATH + graph_name +"_"+str(res) + "_OSM_tag_layer_node_list.csv"
+    graph_name = getattr( conn, "graphname", None )
+    if graph_name in _graphsWithoutLayerIndex or not gqqueries.hasLayerIndex( conn ):
+        return None
+
+    params = { 'lID1' : s1, 'lID2a' : s2a, 'lID2b' : s2b }
+
+    try:
+        seeds = gqqueries.runQuery( conn, "geoqb_layer_cells", params )
+        if len( seeds ) == 0:
+            print( f">>> Layer {s1} is not in the layer index (see gqtg.addLayerIndexToOSMGraph), scanning the layer edges." )
+            return None
+        return exportGraphFrames( conn, "geoqb_layer_page", params, seeds, numPages, verbose=verbose )
+    except ExportSizeLimitError:
+        raise
+    except Exception as e:
+        if not _isMissingLayerIndexError( e ):
+            raise
+        print( f">>> Layer index is not available ({str( e )[:120]}), scanning the layer edges." )
+        _graphsWithoutLayerIndex.add( graph_name )
+        return None
+
+
+def getTagLayerForParaForOSMGraph( conn, graph_name, res = 9 , WORKPATH="./temp/", overwrite=False, verbose=True, s1 = " ", s2 = " ", intCells=None, numPages=None ):
+
+    path_to_nodelist_file, path_to_edgelist_file = _layerFileNames( WORKPATH, graph_name, res, s1, s2 )
+
+    expected_type = "h3place"
+
+    if not overwrite and exists(path_to_nodelist_file) and exists(path_to_edgelist_file):
+        dfS, dfedges = _readLayerFiles( path_to_nodelist_file, path_to_edgelist_file )
+        return _addCellColumns( dfS, dfedges, intCells, expected_type )
+
+    params = {
+        'lID1' : s1,
+        'lID2' : s2
+    }
+
+    frames = _exportIndexedLayer( conn, s1, s2, s2, numPages, verbose=verbose )
+    if frames is None:
+        frames = _exportLayer( conn, "geoqb_layer_scan_page", { 'lID1' : s1, 'lID2a' : s2, 'lID2b' : s2 },
+                               "loadLayer", params, numPages, verbose=verbose )
+
+    dfS, dfedges = frames
+    dfS, dfedges = _finishLayerFrames( dfS, dfedges, path_to_nodelist_file, path_to_edgelist_file )
+
+    return _addCellColumns( dfS, dfedges, intCells, expected_type )
+
+
+######################################################
+#  Layer snapshots validated by a change marker.
+#
+#  The marker of a layer is the number of edges per layer_id which contain s1 (query
+#  layerMarker), it changes with every upsert or delete of layer edges. The snapshot files
+#  of all variants (e.g. POS and NEG) are only exported again if the marker differs from
+#  the one stored next to them. All variants come from one paged query.
+#
+def getLayerMarker( conn, s1 ):
+
+    counts = None
+
+    if getattr( conn, "graphname", None ) not in _graphsWithoutLayerIndex and gqqueries.hasLayerIndex( conn ):
+        try:
+            counts = gqqueries.runQuery( conn, "geoqb_layer_marker", { 'lID1' : s1 } )
+        except Exception as e:
+            if not _isMissingLayerIndexError( e ):
+                raise
+            print( f">>> Layer index is not available ({str( e )[:120]}), scanning the layer edges." )
+            _graphsWithoutLayerIndex.add( getattr( conn, "graphname", None ) )
+
+    if not counts:
+        try:
+            result = conn.runInstalledQuery( "layerMarker", { 'lID1' : s1 } )
+        except Exception as e:
+            if not gqqueries.isMissingQueryError( e ):
+                raise
+            print( ">>> Query layerMarker is not installed (see installPagedExportQueries), layer snapshots are always refreshed." )
+            return None
+        counts = result[0]["@@edgesPerLayer"]
+
+    text = json.dumps( sorted( counts.items() ) )
+    return hashlib.sha256( text.encode( "utf-8" ) ).hexdigest()
+
+
+#
+# The edges of a variant and their end vertices. A page set without any edge (empty layer)
+# has no attributes.layer_id column, the variant is empty then.
+#
+def _splitVariant( dfS, dfedges, variant ):
+    if len( dfedges ) == 0 or "attributes.layer_id" not in dfedges.columns:
+        edges = dfedges.iloc[0:0]
+    else:
+        edges = dfedges[ dfedges["attributes.layer_id"].astype( str ).str.contains( variant, regex=False ) ]
+    ends = set( zip( edges["from_id"], edges["from_type"] ) ) | set( zip( edges["to_id"], edges["to_type"] ) )
+    nodes = dfS[ pd.Series( [ k in ends for k in zip( dfS["v_id"], dfS["v_type"] ) ], index=dfS.index, dtype=bool ) ]
+    nodes = nodes.reset_index( drop=True ).assign( index=range( len( nodes ) ) )
+    edges = edges.reset_index( drop=True ).assign( index=range( len( edges ) ) )
+    return nodes, edges
+
+
+def _exportLayerVariants( conn, s1, variants, numPages=None, verbose=True ):
+
+    frames = {}
+    seeds = None
+
+    for i in range( 0, len( variants ), 2 ):
+
+        pair = list( variants[i:i+2] )
+        params = { 'lID1' : s1, 'lID2a' : pair[0], 'lID2b' : pair[-1] }
+
+        indexed = _exportIndexedLayer( conn, s1, pair[0], pair[-1], numPages, verbose=verbose )
+        if indexed is not None:
+            for v in pair:
+                frames[v] = _splitVariant( indexed[0], indexed[1], v )
+            continue
 
-    t = ""
+        try:
+            if seeds is None:
+                seeds = gqqueries.runQuery( conn, "geoqb_place_ids" )
+            dfS, dfedges = exportGraphFrames( conn, "geoqb_layer_scan_page", params, seeds, numPages, verbose=verbose )
+        except ExportSizeLimitError:
+            raise
+        except Exception as e:
+            if not _isMissingPagedQueryError( e ):
+                raise
+            print( f">>> Query geoqb_layer_scan_page is not available ({str( e )[:120]}), one export of loadLayer per variant." )
+            for v in pair:
+                frames[v] = _exportLegacy( conn, "loadLayer", { 'lID1' : s1, 'lID2' : v } )
+            continue
 
-    file_exists = exists(path_to_buffer_file)
+        for v in pair:
+            frames[v] = _splitVariant( dfS, dfedges, v )
 
-    data = None
+    return frames
 
-    if not file_exists or overwrite:
 
-        preInstalledQResult = conn.runInstalledQuery("loadAll", None, sizeLimit=120*1024*1024)
-        data = preInstalledQResult
+def getTagLayerVariantsForOSMGraph( conn, graph_name, res = 9 , WORKPATH="./temp/", overwrite=False, verbose=True,
+                                    s1 = " ", variants=( "POS", "NEG" ), intCells=None, numPages=None ):
 
-        f = open( path_to_buffer_file, "w")
-        f.write( json.dumps( preInstalledQResult ) )
-        f.flush()
-        f.close()
+    expected_type = "h3place"
+
+    files = { v : _layerFileNames( WORKPATH, graph_name, res, s1, v ) for v in variants }
+    path_to_marker_file = WORKPATH + graph_name +"_"+str(res) + "_OSM_tag_layer_" + s1 + "_marker.json"
+
+    marker = getLayerMarker( conn, s1 )
+
+    stored = {}
+    if exists( path_to_marker_file ):
+        with open( path_to_marker_file ) as f:
+            stored = json.load( f )
+
+    fresh = not overwrite and marker is not None and all(
+        stored.get( v ) == marker and exists( files[v][0] ) and exists( files[v][1] ) for v in variants )
+
+    result = {}
+
+    if fresh:
+        if verbose:
+            print( f">>> Layer {s1} is unchanged, using the snapshot files." )
+        for v in variants:
+            result[v] = _readLayerFiles( *files[v] )
 
     else:
-        f = open( path_to_buffer_file, "r")
-        data = json.load(f)
-        f.close
+        frames = _exportLayerVariants( conn, s1, list( variants ), numPages, verbose=verbose )
+        for v in variants:
+            result[v] = _finishLayerFrames( frames[v][0], frames[v][1], *files[v] )
+            stored[v] = marker
+        with open( path_to_marker_file, "w" ) as f:
+            json.dump( stored, f, indent=2 )
+
+    return { v : _addCellColumns( dfS, dfedges, intCells, expected_type ) for v, ( dfS, dfedges ) in result.items() }
+
+
+def _readLayerFiles( path_to_nodelist_file, path_to_edgelist_file ):
+    dfS = pd.read_csv( path_to_nodelist_file, sep='\t', dtype={'Id':str} )
+    dfedges = pd.read_csv( path_to_edgelist_file, sep='\t', dtype={'Source':str, 'Target':str} )
+    return dfS, dfedges
+
+#
+# the h3place ids are carried as uint64 cells next to the (mixed) vertex ids
+#
+def _addCellColumns( dfS, dfedges, intCells, expected_type ):
+    if gqh3.useIntCells( intCells ):
+        dfS['h3cell'] = gqh3.h3CellColumn( dfS['Id'], dfS['v_type'], expected_type )
+        dfedges['h3cell'] = gqh3.h3CellColumn( dfedges['Target'], dfedges['to_type'], expected_type )
+    return dfS, dfedges
+
+
+
+
+def getTagLayerForResolutionForOSMGraph( conn, graph_name, WORKPATH="./temp/", res = 9 , overwrite=False, verbose=True, numPages=None ):
+
+    path_to_edgelist_file = WORKPATH + graph_name +"_"+str(res) + "_OSM_tag_layer_edge_list.csv"
+    path_to_nodelist_file = WORKPATH + graph_name +"_"+str(res) + "_OSM_tag_layer_node_list.csv"
+
+    if not overwrite and exists(path_to_nodelist_file) and exists(path_to_edgelist_file):
+        return _readLayerFiles( path_to_nodelist_file, path_to_edgelist_file )
+
+    dfS, dfedges = _exportLayer( conn, "geoqb_all_page", {}, "loadAll", {}, numPages, verbose=verbose )
 
     print( "**********************************************")
-    print( f"* Nr of item sets in graph export query: {len(data)}" )
+    print( f"* Graph export: {len(dfS)} nodes, {len(dfedges)} edges" )
     print( "**********************************************")
 
-    dfS = pd.DataFrame(data[0]["nodes1"])
-    dfS = flat_table.normalize(dfS)
     expected_type = "h3place"
-    dfS ['lat'] = dfS.apply( lambda x : gqh3.lat_lon_from_h3Index( x["v_id"], x["v_type"], expected_type )[0], axis = 1 )
-    dfS ['lon'] = dfS.apply( lambda x : gqh3.lat_lon_from_h3Index( x["v_id"], x["v_type"], expected_type )[1], axis = 1 )
+    dfS ['lat'], dfS ['lon'] = gqh3.h3Centroids_batch( dfS["v_id"], dfS["v_type"], expected_type )
     dfS = dfS.rename(columns={
         'v_id':'Id',
         'attributes.lat':'Lat',
@@ -177,16 +506,12 @@ def getTagLayerForResolutionForOSMGraph( conn, graph_name, WORKPATH="./temp/", r
     dfS.to_csv(path_to_nodelist_file, index=False, sep ='\t')
     print( ">   item set 'nodes1' ... DONE.")
 
-    dfedges = pd.DataFrame(data[1]["@@edgeset"])
-
     dfedges = dfedges.rename(columns={
         'from_id':'Source',
         'to_id':'Target'
     })
 
-    dfedges = flat_table.normalize(dfedges)
     dfedges.to_csv(path_to_edgelist_file, index=False, sep ='\t')
     print( ">   item set '@@edgeset' ... DONE.")
 
     return dfS, dfedges
-
@@ -1,86 +1,36 @@
 from string import Template
 import pandas as pd
 
-import flat_table
+import json
+
+import geoanalysis.geoqb.geoqb_tg_queries as gqqueries
 
 import matplotlib.pyplot as plt
 
 from os.path import exists
 
-persistentQuery3a='''
-
-USE GRAPH $graph_name
-
-INTERPRET QUERY () SYNTAX v2 {
-
-    SumAccum<int> @osmtagCnt=0;
-
-    histogram = SELECT t
-           FROM :t -(hasOSMTag:e)- :s
-           WHERE s.resolution == $res
-           ACCUM t.@osmtagCnt += 1;
-
-    PRINT histogram;
-    PRINT $res as resolution;
-
-}'''
-
-
-persistentQuery3b='''
-CREATE QUERY osm_tag_histogram(INT res) FOR GRAPH $graph_name {
-
-    SumAccum<int> @osmtagCnt=0;
-
-    Result_tags = SELECT t
-           FROM :t -(hasOSMTag:e)- :s
-           WHERE s.resolution == res
-           ACCUM t.@osmtagCnt += 1;
-
-    PRINT histogram;
-    PRINT res as resolution;
-
-}'''
-
-
-def getTagHistogramForOSMGraph( conn, graph_name, overwrite=False, verbose=True ):
-    path_to_buffer_file = "tag_histogram_layers_data_"+ graph_name +".json"
+#
+# The histogram query is installed through the query registry (geoqb_tg_queries, key
+# "geoqb_tag_histogram") and parameterized with the resolution of the h3places.
+#
+def getTagHistogramForOSMGraph( conn, graph_name, overwrite=False, verbose=True, res=9 ):
+    path_to_buffer_file = "tag_histogram_layers_data_"+ graph_name + "_" + str(res) + ".json"
     file_exists = exists(path_to_buffer_file)
     if not file_exists or overwrite:
 
-        valueStructure = {
-            'graph_name' : graph_name,
-            'res' : 9
-        }
-
-        gsqlStatement = persistentQuery3a
-
-        gsqlTemplate = Template(gsqlStatement)
-        gsqlScript = gsqlTemplate.substitute(valueStructure)
-
         if verbose:
-            print( gsqlScript )
-
-        result = conn.gsql(gsqlScript, options=[])
-
-        f = open( path_to_buffer_file, "w")
-        f.write( result )
-        f.flush()
-        f.close()
+            print( gqqueries.getQueryGSQL( "geoqb_tag_histogram", graph_name ) )
 
-    rows = None
-    with open(path_to_buffer_file, "r") as f:
-        rows = f.readlines()[1:]
+        data = gqqueries.runQuery( conn, "geoqb_tag_histogram", { 'res' : res }, graph_name=graph_name )
 
-    t = ""
-    for r in rows:
-        t=t+r
+        with open( path_to_buffer_file, "w" ) as f:
+            json.dump( data, f )
 
-    import json
-    data = json.loads(t)
+    else:
+        with open( path_to_buffer_file, "r" ) as f:
+            data = json.load( f )
 
-    dfF = pd.DataFrame(data["results"][0]["histogram"])
-    df1 = flat_table.normalize(dfF)
-    #print(df1)
+    df1 = pd.json_normalize( data[0]["histogram"] )
 
     df2 = df1.rename(columns={
         'attributes.@osmtagCnt':'osmtagCnt',
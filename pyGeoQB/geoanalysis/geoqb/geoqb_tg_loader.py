@@ -0,0 +1,427 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+######################################################
+#  Chunked bulk upserts into TigerGraph.
+#
+#  Every frame is split into chunks of TG_UPSERT_CHUNK_SIZE rows which are sent by a pool
+#  of TG_UPSERT_WORKERS threads. An edge job names the vertex jobs it depends on, its chunks
+#  are only scheduled when all chunks of those vertex jobs are loaded. Independent jobs
+#  overlap, e.g. hasOSMTag edges load while the osmplace vertices are still on the way.
+#
+#  A failed chunk is retried on its own (TG_UPSERT_RETRIES, exponential backoff), the other
+#  chunks of the layer are not sent again.
+#
+TG_UPSERT_CHUNK_SIZE = int( os.environ.get('GEOQB_TG_UPSERT_CHUNK_SIZE', 20000) )
+TG_UPSERT_WORKERS = int( os.environ.get('GEOQB_TG_UPSERT_WORKERS', 4) )
+TG_UPSERT_RETRIES = int( os.environ.get('GEOQB_TG_UPSERT_RETRIES', 3) )
+TG_UPSERT_BACKOFF = float( os.environ.get('GEOQB_TG_UPSERT_BACKOFF', 2.0) )
+
+#
+# "upsert" sends the chunks as REST++ upserts, "loadingjob" posts them as CSV to loading jobs.
+#
+TG_INGEST_MODE = os.environ.get('GEOQB_TG_INGEST_MODE', 'upsert')
+
+
+class UpsertJob:
+
+    def __init__( self, name, kind, df, upsertArgs, dependsOn=() ):
+        self.name = name
+        self.kind = kind
+        self.df = df
+        self.upsertArgs = upsertArgs
+        self.dependsOn = tuple( dependsOn )
+        self.rows = 0
+        self.upserted = 0
+        self.retries = 0
+        self.seconds = 0.0
+        self.started = None
+        self.finished = None
+
+    def chunks( self, chunkSize ):
+        z = len( self.df )
+        return [ self.df.iloc[i:i+chunkSize] for i in range( 0, z, chunkSize ) ]
+
+    def getStats( self ):
+        wall = ( self.finished or time.time() ) - ( self.started or time.time() )
+        return {
+            "job" : self.name,
+            "kind" : self.kind,
+            "rows" : self.rows,
+            "upserted" : self.upserted,
+            "retries" : self.retries,
+            "seconds" : round( wall, 3 ),
+            "chunk_seconds" : round( self.seconds, 3 ),
+            "rows_per_s" : round( self.rows / wall, 1 ) if wall > 0 else None
+        }
+
+
+def vertexJob( name, df, vertexType, v_id, attributes ):
+    return UpsertJob( name, "vertex", df,
+                      { "vertexType" : vertexType, "v_id" : v_id, "attributes" : attributes } )
+
+def edgeJob( name, df, sourceVertexType, edgeType, targetVertexType, from_id, to_id, attributes, dependsOn=() ):
+    return UpsertJob( name, "edge", df,
+                      { "sourceVertexType" : sourceVertexType, "edgeType" : edgeType,
+                        "targetVertexType" : targetVertexType, "from_id" : from_id, "to_id" : to_id,
+                        "attributes" : attributes },
+                      dependsOn )
+
+
+def _upsertChunk( conn, job, chunk ):
+    if isinstance( conn, LoadingJobLoader ):
+        return conn.loadChunk( job, chunk )
+    if job.kind == "vertex":
+        return conn.upsertVertexDataFrame( df=chunk, **job.upsertArgs )
+    return conn.upsertEdgeDataFrame( df=chunk, **job.upsertArgs )
+
+
+def _runChunk( conn, job, chunk, retries, backoff, lock ):
+
+    attempt = 0
+    while True:
+        t0 = time.time()
+        try:
+            z = _upsertChunk( conn, job, chunk )
+            break
+        except Exception as e:
+            attempt = attempt + 1
+            with lock:
+                job.retries = job.retries + 1
+            if attempt > retries:
+                raise RuntimeError( f"Upsert of {len(chunk)} rows for {job.name} failed after {retries} retries: {e}" )
+            wait_s = backoff * ( 2 ** ( attempt - 1 ) )
+            print( f"!!! Upsert chunk for {job.name} failed ({e}), retry {attempt}/{retries} in {wait_s:.1f} s." )
+            time.sleep( wait_s )
+
+    with lock:
+        job.upserted = job.upserted + ( z if isinstance( z, int ) else 0 )
+        job.seconds = job.seconds + ( time.time() - t0 )
+
+    return z
+
+
+######################################################
+#  Loading jobs.
+#
+#  For every vertex or edge type and set of mapped attributes a loading job is generated
+#  from the type definitions (see geoqb_tg.OSM_GLOBAL_TYPES_GSQL) and created once per graph.
+#  A chunk is posted as CSV to the REST++ endpoint /ddl/<graph> of its job. The columns of
+#  the CSV are the id column(s) followed by the mapped attributes in schema order, attributes
+#  which are not mapped are loaded as "_" (default value), like an upsert which omits them.
+#
+_TYPE_RE = re.compile( r'CREATE\s+(?:(?:UNDIRECTED|DIRECTED)\s+)?(VERTEX|EDGE)\s+(\w+)\s*\(([^)]*)\)', re.IGNORECASE )
+
+def parseTypeDefinitions( gsql ):
+
+    types = {}
+
+    for kind, name, body in _TYPE_RE.findall( gsql ):
+
+        spec = { "kind" : kind.lower(), "attributes" : [] }
+
+        for part in [ p.strip() for p in body.split( "," ) if p.strip() ]:
+            tokens = part.split()
+            key = tokens[0].upper()
+            if key == "PRIMARY_ID":
+                spec["primaryId"] = tokens[1]
+            elif key in ( "FROM", "TO" ):
+                spec[ key.lower() ] = tokens[1]
+            else:
+                spec["attributes"].append( tokens[0] )
+
+        types[name] = spec
+
+    return types
+
+
+def _csvColumns( job, spec ):
+    args = job.upsertArgs
+    if job.kind == "vertex":
+        ids = [ args["v_id"] ]
+    else:
+        ids = [ args["from_id"], args["to_id"] ]
+    attributes = args.get( "attributes" ) or {}
+    mapped = [ a for a in spec["attributes"] if a in attributes ]
+    return ids, mapped, [ attributes[a] for a in mapped ]
+
+
+#
+# The name depends on the type definition and the mapped attributes, a job created for an
+# older schema of the type is not reused.
+#
+def getLoadingJobName( typeName, spec, mapped ):
+    text = json.dumps( { "type" : spec, "mapped" : list( mapped ) }, sort_keys=True )
+    digest = hashlib.sha1( text.encode( "utf-8" ) ).hexdigest()[:8]
+    return f"geoqb_load_{typeName}_{digest}"
+
+#
+# GSQL reports "Successfully created loading jobs: [<name>]." or that the job exists already,
+# any other output (semantic check failures, conflicts, ...) means the job is not there.
+#
+def _loadingJobCreated( result, jobName ):
+    m = result.lower()
+    if re.search( r"successfully created loading jobs?", m ) and jobName.lower() in m:
+        return True
+    return jobName.lower() in m and "already exist" in m
+
+def getLoadingJobGSQL( graph_name, typeName, spec, mapped ):
+
+    nIds = 1 if spec["kind"] == "vertex" else 2
+    values = [ f"${i}" for i in range( nIds ) ]
+    for a in spec["attributes"]:
+        values.append( f"${nIds + mapped.index( a )}" if a in mapped else "_" )
+
+    target = "VERTEX" if spec["kind"] == "vertex" else "EDGE"
+
+    return f'''USE GRAPH {graph_name}
+CREATE LOADING JOB {getLoadingJobName( typeName, spec, mapped )} FOR GRAPH {graph_name} {{
+  DEFINE FILENAME f;
+  LOAD f TO {target} {typeName} VALUES({", ".join( values )}) USING SEPARATOR=",", HEADER="false", EOL="\\n", QUOTE="double";
+}}'''
+
+
+class LoadingJobLoader:
+
+    #
+    # restppUrl : REST++ base url, e.g. https://geoqb.i.tgcloud.io:9000
+    # gsql      : callable which runs a GSQL statement (conn.gsql), used to create the jobs
+    # conn      : types without a definition are upserted through this connection, its token
+    #             is read for every request (tokens are refreshed by the connection pool)
+    #
+    def __init__( self, restppUrl, graph_name, typesGSQL, gsql, token=None, session=None, timeout=600, conn=None ):
+        import requests
+        self.restppUrl = restppUrl.rstrip( "/" )
+        self.graph_name = graph_name
+        self.types = parseTypeDefinitions( typesGSQL )
+        self.gsql = gsql
+        self.token = token
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.createdJobs = set()
+        self.conn = conn
+
+    @classmethod
+    def fromConnection( cls, conn, typesGSQL, session=None ):
+        return cls( conn.restppUrl, conn.graphname, typesGSQL,
+                    lambda statement : conn.gsql( statement, options=[] ),
+                    token=getattr( conn, "apiToken", None ), session=session, conn=conn )
+
+    def ensureJob( self, typeName, mapped ):
+        jobName = getLoadingJobName( typeName, self.types[typeName], mapped )
+        with self.lock:
+            if jobName not in self.createdJobs:
+                result = str( self.gsql( getLoadingJobGSQL( self.graph_name, typeName, self.types[typeName], mapped ) ) )
+                if not _loadingJobCreated( result, jobName ):
+                    raise RuntimeError( f"Creating loading job {jobName} failed: {result}" )
+                self.createdJobs.add( jobName )
+        return jobName
+
+    def postCSV( self, jobName, data ):
+
+        headers = { "Content-Type" : "text/csv" }
+        token = getattr( self.conn, "apiToken", None ) if self.conn is not None else self.token
+        if token:
+            headers["Authorization"] = "Bearer " + token
+
+        response = self.session.post( f"{self.restppUrl}/ddl/{self.graph_name}",
+                                      params={ "tag" : jobName, "filename" : "f", "sep" : ",", "eol" : "\n" },
+                                      data=data.encode( "utf-8" ), headers=headers, timeout=self.timeout )
+        response.raise_for_status()
+
+        result = response.json()
+        if result.get( "error" ):
+            raise RuntimeError( f"Loading job {jobName} failed: {result.get( 'message' )}" )
+
+        return result.get( "results", [] )
+
+    def loadChunk( self, job, chunk ):
+
+        typeName = job.upsertArgs[ "vertexType" if job.kind == "vertex" else "edgeType" ]
+        if typeName not in self.types:
+            if self.conn is None:
+                raise KeyError( f"No type definition for {typeName}, it can not be loaded with a loading job." )
+            return _upsertChunk( self.conn, job, chunk )
+
+        ids, mapped, columns = _csvColumns( job, self.types[typeName] )
+        jobName = self.ensureJob( typeName, mapped )
+
+        data = chunk[ ids + columns ].to_csv( index=False, header=False, lineterminator="\n" )
+
+        return _countLoaded( self.postCSV( jobName, data ), typeName )
+
+
+#
+# REST++ upserts (POST /graph/<graph>) sent through a keep-alive requests.Session. It has the
+# two upsert calls of TigerGraphConnection which are used by the jobs, the payload is built
+# the same way as pyTigerGraph does it. The token is read from the connection for every
+# request, so tokens refreshed by the connection pool are picked up.
+#
+class RestppUpserter:
+
+    def __init__( self, conn, session, timeout=600 ):
+        self.conn = conn
+        self.session = session
+        self.timeout = timeout
+        self.restppUrl = conn.restppUrl.rstrip( "/" )
+        self.graph_name = conn.graphname
+
+    def _post( self, payload ):
+
+        headers = { "Content-Type" : "application/json" }
+        token = getattr( self.conn, "apiToken", None )
+        if token:
+            headers["Authorization"] = "Bearer " + token
+
+        response = self.session.post( f"{self.restppUrl}/graph/{self.graph_name}",
+                                      data=json.dumps( payload, allow_nan=False ), headers=headers, timeout=self.timeout )
+        response.raise_for_status()
+
+        result = response.json()
+        if result.get( "error" ):
+            raise RuntimeError( f"Upsert into {self.graph_name} failed: {result.get( 'message' )}" )
+
+        return result.get( "results", [ {} ] )[0]
+
+    #
+    # Missing values (NaN, NA, NaT) are sent as null like in pyTigerGraph, a bare NaN is not JSON.
+    #
+    @staticmethod
+    def _values( column ):
+        return column.astype( object ).where( column.notna(), None ).to_numpy( dtype=object ).tolist()
+
+    @staticmethod
+    def _attributes( df, attributes ):
+        names = list( attributes.keys() )
+        columns = [ RestppUpserter._values( df[ attributes[n] ] ) for n in names ]
+        return [ { n : { "value" : v } for n, v in zip( names, row ) } for row in zip( *columns ) ]
+
+    def upsertVertexDataFrame( self, df, vertexType, v_id, attributes ):
+        ids = df[v_id].to_numpy( dtype=object ).tolist()
+        vertices = dict( zip( ids, self._attributes( df, attributes ) ) )
+        return self._post( { "vertices" : { vertexType : vertices } } ).get( "accepted_vertices", 0 )
+
+    def upsertEdgeDataFrame( self, df, sourceVertexType, edgeType, targetVertexType, from_id, to_id, attributes ):
+        edges = {}
+        for src, tgt, attrs in zip( df[from_id].to_numpy( dtype=object ).tolist(),
+                                    df[to_id].to_numpy( dtype=object ).tolist(),
+                                    self._attributes( df, attributes ) ):
+            edges.setdefault( src, {} ).setdefault( edgeType, {} ).setdefault( targetVertexType, {} )[tgt] = attrs
+        return self._post( { "edges" : { sourceVertexType : edges } } ).get( "accepted_edges", 0 )
+
+
+#
+# Counts the valid objects of a type in the statistics of a /ddl response (3.x and 4.x layout).
+#
+def _countLoaded( results, typeName ):
+    z = 0
+    for r in results:
+        stats = r.get( "statistics", {} )
+        objects = stats.get( "objectLevel", stats )
+        for entry in objects.get( "vertex", [] ) + objects.get( "edge", [] ):
+            if entry.get( "typeName" ) == typeName:
+                z = z + int( entry.get( "validObject", 0 ) )
+    return z
+
+
+#
+# session is a keep-alive requests.Session for the REST++ calls, without a session the
+# upserts go through the connection (pyTigerGraph opens a connection per request).
+#
+def getIngestTarget( conn, typesGSQL, mode=None, session=None ):
+    mode = mode or TG_INGEST_MODE
+    if mode == "loadingjob":
+        return LoadingJobLoader.fromConnection( conn, typesGSQL, session=session )
+    if mode != "upsert":
+        raise ValueError( f"Unknown ingest mode {mode}, use 'upsert' or 'loadingjob'." )
+    if session is not None:
+        return RestppUpserter( conn, session )
+    return conn
+
+
+#
+# Runs all jobs and returns a list of per job statistics (rows, upserted, rows/s, retries).
+# conn is a TigerGraphConnection or a LoadingJobLoader (see getIngestTarget).
+#
+def upsertJobs( conn, jobs, chunkSize=None, maxWorkers=None, retries=None, backoff=None, verbose=True ):
+
+    chunkSize = chunkSize or TG_UPSERT_CHUNK_SIZE
+    maxWorkers = maxWorkers or TG_UPSERT_WORKERS
+    retries = TG_UPSERT_RETRIES if retries is None else retries
+    backoff = TG_UPSERT_BACKOFF if backoff is None else backoff
+
+    byName = { job.name : job for job in jobs }
+    if len( byName ) < len( jobs ):
+        names = [ job.name for job in jobs ]
+        duplicates = sorted( set( n for n in names if names.count( n ) > 1 ) )
+        raise ValueError( f"Upsert job names must be unique, found {duplicates} more than once." )
+    for job in jobs:
+        for dep in job.dependsOn:
+            if dep not in byName:
+                raise ValueError( f"Upsert job {job.name} depends on unknown job {dep}." )
+
+    lock = threading.Lock()
+    pending = { job.name : None for job in jobs }   # name -> number of open chunks, None = not started
+    done = set()
+    futures = {}
+
+    def ready( job ):
+        return pending[job.name] is None and all( dep in done for dep in job.dependsOn )
+
+    def submit( pool, job ):
+        chunks = job.chunks( chunkSize )
+        # a job list can be run again, the statistics start from zero
+        job.rows = len( job.df )
+        job.upserted = 0
+        job.retries = 0
+        job.seconds = 0.0
+        job.finished = None
+        job.started = time.time()
+        pending[job.name] = len( chunks )
+        if len( chunks ) == 0:
+            finish( job )
+        for chunk in chunks:
+            futures[ pool.submit( _runChunk, conn, job, chunk, retries, backoff, lock ) ] = job
+
+    def finish( job ):
+        job.finished = time.time()
+        done.add( job.name )
+        if verbose:
+            s = job.getStats()
+            print( f">>> Upserted {s['kind']:6} {job.name:24} {s['rows']:>9} rows in {s['seconds']:8.2f} s ({s['rows_per_s']} rows/s, {s['retries']} retries)" )
+
+    with ThreadPoolExecutor( max_workers=maxWorkers ) as pool:
+
+        while len( done ) < len( jobs ):
+
+            progress = True
+            while progress:
+                progress = False
+                for job in jobs:
+                    if ready( job ):
+                        submit( pool, job )
+                        progress = True
+
+            if len( futures ) == 0:
+                break
+
+            finished, _ = wait( list( futures.keys() ), return_when=FIRST_COMPLETED )
+            for f in finished:
+                job = futures.pop( f )
+                try:
+                    f.result()
+                except Exception:
+                    for other in futures:
+                        other.cancel()
+                    raise
+                pending[job.name] = pending[job.name] - 1
+                if pending[job.name] == 0:
+                    finish( job )
+
+    return [ job.getStats() for job in jobs ]
@@ -0,0 +1,380 @@
+import os
+import re
+import hashlib
+import threading
+
+from string import Template
+
+######################################################
+#  Registry of installed GSQL queries.
+#
+#  A query is registered with a key and its text ($graph_name and $query_name are filled in).
+#  It is installed as <key>_<hash of the text>, so a changed text is installed under a new
+#  name while the running version keeps working. Queries are installed on first use, later
+#  calls go straight to runInstalledQuery.
+#
+
+QUERIES = {}
+
+_installed = set()
+_installLock = threading.Lock()
+
+
+def registerQuery( key, text, parse=None ):
+    QUERIES[key] = { "text" : text, "parse" : parse }
+
+def getQueryVersion( key ):
+    return hashlib.sha1( QUERIES[key]["text"].encode( "utf-8" ) ).hexdigest()[:10]
+
+def getInstalledName( key ):
+    return key + "_" + getQueryVersion( key )
+
+def getQueryGSQL( key, graph_name ):
+    name = getInstalledName( key )
+    body = Template( QUERIES[key]["text"] ).substitute( { 'graph_name' : graph_name, 'query_name' : name } )
+    return f"USE GRAPH {graph_name}\n{body}\nINSTALL QUERY {name}\n"
+
+
+#
+# REST++ answers a call of a query which is not installed with error code REST-1000
+# ("Endpoint is not found from url = /query/<graph>/<query>"), queries which are created
+# but not installed are reported as "not installed". Other errors which mention "not found"
+# (vertices, attributes, ...) are not a missing query.
+#
+MISSING_QUERY_CODES = ( "REST-1000", )
+
+_MISSING_QUERY_RE = re.compile( r"endpoint is not found from url\s*=\s*\S*/query/|query\s+\S+\s+is not installed", re.IGNORECASE )
+
+def isMissingQueryError( e ):
+    if str( getattr( e, "code", "" ) ) in MISSING_QUERY_CODES:
+        return True
+    return _MISSING_QUERY_RE.search( str( e ) ) is not None
+
+#
+# A query which uses vertex or edge types the graph does not have can not be installed,
+# the GSQL semantic check names the missing type.
+#
+_MISSING_TYPE_RE = re.compile( r"(vertex|edge) type\W+\w+\W+(does not exist|is not defined|not found)"
+                               r"|(undefined|unknown|invalid) (vertex|edge) type"
+                               r"|is not a (valid |defined )?(vertex|edge) type", re.IGNORECASE )
+
+def isMissingSchemaError( e ):
+    return _MISSING_TYPE_RE.search( str( e ) ) is not None
+
+
+class QueryInstallError( RuntimeError ):
+    pass
+
+
+def installQuery( conn, key, graph_name=None, verbose=False ):
+
+    graph_name = graph_name or conn.graphname
+    name = getInstalledName( key )
+
+    with _installLock:
+        if ( graph_name, name ) in _installed:
+            return name
+        gsqlScript = getQueryGSQL( key, graph_name )
+        if verbose:
+            print( gsqlScript )
+        result = str( conn.gsql( gsqlScript, options=[] ) )
+        if "error" in result.lower() and "already exist" not in result.lower():
+            raise QueryInstallError( f"Installing query {name} failed: {result}" )
+        _installed.add( ( graph_name, name ) )
+
+    return name
+
+def installQueries( conn, graph_name=None, verbose=False ):
+    names = []
+    for key in QUERIES:
+        try:
+            names.append( installQuery( conn, key, graph_name, verbose ) )
+        except RuntimeError as e:
+            print( f">>> {e}" )
+    return names
+
+
+#
+# Runs the current version of a registered query, it is installed if the graph does not know it.
+# usePost sends the parameters as JSON body, for long parameter lists (e.g. vertex ids).
+#
+def runQuery( conn, key, params=None, graph_name=None, sizeLimit=None, usePost=False ):
+
+    graph_name = graph_name or conn.graphname
+    name = getInstalledName( key )
+    options = { "sizeLimit" : sizeLimit }
+    if usePost:
+        options["usePost"] = True
+
+    try:
+        result = conn.runInstalledQuery( name, params, **options )
+    except Exception as e:
+        if not isMissingQueryError( e ):
+            raise
+        with _installLock:
+            _installed.discard( ( graph_name, name ) )
+        installQuery( conn, key, graph_name )
+        result = conn.runInstalledQuery( name, params, **options )
+
+    parse = QUERIES[key]["parse"]
+    return parse( result ) if parse is not None else result
+
+
+#
+# Number of h3places per resolution.
+#
+def _parsePlaceStats( result ):
+    perResolution = { int( k ) : int( v ) for k, v in result[0]["@@placesPerResolution"].items() }
+    stats = { f"placeCnt{res}" : perResolution.get( res, 0 ) for res in ( 6, 9, 12 ) }
+    stats["placesPerResolution"] = perResolution
+    return stats
+
+registerQuery( "geoqb_place_stats", '''
+CREATE QUERY $query_name() FOR GRAPH $graph_name SYNTAX v2 {
+
+  MapAccum<INT, INT> @@placesPerResolution;
+
+  Result_all = SELECT s
+            FROM h3place:s
+            ACCUM @@placesPerResolution += ( s.resolution -> 1 );
+
+  PRINT @@placesPerResolution;
+
+}''', _parsePlaceStats )
+
+
+def _parsePlaceCount( result ):
+    return int( result[0]["placeCnt"] )
+
+registerQuery( "geoqb_place_count", '''
+CREATE QUERY $query_name(INT res) FOR GRAPH $graph_name SYNTAX v2 {
+
+  SumAccum<INT> @@placeCnt = 0;
+
+  Result_all = SELECT s
+            FROM h3place:s
+            WHERE s.resolution == res
+            ACCUM @@placeCnt += 1;
+
+  PRINT @@placeCnt AS placeCnt;
+
+}''', _parsePlaceCount )
+
+
+#
+# OSM tags with the number of h3places of a resolution they are linked to.
+#
+registerQuery( "geoqb_tag_histogram", '''
+CREATE QUERY $query_name(INT res) FOR GRAPH $graph_name SYNTAX v2 {
+
+    SumAccum<INT> @osmtagCnt = 0;
+
+    histogram = SELECT t
+           FROM osmtag:t -(hasOSMTag:e)- h3place:s
+           WHERE s.resolution == res
+           ACCUM t.@osmtagCnt += 1;
+
+    PRINT histogram;
+    PRINT res AS resolution;
+
+}''' )
+
+
+######################################################
+#  Seeded export pages.
+#
+#  A page query starts from the h3places given as seeds and returns the edges of these
+#  cells and the vertices at both ends. Every layer edge has an h3place end, so the pages
+#  of all cells cover the layer and each page only touches the edges of its own cells.
+#  An edge between two cells, and the vertices shared by cells (osmtag), can show up on
+#  more than one page (see gqtaglayerextract.exportGraphFrames).
+#
+def _parseIds( result ):
+    return sorted( result[0]["ids"] )
+
+registerQuery( "geoqb_place_ids", '''
+CREATE QUERY $query_name() FOR GRAPH $graph_name SYNTAX v2 {
+
+    SetAccum<STRING> @@ids;
+
+    cells = SELECT c FROM h3place:c
+            ACCUM @@ids += c.h3index;
+
+    PRINT @@ids AS ids;
+
+}''', _parseIds )
+
+registerQuery( "geoqb_all_page", '''
+CREATE QUERY $query_name(SET<STRING> seeds) FOR GRAPH $graph_name SYNTAX v2 {
+
+    SetAccum<EDGE> @@edgeset;
+    OrAccum @linked;
+
+    cells = to_vertex_set( seeds, "h3place" );
+
+    ends = SELECT t FROM cells:c -(:e)- :t
+           ACCUM c.@linked += TRUE, t.@linked += TRUE, @@edgeset += e;
+
+    nodes1 = cells UNION ends;
+    nodes1 = SELECT v FROM nodes1:v WHERE v.@linked;
+
+    PRINT nodes1;
+    PRINT @@edgeset;
+
+}''' )
+
+registerQuery( "geoqb_layer_scan_page", '''
+CREATE QUERY $query_name(STRING lID1, STRING lID2a, STRING lID2b, SET<STRING> seeds) FOR GRAPH $graph_name SYNTAX v2 {
+
+    SetAccum<EDGE> @@edgeset;
+    OrAccum @inLayer;
+
+    cells = to_vertex_set( seeds, "h3place" );
+
+    ends = SELECT t FROM cells:c -((hasOSMTag|located_on_h3_cell|h3_grid_link):e)- :t
+           WHERE instr ( e.layer_id, lID1 ) >= 0
+             AND ( instr ( e.layer_id, lID2a ) >= 0 OR instr ( e.layer_id, lID2b ) >= 0 )
+           ACCUM c.@inLayer += TRUE, t.@inLayer += TRUE, @@edgeset += e;
+
+    nodes1 = cells UNION ends;
+    nodes1 = SELECT v FROM nodes1:v WHERE v.@inLayer;
+
+    PRINT nodes1;
+    PRINT @@edgeset;
+
+}''' )
+
+
+######################################################
+#  Layer index queries.
+#
+#  The layers matching ( lID1, lID2a or lID2b ) are selected from the osmlayer vertices,
+#  their member h3places are the seeds of the export pages, so neither the seeds nor the
+#  pages touch cells outside of the layers.
+#
+#  The index is used for graphs which have the osmlayer and layer_member types (see
+#  gqtg.addLayerIndexToOSMGraph), graphs created with the older schema are staged and
+#  extracted without it. GEOQB_LAYER_INDEX=false disables the index for all graphs.
+#
+LAYER_INDEX = str( os.environ.get('GEOQB_LAYER_INDEX', 'true') ).lower() in ( "1", "true", "yes" )
+LAYER_INDEX_TYPES = ( "osmlayer", "layer_member" )
+
+_layerIndexGraphs = {}
+_layerIndexLock = threading.Lock()
+
+#
+# True if the layer index is enabled and the graph has its types, the schema is asked once per graph.
+#
+def hasLayerIndex( conn ):
+
+    if not LAYER_INDEX:
+        return False
+
+    graph_name = getattr( conn, "graphname", None )
+
+    with _layerIndexLock:
+        if graph_name not in _layerIndexGraphs:
+            try:
+                types = set( conn.getVertexTypes() ) | set( conn.getEdgeTypes() )
+                found = all( t in types for t in LAYER_INDEX_TYPES )
+            except Exception as e:
+                print( f"!!! Schema of graph {graph_name} is not available ({str( e )[:120]}), the layer index is not used." )
+                found = False
+            if not found:
+                print( f"!!! Graph {graph_name} has no layer index types {LAYER_INDEX_TYPES}, layers are staged and extracted without the index (see gqtg.addLayerIndexToOSMGraph)." )
+            _layerIndexGraphs[graph_name] = found
+        return _layerIndexGraphs[graph_name]
+
+def resetLayerIndex( graph_name=None ):
+    with _layerIndexLock:
+        if graph_name is None:
+            _layerIndexGraphs.clear()
+        else:
+            _layerIndexGraphs.pop( graph_name, None )
+
+registerQuery( "geoqb_layer_cells", '''
+CREATE QUERY $query_name(STRING lID1, STRING lID2a, STRING lID2b) FOR GRAPH $graph_name SYNTAX v2 {
+
+    SetAccum<STRING> @@ids;
+
+    layers = SELECT l FROM osmlayer:l
+             WHERE instr ( l.layer_id, lID1 ) >= 0
+               AND ( instr ( l.layer_id, lID2a ) >= 0 OR instr ( l.layer_id, lID2b ) >= 0 );
+
+    cells = SELECT c FROM layers:l -(layer_member:m)- h3place:c
+            ACCUM @@ids += c.h3index;
+
+    PRINT @@ids AS ids;
+
+}''', _parseIds )
+
+registerQuery( "geoqb_layer_page", '''
+CREATE QUERY $query_name(STRING lID1, STRING lID2a, STRING lID2b, SET<STRING> seeds) FOR GRAPH $graph_name SYNTAX v2 {
+
+    SetAccum<STRING> @@layerIds;
+    SetAccum<EDGE> @@edgeset;
+    OrAccum @inLayer;
+
+    layers = SELECT l FROM osmlayer:l
+             WHERE instr ( l.layer_id, lID1 ) >= 0
+               AND ( instr ( l.layer_id, lID2a ) >= 0 OR instr ( l.layer_id, lID2b ) >= 0 )
+             ACCUM @@layerIds += l.layer_id;
+
+    cells = to_vertex_set( seeds, "h3place" );
+
+    ends = SELECT t FROM cells:c -((hasOSMTag|located_on_h3_cell):e)- :t
+           WHERE @@layerIds.contains( e.layer_id )
+           ACCUM c.@inLayer += TRUE, t.@inLayer += TRUE, @@edgeset += e;
+
+    nodes1 = cells UNION ends;
+    nodes1 = SELECT v FROM nodes1:v WHERE v.@inLayer;
+
+    PRINT nodes1;
+    PRINT @@edgeset;
+
+}''' )
+
+
+def _parseLayerMarker( result ):
+    return result[0]["@@edgesPerLayer"]
+
+registerQuery( "geoqb_layer_marker", '''
+CREATE QUERY $query_name(STRING lID1) FOR GRAPH $graph_name SYNTAX v2 {
+
+    SetAccum<STRING> @@layerIds;
+    MapAccum<STRING, INT> @@edgesPerLayer;
+
+    layers = SELECT l FROM osmlayer:l
+             WHERE instr ( l.layer_id, lID1 ) >= 0
+             ACCUM @@layerIds += l.layer_id;
+
+    cells = SELECT c FROM layers:l -(layer_member:m)- h3place:c;
+
+    tmp = SELECT t FROM cells:c -((hasOSMTag|located_on_h3_cell):e)- :t
+          WHERE @@layerIds.contains( e.layer_id )
+          ACCUM @@edgesPerLayer += ( e.layer_id -> 1 );
+
+    PRINT @@edgesPerLayer;
+
+}''', _parseLayerMarker )
+
+
+#
+# Builds the layer index for edges which were loaded before the index existed.
+#
+registerQuery( "geoqb_build_layer_index", '''
+CREATE QUERY $query_name() FOR GRAPH $graph_name SYNTAX v2 {
+
+    SetAccum<STRING> @@layerIds;
+
+    cells = SELECT c FROM h3place:c -((hasOSMTag|located_on_h3_cell):e)- :t
+            ACCUM @@layerIds += e.layer_id,
+                  INSERT INTO layer_member VALUES ( e.layer_id, c );
+
+    FOREACH l IN @@layerIds DO
+        INSERT INTO osmlayer VALUES ( l, l, _ );
+    END;
+
+    PRINT @@layerIds.size() AS layers;
+
+}''' )
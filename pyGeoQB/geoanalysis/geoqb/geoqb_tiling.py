@@ -0,0 +1,124 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from h3 import h3
+
+import geoanalysis.geoqb.geoqb_sophox as gqsophox
+
+######################################################
+#  Spatial tiling for large-area extraction.
+#
+#  A circular region (center, radius in km) is covered by H3 cells. Each cell is
+#  queried with a circle around its centroid which contains the whole hexagon. A tile
+#  which returns targetCount records (the query LIMIT) is considered truncated and is
+#  split into its children at the next resolution. The children of a cell do not cover it
+#  exactly (H3 is not a strict hierarchy), parts of the parent near its border belong to
+#  children of the neighbours. A split tile is therefore replaced by its children and their
+#  direct neighbours (k_ring 1), each cell is queried once per level. The results of all
+#  tiles are merged, osmids on tile borders are de-duplicated, and records outside the
+#  region are dropped.
+#
+TILE_TARGET_COUNT = int( os.environ.get('GEOQB_TILE_TARGET_COUNT', 10000) )
+TILE_MAX_RESOLUTION = 12
+TILE_MAX_WORKERS = 4
+TILE_RADIUS_MARGIN = 1.02
+
+
+#
+# Coarsest resolution with at least a few tiles per region diameter.
+#
+def pickTileResolution( radius_km ):
+    for res in range( 0, TILE_MAX_RESOLUTION + 1 ):
+        if h3.edge_length( res, unit='km' ) <= radius_km / 2.0:
+            return res
+    return TILE_MAX_RESOLUTION
+
+#
+# Distance from the centroid to the farthest vertex of the cell, H3 cells are not regular
+# hexagons (and pentagons are larger), so the edge length is not a covering bound.
+#
+def tileRadius( cell ):
+    center = h3.h3_to_geo( cell )
+    return TILE_RADIUS_MARGIN * max( h3.point_dist( center, vertex, unit='km' ) for vertex in h3.h3_to_geo_boundary( cell ) )
+
+#
+# The children of the split tiles, padded with their neighbours so that the whole area of
+# the parents is covered.
+#
+def splitTiles( cells ):
+    children = set()
+    for cell in cells:
+        children.update( h3.h3_to_children( cell, h3.h3_get_resolution( cell ) + 1 ) )
+    padded = set()
+    for child in children:
+        padded.update( h3.k_ring( child, 1 ) )
+    return sorted( padded )
+
+
+def planTiles( center, radius_km, resolution=None ):
+
+    if resolution is None:
+        resolution = pickTileResolution( radius_km )
+
+    centerCell = h3.geo_to_h3( center[0], center[1], resolution )
+    edge = h3.edge_length( resolution, unit='km' )
+    k = int( math.ceil( radius_km / ( 1.5 * edge ) ) ) + 1
+
+    tiles = []
+    for cell in h3.k_ring( centerCell, k ):
+        if h3.point_dist( center, h3.h3_to_geo( cell ), unit='km' ) <= radius_km + edge:
+            tiles.append( cell )
+
+    return sorted( tiles )
+
+
+def _distanceKm( lat1, lon1, lat2, lon2 ):
+    lat1, lon1, lat2, lon2 = map( np.radians, ( lat1, lon1, lat2, lon2 ) )
+    a = np.sin( ( lat2 - lat1 ) / 2.0 ) ** 2 + np.cos( lat1 ) * np.cos( lat2 ) * np.sin( ( lon2 - lon1 ) / 2.0 ) ** 2
+    return 2.0 * 6371.0088 * np.arcsin( np.sqrt( a ) )
+
+
+#
+# fetchTile( cell, radius_km, limit ) returns the list of Sophox records for one tile.
+#
+def fetchTiledRecords( center, radius_km, fetchTile, targetCount=TILE_TARGET_COUNT,
+                       resolution=None, maxResolution=TILE_MAX_RESOLUTION, maxWorkers=TILE_MAX_WORKERS, verbose=True ):
+
+    tiles = planTiles( center, radius_km, resolution )
+
+    merged = {}
+    nTiles = 0
+    nSplit = 0
+
+    with ThreadPoolExecutor( max_workers=maxWorkers ) as pool:
+
+        while len(tiles) > 0:
+
+            results = list( pool.map( lambda cell: fetchTile( cell, tileRadius( cell ), targetCount ), tiles ) )
+            nTiles = nTiles + len(tiles)
+
+            truncated = []
+            for cell, records in zip( tiles, results ):
+                if len(records) >= targetCount and h3.h3_get_resolution( cell ) < maxResolution:
+                    truncated.append( cell )
+                    nSplit = nSplit + 1
+                    continue
+                for record in records:
+                    merged[ ( record['osmid'], record['tag'] ) ] = record
+
+            tiles = splitTiles( truncated )
+
+    records = [ r for r in merged.values() if r['loc'] is not None ]
+
+    if len(records) > 0:
+        lon, lat = gqsophox.parseWKTPoints( [ r['loc'] for r in records ] )
+        inside = _distanceKm( center[0], center[1], lat, lon ) <= radius_km
+        records = [ r for r, keep in zip( records, inside.tolist() ) if keep ]
+
+    if verbose:
+        print( f">>> Tiled extraction: {nTiles} tiles queried, {nSplit} split, {len(records)} records in region." )
+
+    return records
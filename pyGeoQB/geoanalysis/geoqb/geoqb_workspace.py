@@ -9,6 +9,11 @@ from os.path import exists
 import os
 import shutil
 from pathlib import Path
+import json
+
+import pandas as pd
+
+import geoanalysis.geoqb.geoqb_h3 as gqh3
 
 
 def getFileHandle( path="", fn="f1.dat", mode="w" ):
@@ -57,7 +62,7 @@ def prepareWorkspaceFolders( verbose=True):
 
     path_offset = os.environ.get('GEOQB_WORKSPACE')
 
-    required_dirs = ["single_layer_images", "multi_layer_images", "graph_layers", "graph_layers/vertexes", "graph_layers/edges", "graph_layers/grid", "raw", "md", "dumps", "stage"]
+    required_dirs = ["single_layer_images", "multi_layer_images", "graph_layers", "graph_layers/vertexes", "graph_layers/edges", "graph_layers/grid", "raw", "md", "dumps", "stage", "cache"]
 
     if verbose:
         print( f"ENV GEOQB_WORKSPACE: {path_offset}")
@@ -78,7 +83,7 @@ def describeWorkspace( verbose=True ):
 
     path_offset = os.environ.get('GEOQB_WORKSPACE')
 
-    required_dirs = ["single_layer_images", "multi_layer_images", "graph_layers", "graph_layers/vertexes", "graph_layers/edges", "graph_layers/grid", "raw", "md", "dumps", "stage"]
+    required_dirs = ["single_layer_images", "multi_layer_images", "graph_layers", "graph_layers/vertexes", "graph_layers/edges", "graph_layers/grid", "raw", "md", "dumps", "stage", "cache"]
     print( f"\n>>> GeoQB-Workspace folder structure: {path_offset}")
 
     status = True
@@ -95,3 +100,122 @@ def describeWorkspace( verbose=True ):
 
 
 
+
+
+
+######################################################
+#  Storage backends for the layer artifacts in graph_layers/vertexes and graph_layers/edges.
+#
+#  GEOQB_STORAGE_FORMAT selects the backend which is used to write new files (csv|parquet).
+#  Files are always read with the backend which matches the file on disk, so workspaces
+#  with a mix of CSV and Parquet files keep working.
+#
+GEOQB_STORAGE_FORMAT = os.environ.get('GEOQB_STORAGE_FORMAT', 'csv')
+
+
+class CSVStorage:
+
+    format = "csv"
+    suffix = ".csv"
+
+    # uint64 H3 cells are written as hex strings, the same as TigerGraph uses them
+    cellColumns = ( "h3index", "h3cell" )
+
+    def fileName( self, fn ):
+        return os.path.splitext( fn )[0] + self.suffix
+
+    def write( self, df, fn, metadata=None ):
+        cells = {}
+        for c in self.cellColumns:
+            if c in df.columns and df[c].dtype == 'uint64':
+                cells[c] = gqh3.h3CellsToStrings( df[c].to_numpy() )
+        if len(cells) > 0:
+            df = df.assign( **cells )
+        df.to_csv( fn, index=False )
+        return fn
+
+    def read( self, fn, dtype=None ):
+        return pd.read_csv( fn, dtype=dtype )
+
+    def readMetadata( self, fn ):
+        return None
+
+
+class ParquetStorage:
+
+    format = "parquet"
+    suffix = ".parquet"
+
+    def __init__( self, compression="zstd" ):
+        self.compression = compression
+
+    def fileName( self, fn ):
+        return os.path.splitext( fn )[0] + self.suffix
+
+    def write( self, df, fn, metadata=None ):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas( df, preserve_index=False )
+        if metadata is not None:
+            schemaMD = dict( table.schema.metadata or {} )
+            schemaMD[b'geoqb'] = json.dumps( metadata, default=str ).encode( 'utf-8' )
+            table = table.replace_schema_metadata( schemaMD )
+        pq.write_table( table, fn, compression=self.compression )
+        return fn
+
+    def read( self, fn, dtype=None ):
+        import pyarrow.parquet as pq
+
+        df = pq.read_table( fn ).to_pandas()
+        if dtype is not None:
+            # typed columns are kept, e.g. uint64 cells are not turned into strings
+            dtype = { c : t for c, t in dtype.items() if c in df.columns and df[c].dtype == object }
+            df = df.astype( dtype )
+        return df
+
+    def readMetadata( self, fn ):
+        import pyarrow.parquet as pq
+
+        schemaMD = pq.read_schema( fn ).metadata or {}
+        if b'geoqb' not in schemaMD:
+            return None
+        return json.loads( schemaMD[b'geoqb'].decode( 'utf-8' ) )
+
+
+STORAGE_BACKENDS = {
+    "csv" : CSVStorage,
+    "parquet" : ParquetStorage
+}
+
+def getStorage( format=None ):
+    if format is None:
+        format = GEOQB_STORAGE_FORMAT
+    if not isinstance( format, str ):
+        return format
+    try:
+        return STORAGE_BACKENDS[ format.lower() ]()
+    except KeyError:
+        raise ValueError( f"Unknown storage format <{format}>, use one of {list(STORAGE_BACKENDS.keys())}." )
+
+def writeFrame( df, fn, storage=None, metadata=None ):
+    storage = getStorage( storage )
+    return storage.write( df, storage.fileName( fn ), metadata=metadata )
+
+def readFrame( fn, dtype=None, storage=None ):
+    preferred = getStorage( storage )
+    for s in [ preferred ] + [ b() for k, b in STORAGE_BACKENDS.items() if k != preferred.format ]:
+        if exists( s.fileName( fn ) ):
+            return s.read( s.fileName( fn ), dtype=dtype )
+    raise FileNotFoundError( f"No layer file for <{fn}> in any of the formats {list(STORAGE_BACKENDS.keys())}." )
+
+def readFrameMetadata( fn, storage=None ):
+    s = getStorage( storage )
+    return s.readMetadata( s.fileName( fn ) )
+
+#
+# CSV stays available as export format for files written with another backend.
+#
+def exportFrameAsCSV( fn, storage=None ):
+    df = readFrame( fn, storage=storage )
+    return writeFrame( df, fn, storage="csv" )
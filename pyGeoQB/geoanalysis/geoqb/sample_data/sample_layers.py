@@ -1,6 +1,9 @@
 import copy
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import geoanalysis.geoqb.geoqb_layers as gql
+import geoanalysis.geoqb.geoqb_query_cache as gqcache
 
 def getSampleLayerStack9( layer, path_offset ):
     #
@@ -167,6 +170,39 @@ def defineSampleLayerStack( layer, queryParts, layerWeight, path_offset ):
 
     return stackOfLayers
 
+#
+# Fetch the data of all sheets concurrently before they are plotted and persisted.
+# Sheets with identical queries are fetched once, the others are served by the query cache.
+#
+def prefetchSheets( sheets, path_offset, maxWorkers=8 ):
+
+    unique = {}
+    duplicates = []
+    for sheet in sheets:
+        key = gqcache.getQueryKey( sheet.query, os.environ.get('sophox_endpoint') )
+        if key in unique:
+            duplicates.append( sheet )
+        else:
+            unique[key] = sheet
+
+    print( f"*** prefetch {len(unique)} queries for {len(sheets)} sheets (workers:{maxWorkers})" )
+
+    failed = []
+    with ThreadPoolExecutor( max_workers=maxWorkers ) as pool:
+        futures = { pool.submit( sheet.getJSONData, path_offset, forceReload=False, dryRun=False ) : sheet for sheet in unique.values() }
+        for future in as_completed( futures ):
+            try:
+                future.result()
+            except Exception as e:
+                print( f"!!! prefetch of {futures[future].qn} failed: {e}" )
+                failed.append( futures[future] )
+
+    for sheet in duplicates:
+        sheet.getJSONData( path_offset, forceReload=False, dryRun=False )
+
+    return failed
+
+
 #
 # Generate named queries for OSM layers
 #
@@ -223,40 +259,41 @@ def getKGC2022_FullDataset( location_name, l, zoom, path_offset, dryRun ):
     return layers
 
 
-def getKGC2022_DemoDataStack( location_name, l, zoom, path_offset, dryRun ):
+#
+# tiled: the sheets are TiledSophoxLayers, for regions which exceed the result limit of a
+#        single Sophox query (e.g. a federal state).
+#
+def getKGC2022_DemoDataStack( location_name, l, zoom, path_offset, dryRun, tiled=False ):
 
     layers = {}
 
-    layer = gql.SophoxLayer( location_name=location_name, zoom=zoom, l=l )
-
-    layers1 = getSampleLayerStack1( layer, path_offset )
-    layers[ layers1[0]+"_"+location_name ] = combineSheets( layers1[1], path_offset, dryRun = dryRun )
-
-    layers2 = getSampleLayerStack2( layer, path_offset )
-    layers[ layers2[0]+"_"+location_name ] = combineSheets( layers2[1], path_offset, dryRun = dryRun )
-
-    layers3 = getSampleLayerStack3( layer, path_offset )
-    layers[ layers3[0]+"_"+location_name ] = combineSheets( layers3[1], path_offset, dryRun = dryRun )
-
-    layers4 = getSampleLayerStack4( layer, path_offset )
-    layers[ layers4[0]+"_"+location_name ] = combineSheets( layers4[1], path_offset, dryRun = dryRun )
-
-    layers5 = getSampleLayerStack5( layer, path_offset )
-    layers[ layers5[0]+"_"+location_name ] = combineSheets( layers5[1], path_offset, dryRun = dryRun )
-
-    layers6 = getSampleLayerStack6( layer, path_offset )
-    layers[ layers6[0]+"_"+location_name ] = combineSheets( layers6[1], path_offset, dryRun = dryRun )
-
-    layers7 = getSampleLayerStack7( layer, path_offset )
-    layers[ layers7[0]+"_"+location_name ] = combineSheets( layers7[1], path_offset, dryRun = dryRun )
-
-    layers8 = getSampleLayerStack8( layer, path_offset )
-    layers[ layers8[0]+"_"+location_name ] = combineSheets( layers8[1], path_offset, dryRun = dryRun )
+    if tiled:
+        layer = gql.TiledSophoxLayer( location_name=location_name, zoom=zoom, l=l )
+    else:
+        layer = gql.SophoxLayer( location_name=location_name, zoom=zoom, l=l )
+
+    stacks = [
+        getSampleLayerStack1( layer, path_offset ),
+        getSampleLayerStack2( layer, path_offset ),
+        getSampleLayerStack3( layer, path_offset ),
+        getSampleLayerStack4( layer, path_offset ),
+        getSampleLayerStack5( layer, path_offset ),
+        getSampleLayerStack6( layer, path_offset ),
+        getSampleLayerStack7( layer, path_offset ),
+        getSampleLayerStack8( layer, path_offset ),
+        getSampleLayerStack9( layer, path_offset ),
+        getSampleLayerStack10( layer, path_offset )
+    ]
 
-    layers9 = getSampleLayerStack9( layer, path_offset )
-    layers[ layers9[0]+"_"+location_name ] = combineSheets( layers9[1], path_offset, dryRun = dryRun )
+    #
+    # all network round trips happen here, combineSheets works on the local dump files,
+    # so a stack is not built from a sheet which could not be fetched.
+    #
+    failed = prefetchSheets( [ sheet for stack in stacks for sheet in stack[1] ], path_offset )
+    if len( failed ) > 0:
+        raise RuntimeError( f"prefetch of {len(failed)} sheets failed: " + ", ".join( sorted( sheet.qn for sheet in failed ) ) )
 
-    layers10 = getSampleLayerStack10( layer, path_offset )
-    layers[ layers10[0]+"_"+location_name ] = combineSheets( layers10[1], path_offset, dryRun = dryRun )
+    for stack in stacks:
+        layers[ stack[0]+"_"+location_name ] = combineSheets( stack[1], path_offset, dryRun = dryRun )
 
-    return layers
\ No newline at end of file
+    return layers
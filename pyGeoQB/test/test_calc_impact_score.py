@@ -0,0 +1,177 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import geoanalysis.geoqb.calc_impact_score as scorer
+
+
+def createLayers(location_name, variants):
+    rng = np.random.default_rng(sum(map(ord, location_name)))
+    layers = {}
+    for k, v in enumerate(("POS", "NEG")):
+        n = 12 + 5 * k
+        dfNodes = pd.DataFrame({"Id": ["%s%d" % (v, i) for i in range(n)],
+                                "lat": 52.4 + rng.random(n) * 0.2,
+                                "lon": 13.3 + rng.random(n) * 0.3})
+        layers[v] = (dfNodes, pd.DataFrame())
+    return {v: layers[v] for v in variants}
+
+
+class TestVariantScores(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.workspace, "sample_score"))
+        self.environ = os.environ.get("GEOQB_WORKSPACE")
+        os.environ["GEOQB_WORKSPACE"] = self.workspace
+
+        self.getLayerVariants = scorer.gqtg.getLayerVariants
+        scorer.gqtg.getLayerVariants = lambda conn, graph_name, WORKPATH=None, overwrite=False, s1=None, variants=None, verbose=True: createLayers(s1, variants)
+
+    def tearDown(self):
+        scorer.gqtg.getLayerVariants = self.getLayerVariants
+        if self.environ is None:
+            os.environ.pop("GEOQB_WORKSPACE")
+        else:
+            os.environ["GEOQB_WORKSPACE"] = self.environ
+        shutil.rmtree(self.workspace, ignore_errors=True)
+
+    def singleScore(self, location_name):
+        fn = scorer.calc_score(location_name, None, self.workspace, 1, "OSMLayers_Test", mode="exact")
+        return pd.read_csv(fn, sep="\t").set_index("LOC").loc[location_name]
+
+    def test_table_matches_calc_score_per_pair(self):
+        locations = ["Berlin", "Jena"]
+        pairs = {"POS/NEG": ("POS", "NEG"), "NEG/POS": ("NEG", "POS")}
+
+        table = scorer.calc_variant_scores(locations, None, self.workspace, "OSMLayers_Test", pairs=pairs,
+                                           mode="exact", maxWorkers=2, verbose=False)
+        self.assertEqual(len(table), 4)
+        table = table.set_index(["location", "pair"])
+
+        for loc in locations:
+            single = self.singleScore(loc)
+
+            row = table.loc[(loc, "POS/NEG")]
+            self.assertEqual(row["zPOS"], single["zPOS"])
+            self.assertEqual(row["zNEG"], single["zNEG"])
+            for a, b in (("posM", "posM"), ("allM", "allM"), ("negM", "negM"), ("posMAX", "posMAX"), ("allMAX", "allMAX"),
+                         ("posM_allMAX", "posM/allMAX"), ("negM_allMAX", "negM/allMAX")):
+                self.assertAlmostEqual(row[a], single[b], places=9)
+
+            # the swapped pair scores NEG as positive layer
+            swapped = table.loc[(loc, "NEG/POS")]
+            self.assertEqual(swapped["zPOS"], single["zNEG"])
+            self.assertAlmostEqual(swapped["posM"], single["negM"], places=9)
+            self.assertAlmostEqual(swapped["negM"], single["posM"], places=9)
+            self.assertAlmostEqual(swapped["allM"], single["allM"], places=9)
+
+    def test_failed_location_is_reported(self):
+        scorer.gqtg.getLayerVariants = lambda *args, **kwargs: (_ for _ in ()).throw(RuntimeError("REST++ is not available"))
+
+        table = scorer.calc_variant_scores(["Berlin"], None, self.workspace, "OSMLayers_Test", maxWorkers=1, verbose=False)
+
+        self.assertEqual(list(table["location"]), ["Berlin"])
+        self.assertIn("REST++", table["error"][0])
+
+
+# Flinders Peak - Buninyong, the example of Vincenty (1975): 54972.271 m
+FLINDERS_PEAK = (-(37 + 57 / 60.0 + 3.72030 / 3600.0), 144 + 25 / 60.0 + 29.52440 / 3600.0)
+BUNINYONG = (-(37 + 39 / 60.0 + 10.15610 / 3600.0), 143 + 55 / 60.0 + 35.38390 / 3600.0)
+
+# Newport, RI - Cleveland, OH from the geopy documentation
+NEWPORT_RI = (41.49008, -71.312796)
+CLEVELAND_OH = (41.499498, -81.695391)
+
+
+class TestDistanceKernels(unittest.TestCase):
+
+    def test_ellipsoid_kernels(self):
+        for kernel in (scorer.karneyKm, scorer.vincentyKm):
+            self.assertAlmostEqual(float(kernel(*FLINDERS_PEAK, *BUNINYONG)), 54.972271, places=6)
+            self.assertAlmostEqual(float(kernel(*NEWPORT_RI, *CLEVELAND_OH)), 866.455433, places=6)
+
+    def test_haversine(self):
+        # great circle of geopy with the mean earth radius 6371.009 km
+        self.assertAlmostEqual(float(scorer.haversineKm(*NEWPORT_RI, *CLEVELAND_OH)), 864.214494 * 6371.0088 / 6371.009, places=6)
+        self.assertAlmostEqual(float(scorer.haversineKm(0.0, 0.0, 0.0, 90.0)), scorer.EARTH_RADIUS_KM * np.pi / 2, places=9)
+        self.assertEqual(float(scorer.haversineKm(*NEWPORT_RI, *NEWPORT_RI)), 0.0)
+
+    def test_vincenty_nearly_antipodal(self):
+        # the iteration does not converge, the points get the geodesic (GeographicLib: 19936288.579 m)
+        self.assertAlmostEqual(float(scorer.vincentyKm(0.0, 0.0, 0.5, 179.5)), 19936.288579, places=6)
+        d = scorer.vincentyKm(np.array([0.0, FLINDERS_PEAK[0]]), np.array([0.0, FLINDERS_PEAK[1]]),
+                              np.array([0.5, BUNINYONG[0]]), np.array([179.5, BUNINYONG[1]]))
+        self.assertEqual(d.round(6).tolist(), [19936.288579, 54.972271])
+
+    def test_pairwise_stats_use_lat_lon(self):
+        lat = [NEWPORT_RI[0], CLEVELAND_OH[0]]
+        lon = [NEWPORT_RI[1], CLEVELAND_OH[1]]
+        for method in ("haversine", "vincenty", "karney"):
+            d = float(scorer.DISTANCE_METHODS[method](*NEWPORT_RI, *CLEVELAND_OH))
+            mean, count, dmax = scorer.pairwiseDistanceStats(lat, lon, method=method, blockSize=1)
+            # all ordered pairs including the self pairs
+            self.assertEqual(count, 4)
+            self.assertAlmostEqual(mean, d / 2, places=9)
+            self.assertAlmostEqual(dmax, d, places=9)
+        self.assertAlmostEqual(dmax, 866.455433, places=6)
+
+
+class TestHullDiameter(unittest.TestCase):
+
+    def check(self, lat, lon, method="haversine"):
+        lat, lon = np.asarray(lat), np.asarray(lon)
+        expected = scorer.pairwiseDistanceStats(lat, lon, method=method)[2]
+        self.assertAlmostEqual(scorer.hullDiameterKm(lat, lon, method=method), expected, places=9)
+
+    def test_hull_contains_the_farthest_pair(self):
+        rng = np.random.default_rng(3)
+        for center in ((52.5, 13.4), (-33.9, 151.2), (78.2, 15.6), (0.0, 179.9), (89.9, 0.0)):
+            lat = center[0] + rng.normal(0.0, 0.3, 500)
+            lon = center[1] + rng.normal(0.0, 2.0, 500)
+            lat = np.clip(lat, -89.99, 89.99)
+            lon = (lon + 180.0) % 360.0 - 180.0
+            self.check(lat, lon)
+
+    def test_points_across_the_antimeridian(self):
+        lat = [20.922, 12.993, -4.755, 13.764, 21.236]
+        lon = [-175.05, -179.22, -177.893, -171.188, 177.977]
+        self.check(lat, lon)
+        self.assertAlmostEqual(scorer.hullDiameterKm(lat, lon), 1417.0, places=1)
+
+    def test_wide_spread_points_use_all_pairs(self):
+        self.check([10.0, 45.0, -40.0, 30.0], [20.0, -120.0, 60.0, 170.0])
+        self.check([52.5, 52.5], [13.4, 13.4])
+
+
+class TestProfileScores(unittest.TestCase):
+
+    def test_count_matrix_and_scores(self):
+        dfEdges = pd.DataFrame({
+            "e_type": ["hasOSMTag", "hasOSMTag", "hasOSMTag", "located_on_h3_cell", "hasOSMTag"],
+            "from_id": ["tourism=museum", "bus_stop", "tourism=hotel", "node1", "shop=bakery"],
+            "from_type": ["osmtag"] * 3 + ["osmplace", "osmtag"],
+            "to_id": ["891e34d61d3ffff", "891e34d61d3ffff", "891e34d61c7ffff", "891e34d61c7ffff", "891e34d61c7ffff"],
+            "to_type": ["h3place"] * 5,
+            "attributes.layer_id": ["Jena_tourism_POS", "Jena_public_transport_NEG", "Jena_tourism_POS", "Jena_tourism_POS", "Jena_shop_POS"],
+            "attributes.tagCount": [2, 1, 3, 1, 1],
+        })
+
+        counts = scorer.layerCountMatrix(dfEdges, ["tourism", "public_transport"])
+        self.assertEqual(counts.loc["891e34d61d3ffff"].tolist(), [2.0, 1.0])
+        self.assertEqual(counts.loc["891e34d61c7ffff"].tolist(), [3.0, 0.0])
+
+        scores = scorer.profileScores(counts, {"pA": [1.0, -2.0], "pB": ("pB", [0.5, 1.0])})
+        self.assertEqual(scores.loc["891e34d61d3ffff"].tolist(), [0.0, 2.0])
+        self.assertEqual(scores.loc["891e34d61c7ffff"].tolist(), [3.0, 1.5])
+
+        with self.assertRaises(ValueError):
+            scorer.profileScores(counts, {"pC": [1.0]})
+
+
+if __name__ == '__main__':
+    unittest.main()
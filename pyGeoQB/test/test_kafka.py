@@ -0,0 +1,65 @@
+import json
+import unittest
+
+import pandas as pd
+
+import geoanalysis.geoqb.geoqb_kafka as gqk
+
+
+class FakeProducer:
+
+    # Queues messages, the delivery reports are sent on poll() and flush().
+
+    def __init__(self):
+        self.queue = []
+        self.sent = []
+        self.flushes = 0
+
+    def produce(self, topic, key=None, value=None, on_delivery=None):
+        self.queue.append((topic, key, value, on_delivery))
+
+    def poll(self, timeout=None):
+        return 0
+
+    def flush(self, timeout=None):
+        self.flushes = self.flushes + 1
+        for topic, key, value, on_delivery in self.queue:
+            self.sent.append((topic, key, value))
+            on_delivery(None, None)
+        self.queue = []
+        return 0
+
+
+class TestPublish(unittest.TestCase):
+
+    def setUp(self):
+        self.producer = FakeProducer()
+        gqk._producer = self.producer
+
+    def tearDown(self):
+        gqk._producer = None
+
+    def test_rows_are_queued_without_flush(self):
+        df = pd.DataFrame({"id": ["1", "2", "3"], "lat": [52.5, 52.6, 52.7]})
+
+        for i, row in df.iterrows():
+            gqk.publishToTopic(row, "GQ_nodes")
+
+        self.assertEqual(self.producer.flushes, 0)
+        self.assertEqual(len(self.producer.queue), 3)
+
+        gqk.flushProducer()
+        self.assertEqual([m[1] for m in self.producer.sent], ["1", "2", "3"])
+        self.assertEqual(json.loads(self.producer.sent[0][2])["lat"], 52.5)
+
+    def test_frame_is_flushed_once(self):
+        df = pd.DataFrame({"id": range(100), "lat": [52.5] * 100})
+
+        stats = gqk.publishToTopic(df, "GQ_nodes")
+
+        self.assertEqual(self.producer.flushes, 1)
+        self.assertEqual((stats["produced"], stats["delivered"], stats["failed"]), (100, 100, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import shutil
+import tempfile
+import threading
+import unittest
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from geoanalysis.geoqb.geoqb_profiles import ProfileStore, serializeProfile, PROFILE_PATH
+
+
+class FakePod:
+
+    # Stand-in for a NSS pod: password login with a session cookie, profiles with ETags.
+
+    def __init__(self):
+        self.profiles = {}
+        self.versions = {}
+        self.gets = []
+        self.logins = 0
+        self.expired = False
+        self.release = {}
+
+        pod = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body=b"", headers=None):
+                self.send_response(status)
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                pod.logins += 1
+                pod.expired = False
+                self.reply(200, headers={"Set-Cookie": "nssidp.sid=session%d; Path=/" % pod.logins})
+
+            def do_HEAD(self):
+                self.reply(200 if self.path in pod.profiles else 404)
+
+            def do_PUT(self):
+                pod.put(self.path, self.rfile.read(int(self.headers["Content-Length"])).decode())
+                self.reply(201)
+
+            def do_GET(self):
+                pod.gets.append(self.path)
+                if pod.expired or "nssidp.sid=" not in (self.headers.get("Cookie") or ""):
+                    self.reply(401)
+                    return
+                if self.path in pod.release:
+                    pod.release[self.path].wait(10)
+                if self.path not in pod.profiles:
+                    self.reply(404)
+                    return
+                etag = '"v%d"' % pod.versions[self.path]
+                if self.headers.get("If-None-Match") == etag:
+                    self.reply(304)
+                    return
+                self.reply(200, pod.profiles[self.path].encode(), {"ETag": etag})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d" % self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def put(self, path, text):
+        # rdflib < 6 serializes to bytes
+        self.profiles[path] = text.decode() if isinstance(text, bytes) else text
+        self.versions[path] = self.versions.get(path, 0) + 1
+
+    def putProfile(self, endpoint, name, values):
+        self.put(endpoint + PROFILE_PATH + name + ".ttl", serializeProfile(values))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestProfileStore(unittest.TestCase):
+
+    def setUp(self):
+        self.pod = FakePod()
+        self.cacheFolder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.pod.close()
+        shutil.rmtree(self.cacheFolder, ignore_errors=True)
+
+    def createStore(self, endpoint="", username="alice"):
+        return ProfileStore(self.pod.url + "/", username, "secret", self.pod.url + endpoint, cacheFolder=self.cacheFolder)
+
+    def test_cached_and_revalidated(self):
+        self.pod.putProfile("", "pFAM", {"tourism": 1.5, "health": -2.0})
+        store = self.createStore()
+
+        for i in range(10):
+            self.assertEqual(store.getProfile("pFAM"), {"tourism": 1.5, "health": -2.0})
+        self.assertEqual(len(self.pod.gets), 1)
+
+        # expired entries are validated with the ETag, the pod answers 304
+        self.assertEqual(store.getProfile("pFAM", maxAge=0), {"tourism": 1.5, "health": -2.0})
+        self.assertEqual(store.stats["notModified"], 1)
+        self.assertEqual(store.stats["downloads"], 1)
+        self.assertEqual(self.pod.logins, 1)
+
+    def test_disk_cache_is_keyed_by_url_and_user(self):
+        self.pod.putProfile("", "pFAM", {"tourism": 1.0})
+        self.pod.putProfile("/other", "pFAM", {"tourism": 2.0})
+
+        self.assertEqual(self.createStore().getProfile("pFAM"), {"tourism": 1.0})
+        self.assertEqual(self.createStore("/other").getProfile("pFAM"), {"tourism": 2.0})
+        self.createStore(username="bob").getProfile("pFAM")
+        self.assertEqual(len(self.pod.gets), 3)
+
+        # a new store finds the entries of the same pod and user on disk
+        self.assertEqual(self.createStore("/other").getProfile("pFAM"), {"tourism": 2.0})
+        self.assertEqual(len(self.pod.gets), 3)
+
+    def test_login_again_after_expired_session(self):
+        self.pod.putProfile("", "pOLD", {"health": 3.0})
+        store = self.createStore()
+        store.getProfile("pOLD")
+
+        self.pod.expired = True
+        self.assertEqual(store.getProfile("pOLD", maxAge=0), {"health": 3.0})
+        self.assertEqual(self.pod.logins, 2)
+
+    def test_put_invalidates_the_entry(self):
+        store = self.createStore()
+        store.putProfile("pYOUNG", {"tourism": 1.0})
+        self.assertEqual(store.getProfile("pYOUNG"), {"tourism": 1.0})
+
+        store.putProfile("pYOUNG", {"tourism": 4.0})
+        self.assertEqual(store.getProfile("pYOUNG"), {"tourism": 4.0})
+
+    def test_profiles_are_fetched_in_parallel(self):
+        self.pod.putProfile("", "slow", {"tourism": 1.0})
+        self.pod.putProfile("", "fast", {"tourism": 2.0})
+        store = self.createStore()
+        store.login()
+
+        release = threading.Event()
+        self.pod.release[PROFILE_PATH + "slow.ttl"] = release
+        slow = threading.Thread(target=store.getProfile, args=("slow",))
+        slow.start()
+        while PROFILE_PATH + "slow.ttl" not in self.pod.gets:
+            slow.join(0.01)
+
+        # the pending request for "slow" does not block other profiles
+        self.assertEqual(store.getProfile("fast"), {"tourism": 2.0})
+        self.assertTrue(slow.is_alive())
+
+        release.set()
+        slow.join(10)
+        self.assertEqual(store.getProfile("slow"), {"tourism": 1.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from geoanalysis.geoqb.geoqb_query_cache import QueryCache
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.result = os.path.join(self.folder, "result.json")
+        with open(self.result, "w") as f:
+            json.dump({"elements": [{"id": 1}]}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def readIndex(self, cache):
+        with open(cache.indexFile) as f:
+            return json.load(f)
+
+    def test_lookups_do_not_write_the_index(self):
+        cache = QueryCache(os.path.join(self.folder, "cache"))
+        cache.putFile("node[amenity=cafe];", "overpass", self.result)
+
+        os.utime(cache.indexFile, (0, 0))
+        for i in range(5):
+            self.assertIsNotNone(cache.get("node[amenity=cafe]; ", "overpass"))
+        self.assertIsNone(cache.get("way[amenity=cafe];", "overpass"))
+        self.assertEqual(os.path.getmtime(cache.indexFile), 0)
+        self.assertEqual(self.readIndex(cache)["stats"]["hits"], 0)
+
+        cache.flush()
+        self.assertNotEqual(os.path.getmtime(cache.indexFile), 0)
+        self.assertEqual(self.readIndex(cache)["stats"]["hits"], 5)
+        self.assertEqual(self.readIndex(cache)["stats"]["misses"], 1)
+
+    def test_flushed_statistics_are_loaded_again(self):
+        folder = os.path.join(self.folder, "cache")
+        cache = QueryCache(folder)
+        cache.putFile("node[amenity=cafe];", "overpass", self.result)
+        cache.get("node[amenity=cafe];", "overpass")
+        cache.flush()
+
+        stats = QueryCache(folder).getStats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["entries"], 1)
+        self.assertEqual([n for n in os.listdir(folder) if n.endswith(".tmp")], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
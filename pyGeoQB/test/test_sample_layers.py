@@ -0,0 +1,26 @@
+import unittest
+from unittest import mock
+
+import geoanalysis.geoqb.geoqb_layers as gql
+from geoanalysis.geoqb.sample_data import sample_layers
+
+
+class TestDemoDataStack(unittest.TestCase):
+
+    def test_failed_prefetch_is_raised(self):
+        def getJSONData(sheet, path_offset, forceReload=False, dryRun=False):
+            if "nightclub" in sheet.query:
+                raise IOError("Sophox is not available")
+            return sheet.qn
+
+        with mock.patch.object(gql.SophoxLayer, "getJSONData", getJSONData), \
+                mock.patch.object(sample_layers, "combineSheets") as combineSheets:
+            with self.assertRaises(RuntimeError) as ctx:
+                sample_layers.getKGC2022_DemoDataStack("Point(52.52, 13.4)", 10, 9, "./", dryRun=True)
+
+        self.assertIn("Services_NEG", str(ctx.exception))
+        combineSheets.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import json
+import unittest
+
+import pandas as pd
+
+from confluent_kafka import TopicPartition
+
+from geoanalysis.geoqb.geoqb_stream_blender import StreamBlender
+
+
+class FakeMessage:
+
+    def __init__(self, topic, partition, offset, key, value):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._key = key
+        self._value = value
+
+    def error(self):
+        return None
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key.encode('UTF-8')
+
+    def value(self):
+        return self._value.encode('UTF-8') if self._value is not None else None
+
+    def headers(self):
+        return None
+
+
+class FakeConsumer:
+
+    # the messages of one partition, served by poll() and followed by None (no new messages)
+
+    def __init__(self, messages, end):
+        self.messages = list(messages)
+        self.end = end
+        self.commits = []
+        self.consumed = 0
+
+    def poll(self, timeout=None):
+        if len(self.messages) == 0:
+            return None
+        self.consumed = self.consumed + 1
+        return self.messages.pop(0)
+
+    def commit(self, offsets=None, asynchronous=True):
+        self.commits.append([(tp.topic, tp.partition, tp.offset) for tp in offsets])
+
+    def assignment(self):
+        return [TopicPartition("GQ_sensors", 0)]
+
+    def position(self, partitions):
+        return [TopicPartition(tp.topic, tp.partition, self.consumed) for tp in partitions]
+
+    def get_watermark_offsets(self, partition, cached=False):
+        return 0, self.end
+
+
+def createMessages(n):
+    cells = ["891e34d61d3ffff", "891e34d61c7ffff", "891e34d61cfffff"]
+    return [FakeMessage("GQ_sensors", 0, i, '"' + cells[i % 3] + '"', json.dumps({"t": 1650014969 + i, "temp": 20.0 + i}))
+            for i in range(n)]
+
+
+class TestStreamBlender(unittest.TestCase):
+
+    def setUp(self):
+        # the third cell is not part of the layer
+        self.layer = pd.DataFrame({"Id": ["891e34d61d3ffff", "891e34d61c7ffff"], "Lat": [52.5, 52.6], "Lon": [13.4, 13.5]})
+        self.calls = []
+
+    def blend(self, layer, df, mappings, path_offset, conn, res=9, dumpFile=False, mode=None):
+        self.calls.append((len(layer), len(df)))
+        return [{"job": "observed_at:temp", "upserted": len(df)}]
+
+    def test_batches_and_commits(self):
+        consumer = FakeConsumer(createMessages(25), end=25)
+        blender = StreamBlender(consumer, self.layer, [], None, batchSize=10, batchSeconds=60, blend=self.blend, verbose=False)
+
+        metrics = blender.run(maxMessages=25, pollTimeout=0)
+
+        self.assertEqual(metrics["messages"], 25)
+        self.assertEqual(metrics["batches"], 3)
+        self.assertEqual(metrics["unmatched"], 8)
+        self.assertEqual(metrics["matched"], 17)
+        self.assertEqual(metrics["observations"], 17)
+        self.assertEqual(metrics["lag"], 0)
+        self.assertEqual([c[0] for c in self.calls], [2, 2, 2])
+        # the committed offset is the next message to read
+        self.assertEqual(consumer.commits, [[("GQ_sensors", 0, 10)], [("GQ_sensors", 0, 20)], [("GQ_sensors", 0, 25)]])
+
+    def test_tombstones_are_skipped(self):
+        messages = createMessages(6)
+        for i in (1, 4):
+            messages[i]._value = None
+        tail = [FakeMessage("GQ_sensors", 0, 6, '"891e34d61d3ffff"', None)]
+
+        consumer = FakeConsumer(messages + tail, end=7)
+        blender = StreamBlender(consumer, self.layer, [], None, batchSize=4, batchSeconds=60, blend=self.blend, verbose=False)
+
+        metrics = blender.run(maxMessages=7, pollTimeout=0)
+
+        self.assertEqual(metrics["messages"], 7)
+        self.assertEqual(metrics["tombstones"], 3)
+        self.assertEqual(metrics["matched"] + metrics["unmatched"], 4)
+        self.assertEqual(metrics["batches"], 1)
+        self.assertEqual(self.calls, [(1, 2)])
+        # the offsets of the tombstones are committed, also without a batch after them
+        self.assertEqual(consumer.commits, [[("GQ_sensors", 0, 6)], [("GQ_sensors", 0, 7)]])
+
+    def test_retry_after_failure(self):
+        failures = [RuntimeError("REST++ is not available")]
+
+        def blend(*args, **kwargs):
+            if len(failures) > 0:
+                raise failures.pop()
+            return self.blend(*args, **kwargs)
+
+        consumer = FakeConsumer(createMessages(5), end=5)
+        blender = StreamBlender(consumer, self.layer, [], None, batchSize=5, batchRetries=2, batchBackoff=0.0, blend=blend, verbose=False)
+
+        metrics = blender.run(maxMessages=5, pollTimeout=0)
+
+        self.assertEqual(metrics["failedBatches"], 0)
+        self.assertEqual(metrics["batches"], 1)
+        self.assertEqual(self.calls, [(2, 4)])
+        self.assertEqual(consumer.commits, [[("GQ_sensors", 0, 5)]])
+
+    def test_failed_batch_is_not_committed(self):
+        def blend(*args, **kwargs):
+            raise RuntimeError("REST++ is not available")
+
+        consumer = FakeConsumer(createMessages(5), end=5)
+        blender = StreamBlender(consumer, self.layer, [], None, batchSize=5, batchRetries=2, batchBackoff=0.0, blend=blend, verbose=False)
+
+        with self.assertRaises(RuntimeError):
+            blender.run(maxMessages=5, pollTimeout=0)
+
+        self.assertEqual(blender.metrics["failedBatches"], 1)
+        self.assertEqual(blender.metrics["batches"], 0)
+        self.assertEqual(consumer.commits, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
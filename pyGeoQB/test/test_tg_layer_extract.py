@@ -0,0 +1,146 @@
+import unittest
+
+from geoanalysis.geoqb import geoqb_tg_queries as gqqueries
+from geoanalysis.geoqb import geoqb_tg_layer_extract as gqtaglayerextract
+
+
+class FakeGraph:
+
+    # Evaluates the seeded export queries on a list of undirected edges.
+
+    def __init__(self, edges, maxEdges=None):
+        self.graphname = "OSMLayers_Test"
+        self.edges = edges
+        self.maxEdges = maxEdges
+        self.pages = []
+        self.posts = []
+
+    def getVertexTypes(self):
+        return ["osmtag", "osmplace", "h3place", "osmlayer"]
+
+    def getEdgeTypes(self):
+        return ["hasOSMTag", "located_on_h3_cell", "h3_grid_link", "layer_member"]
+
+    def gsql(self, query, options=None):
+        return "ok"
+
+    def cells(self):
+        return {e[i] for e in self.edges for i in (1, 3) if e[i + 1] == "h3place"}
+
+    def runInstalledQuery(self, name, params=None, sizeLimit=None, usePost=False):
+        key = name.rsplit("_", 1)[0]
+        params = params or {}
+
+        if key == "geoqb_place_ids":
+            return [{"ids": sorted(self.cells())}]
+        if key == "geoqb_layer_cells":
+            return [{"ids": sorted({e[3] for e in self.edges if self.inLayer(e, params)})}]
+
+        self.posts.append(usePost)
+        seeds = set(params["seeds"])
+        edges = [e for e in self.edges
+                 if (e[1] in seeds and e[2] == "h3place" or e[3] in seeds and e[4] == "h3place")
+                 and (key == "geoqb_all_page" or self.inLayer(e, params))]
+        if self.maxEdges is not None and len(edges) > self.maxEdges:
+            raise Exception("The query response size exceeds the limit of %s bytes" % sizeLimit)
+        self.pages.append(sorted(seeds))
+
+        nodes = {(e[i], e[i + 1]) for e in edges for i in (1, 3)}
+        return [{"nodes1": [{"v_id": v, "v_type": t, "attributes": {}} for v, t in sorted(nodes)]},
+                {"@@edgeset": [{"e_type": e[0], "directed": False, "from_id": e[1], "from_type": e[2],
+                                "to_id": e[3], "to_type": e[4], "attributes": {"layer_id": e[5]}} for e in edges]}]
+
+    def inLayer(self, e, params):
+        return params["lID1"] in e[5] and (params["lID2a"] in e[5] or params["lID2b"] in e[5])
+
+
+def createEdges():
+    edges = []
+    for i in range(40):
+        cell = "891e34d61%02dffff" % i
+        variant = "POS" if i % 2 == 0 else "NEG"
+        # all cells share the tags, so a tag is found on every page
+        edges.append(("hasOSMTag", "amenity=cafe", "osmtag", cell, "h3place", "A_" + variant))
+        edges.append(("located_on_h3_cell", "node%d" % i, "osmplace", cell, "h3place", "A_" + variant))
+        edges.append(("hasOSMTag", "shop=bakery", "osmtag", cell, "h3place", "B_POS"))
+    edges.append(("h3_grid_link", "891e34d6100ffff", "h3place", "891e34d6139ffff", "h3place", "all"))
+    return edges
+
+
+class TestSeededExport(unittest.TestCase):
+
+    def setUp(self):
+        self.enabled = gqqueries.LAYER_INDEX
+        gqqueries.resetLayerIndex()
+        gqtaglayerextract._graphsWithoutLayerIndex.clear()
+
+    def tearDown(self):
+        gqqueries.LAYER_INDEX = self.enabled
+        gqqueries.resetLayerIndex()
+
+    def test_pages_partition_the_seed_cells(self):
+        pages = gqtaglayerextract.seedPages(["c3", "c1", "c2", "c1", "c5", "c4"], numPages=4)
+        self.assertEqual(pages, [["c1", "c2"], ["c3", "c4"], ["c5"]])
+        self.assertEqual(gqtaglayerextract.seedPages([], numPages=4), [])
+
+    def test_all_pages(self):
+        conn = FakeGraph(createEdges())
+        dfS, dfedges = gqtaglayerextract.exportGraphFrames(conn, "geoqb_all_page", {}, sorted(conn.cells()), numPages=4, verbose=False)
+
+        # every page gets its own cells, all pages are sent as POST
+        self.assertEqual(len(conn.pages), 4)
+        self.assertEqual(sorted(c for page in conn.pages for c in page), sorted(conn.cells()))
+        self.assertTrue(all(conn.posts))
+
+        # shared tags and the grid link between two pages are kept once
+        self.assertEqual(len(dfedges), len(conn.edges))
+        self.assertFalse(dfS.duplicated(subset=["v_type", "v_id"]).any())
+        self.assertEqual(len(dfS), 40 + 40 + 2)
+        self.assertEqual(list(dfS["index"]), list(range(len(dfS))))
+
+    def test_layer_variants_with_and_without_index(self):
+        for index in (False, True):
+            gqqueries.LAYER_INDEX = index
+            gqqueries.resetLayerIndex()
+            conn = FakeGraph(createEdges())
+
+            frames = gqtaglayerextract._exportLayerVariants(conn, "A", ["POS", "NEG"], numPages=4, verbose=False)
+
+            for variant in ("POS", "NEG"):
+                dfS, dfedges = frames[variant]
+                self.assertEqual(len(dfedges), 40)
+                self.assertTrue(dfedges["attributes.layer_id"].eq("A_" + variant).all())
+                self.assertEqual(len(dfS), 20 + 20 + 1)
+
+            seeded = sorted(c for page in conn.pages for c in page)
+            self.assertEqual(seeded, sorted(conn.cells()))
+
+    def test_empty_layer(self):
+        for index in (False, True):
+            gqqueries.LAYER_INDEX = index
+            gqqueries.resetLayerIndex()
+            conn = FakeGraph(createEdges())
+
+            frames = gqtaglayerextract._exportLayerVariants(conn, "C", ["POS", "NEG"], numPages=4, verbose=False)
+
+            for variant in ("POS", "NEG"):
+                dfS, dfedges = frames[variant]
+                self.assertEqual((len(dfS), len(dfedges)), (0, 0))
+                self.assertIn("v_id", dfS.columns)
+                self.assertIn("from_id", dfedges.columns)
+
+    def test_page_over_size_limit_is_split(self):
+        conn = FakeGraph(createEdges(), maxEdges=25)
+        dfS, dfedges = gqtaglayerextract.exportGraphFrames(conn, "geoqb_all_page", {}, sorted(conn.cells()), numPages=2, verbose=False)
+
+        self.assertEqual(len(dfedges), len(conn.edges))
+        self.assertEqual([len(page) for page in conn.pages], [5] * 8)
+        self.assertEqual(sorted(c for page in conn.pages for c in page), sorted(conn.cells()))
+
+        conn = FakeGraph(createEdges(), maxEdges=2)
+        with self.assertRaises(gqtaglayerextract.ExportSizeLimitError):
+            gqtaglayerextract.exportGraphFrames(conn, "geoqb_all_page", {}, sorted(conn.cells()), numPages=2, verbose=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,271 @@
+import json
+import threading
+import unittest
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+import requests
+
+import geoanalysis.geoqb.geoqb_tg_loader as gqtgloader
+
+
+def _rejectConstant(name):
+    raise ValueError("invalid JSON constant " + name)
+
+
+class FakeRestpp:
+
+    # Stand-in for the REST++ endpoints /graph/<graph> (upserts) and /ddl/<graph> (loading jobs).
+
+    def __init__(self, graph_name="G"):
+        self.graph_name = graph_name
+        self.upserts = []
+        self.loads = []
+        self.tokens = []
+
+        restpp = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, result):
+                body = json.dumps(result).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                data = self.rfile.read(int(self.headers["Content-Length"])).decode()
+                restpp.tokens.append(self.headers.get("Authorization"))
+
+                if url.path == "/graph/" + restpp.graph_name:
+                    try:
+                        payload = json.loads(data, parse_constant=_rejectConstant)
+                    except ValueError as e:
+                        self.reply(400, {"error": True, "message": str(e)})
+                        return
+                    restpp.upserts.append(payload)
+                    vertices = sum(len(v) for v in payload.get("vertices", {}).values())
+                    edges = sum(len(t) for s in payload.get("edges", {}).values()
+                                for e in s.values() for tt in e.values() for t in tt.values())
+                    self.reply(200, {"error": False, "results": [{"accepted_vertices": vertices, "accepted_edges": edges}]})
+
+                elif url.path == "/ddl/" + restpp.graph_name:
+                    params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                    restpp.loads.append((params, data))
+                    rows = len([line for line in data.split("\n") if line])
+                    self.reply(200, {"error": False, "results": [{"statistics": {"vertex": [{"typeName": "h3place", "validObject": rows}]}}]})
+
+                else:
+                    self.reply(404, {"error": True, "message": "Endpoint is not found from url = " + url.path})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d" % self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeConnection:
+
+    def __init__(self, restppUrl, graphname="G", apiToken="token1"):
+        self.restppUrl = restppUrl
+        self.graphname = graphname
+        self.apiToken = apiToken
+
+
+class TestRestppUpserter(unittest.TestCase):
+
+    def setUp(self):
+        self.restpp = FakeRestpp()
+        self.conn = FakeConnection(self.restpp.url)
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.session.close()
+        self.restpp.close()
+
+    def test_missing_values_are_sent_as_null(self):
+        # observations of a mapping which some records do not have
+        df = pd.DataFrame({"Id": ["891e34d61d3ffff", "891e34d61c7ffff"], "factID": ["p", "p"],
+                           "value": [1013.2, np.nan], "t": ["2022-04-15 09:29:29", None]})
+        job = gqtgloader.edgeJob("observed_at:p", df, sourceVertexType='h3place', edgeType='observed_at', targetVertexType='fact',
+                                 from_id='Id', to_id='factID', attributes={'value': 'value', 'time': 't'})
+
+        target = gqtgloader.getIngestTarget(self.conn, "", mode="upsert", session=self.session)
+        stats = gqtgloader.upsertJobs(target, [job], retries=0, verbose=False)
+
+        self.assertEqual(stats[0]["upserted"], 2)
+        edges = self.restpp.upserts[0]["edges"]["h3place"]
+        self.assertEqual(edges["891e34d61d3ffff"]["observed_at"]["fact"]["p"], {"value": {"value": 1013.2}, "time": {"value": "2022-04-15 09:29:29"}})
+        self.assertEqual(edges["891e34d61c7ffff"]["observed_at"]["fact"]["p"], {"value": {"value": None}, "time": {"value": None}})
+
+    def test_vertices_and_token_refresh(self):
+        df = pd.DataFrame({"Id": ["891e34d61d3ffff"], "res": [9], "Lat": [52.5], "Lon": [13.4]})
+        target = gqtgloader.getIngestTarget(self.conn, "", mode="upsert", session=self.session)
+
+        self.assertEqual(target.upsertVertexDataFrame(df, 'h3place', 'Id', {'resolution': 'res', 'lat': 'Lat', 'lon': 'Lon'}), 1)
+        self.conn.apiToken = "token2"
+        target.upsertVertexDataFrame(df, 'h3place', 'Id', {'resolution': 'res'})
+
+        self.assertEqual(self.restpp.upserts[0]["vertices"]["h3place"]["891e34d61d3ffff"],
+                         {"resolution": {"value": 9}, "lat": {"value": 52.5}, "lon": {"value": 13.4}})
+        self.assertEqual(self.restpp.tokens, ["Bearer token1", "Bearer token2"])
+
+
+class TestLoadingJobLoader(unittest.TestCase):
+
+    TYPES = """
+CREATE VERTEX h3place(PRIMARY_ID h3index STRING, resolution INT, lat DOUBLE, lon DOUBLE) WITH primary_id_as_attribute="true"
+CREATE UNDIRECTED EDGE located_on_h3_cell(FROM osmplace, TO h3place, layer_id STRING)
+"""
+
+    def setUp(self):
+        self.restpp = FakeRestpp()
+        self.conn = FakeConnection(self.restpp.url)
+        self.statements = []
+        self.session = requests.Session()
+
+    def tearDown(self):
+        self.session.close()
+        self.restpp.close()
+
+    def gsql(self, statement):
+        self.statements.append(statement)
+        name = statement.split("CREATE LOADING JOB ")[1].split()[0]
+        return "Successfully created loading jobs: [" + name + "]."
+
+    def createLoader(self):
+        return gqtgloader.LoadingJobLoader(self.restpp.url, "G", self.TYPES, self.gsql, session=self.session, conn=self.conn)
+
+    def test_csv_columns_and_job(self):
+        df = pd.DataFrame({"Id": ["891e34d61d3ffff", "891e34d61c7ffff"], "Lon": [13.4, 13.5], "Lat": [52.5, 52.6]})
+        job = gqtgloader.vertexJob("h3place", df, vertexType='h3place', v_id='Id', attributes={'lon': 'Lon', 'lat': 'Lat'})
+
+        stats = gqtgloader.upsertJobs(self.createLoader(), [job], verbose=False)
+
+        self.assertEqual(stats[0]["upserted"], 2)
+        self.assertEqual(len(self.statements), 1)
+        # the attributes in schema order, resolution is not mapped
+        self.assertIn("LOAD f TO VERTEX h3place VALUES($0, _, $1, $2)", self.statements[0])
+
+        params, data = self.restpp.loads[0]
+        jobName = gqtgloader.getLoadingJobName("h3place", gqtgloader.parseTypeDefinitions(self.TYPES)["h3place"], ["lat", "lon"])
+        self.assertEqual(params["tag"], jobName)
+        self.assertEqual(params["filename"], "f")
+        self.assertEqual(data, "891e34d61d3ffff,52.5,13.4\n891e34d61c7ffff,52.6,13.5\n")
+
+    def test_job_is_created_once_and_token_is_refreshed(self):
+        df = pd.DataFrame({"Id": ["891e34d61d3ffff"], "Lat": [52.5]})
+        loader = self.createLoader()
+
+        loader.loadChunk(gqtgloader.vertexJob("a", df, vertexType='h3place', v_id='Id', attributes={'lat': 'Lat'}), df)
+        self.conn.apiToken = "token2"
+        loader.loadChunk(gqtgloader.vertexJob("b", df, vertexType='h3place', v_id='Id', attributes={'lat': 'Lat'}), df)
+
+        self.assertEqual(len(self.statements), 1)
+        self.assertEqual(self.restpp.tokens, ["Bearer token1", "Bearer token2"])
+
+    def test_failed_job_creation(self):
+        df = pd.DataFrame({"Id": ["891e34d61d3ffff"], "Lat": [52.5]})
+        loader = gqtgloader.LoadingJobLoader(self.restpp.url, "G", self.TYPES, lambda statement: "Semantic Check Fails: unknown attribute",
+                                             session=self.session, conn=self.conn)
+
+        with self.assertRaises(RuntimeError):
+            loader.loadChunk(gqtgloader.vertexJob("a", df, vertexType='h3place', v_id='Id', attributes={'lat': 'Lat'}), df)
+        self.assertEqual(self.restpp.loads, [])
+
+
+class FakeTarget:
+
+    # Records the chunks in the order they are loaded, the first failures calls of a job raise.
+
+    def __init__(self, failures=None):
+        self.failures = dict(failures or {})
+        self.events = []
+        self.lock = threading.Lock()
+
+    def _load(self, name, df):
+        with self.lock:
+            if self.failures.get(name, 0) > 0:
+                self.failures[name] -= 1
+                raise RuntimeError("REST++ is not available")
+            self.events.append(name)
+        return len(df)
+
+    def upsertVertexDataFrame(self, df, vertexType, v_id, attributes):
+        return self._load(vertexType, df)
+
+    def upsertEdgeDataFrame(self, df, sourceVertexType, edgeType, targetVertexType, from_id, to_id, attributes):
+        return self._load(edgeType, df)
+
+
+def createJobs(n=10):
+    cells = pd.DataFrame({"h3index": ["891e34d61d3ffff"] * n, "res": [9] * n})
+    tags = pd.DataFrame({"osmtag": ["amenity=school"] * n})
+    links = pd.DataFrame({"osmtag": ["amenity=school"] * n, "h3index": ["891e34d61d3ffff"] * n})
+    return [
+        gqtgloader.vertexJob("h3place", cells, vertexType='h3place', v_id='h3index', attributes={'resolution': 'res'}),
+        gqtgloader.vertexJob("osmtag", tags, vertexType='osmtag', v_id='osmtag', attributes={}),
+        gqtgloader.edgeJob("hasOSMTag", links, sourceVertexType='osmtag', edgeType='hasOSMTag', targetVertexType='h3place',
+                           from_id='osmtag', to_id='h3index', attributes={}, dependsOn=["h3place", "osmtag"])
+    ]
+
+
+class TestUpsertJobs(unittest.TestCase):
+
+    def test_edges_wait_for_their_vertices(self):
+        target = FakeTarget()
+        stats = gqtgloader.upsertJobs(target, createJobs(), chunkSize=3, maxWorkers=4, verbose=False)
+
+        first = target.events.index("hasOSMTag")
+        self.assertEqual(target.events[:first].count("h3place"), 4)
+        self.assertEqual(target.events[:first].count("osmtag"), 4)
+        self.assertEqual(target.events[first:], ["hasOSMTag"] * 4)
+        self.assertEqual([s["upserted"] for s in stats], [10, 10, 10])
+
+    def test_failed_chunks_are_retried(self):
+        target = FakeTarget(failures={"h3place": 2})
+        stats = gqtgloader.upsertJobs(target, createJobs(), chunkSize=5, retries=3, backoff=0.0, verbose=False)
+
+        self.assertEqual(stats[0]["retries"], 2)
+        self.assertEqual(stats[0]["upserted"], 10)
+        self.assertEqual(target.events.count("hasOSMTag"), 2)
+
+    def test_failure_after_all_retries(self):
+        target = FakeTarget(failures={"osmtag": 10})
+        with self.assertRaises(RuntimeError):
+            gqtgloader.upsertJobs(target, createJobs(), chunkSize=5, retries=1, backoff=0.0, verbose=False)
+        self.assertNotIn("hasOSMTag", target.events)
+
+    def test_job_names_are_unique(self):
+        jobs = createJobs() + [createJobs()[0]]
+        with self.assertRaises(ValueError):
+            gqtgloader.upsertJobs(FakeTarget(), jobs, verbose=False)
+
+    def test_unknown_dependency(self):
+        jobs = createJobs()[2:]
+        with self.assertRaises(ValueError):
+            gqtgloader.upsertJobs(FakeTarget(), jobs, verbose=False)
+
+    def test_statistics_of_a_second_run(self):
+        jobs = createJobs()
+        gqtgloader.upsertJobs(FakeTarget(failures={"h3place": 1}), jobs, chunkSize=5, backoff=0.0, verbose=False)
+        stats = gqtgloader.upsertJobs(FakeTarget(), jobs, chunkSize=5, verbose=False)
+
+        self.assertEqual([s["upserted"] for s in stats], [10, 10, 10])
+        self.assertEqual(stats[0]["retries"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+from geoanalysis.geoqb import geoqb_tg_queries as gqqueries
+
+
+class FakeConnection:
+
+    def __init__(self, graphname, vertexTypes, edgeTypes):
+        self.graphname = graphname
+        self.vertexTypes = vertexTypes
+        self.edgeTypes = edgeTypes
+        self.calls = 0
+
+    def getVertexTypes(self):
+        self.calls = self.calls + 1
+        if self.vertexTypes is None:
+            raise RuntimeError("connection refused")
+        return self.vertexTypes
+
+    def getEdgeTypes(self):
+        return self.edgeTypes
+
+
+class TestLayerIndex(unittest.TestCase):
+
+    def setUp(self):
+        gqqueries.resetLayerIndex()
+        self.enabled = gqqueries.LAYER_INDEX
+        gqqueries.LAYER_INDEX = True
+
+    def tearDown(self):
+        gqqueries.LAYER_INDEX = self.enabled
+        gqqueries.resetLayerIndex()
+
+    def test_graph_with_index_types(self):
+        conn = FakeConnection("OSMLayers_Demo6a", ["osmtag", "osmplace", "h3place", "osmlayer"],
+                              ["hasOSMTag", "h3_grid_link", "located_on_h3_cell", "layer_member"])
+        self.assertTrue(gqqueries.hasLayerIndex(conn))
+        self.assertTrue(gqqueries.hasLayerIndex(conn))
+        # the schema is read once per graph
+        self.assertEqual(conn.calls, 1)
+
+    def test_old_schema_is_skipped(self):
+        conn = FakeConnection("OSMLayers_Old", ["osmtag", "osmplace", "h3place"],
+                              ["hasOSMTag", "h3_grid_link", "located_on_h3_cell"])
+        self.assertFalse(gqqueries.hasLayerIndex(conn))
+
+        # after addLayerIndexToOSMGraph the schema is read again
+        conn.vertexTypes = conn.vertexTypes + ["osmlayer"]
+        conn.edgeTypes = conn.edgeTypes + ["layer_member"]
+        self.assertFalse(gqqueries.hasLayerIndex(conn))
+        gqqueries.resetLayerIndex("OSMLayers_Old")
+        self.assertTrue(gqqueries.hasLayerIndex(conn))
+
+    def test_unavailable_schema_or_disabled_index(self):
+        self.assertFalse(gqqueries.hasLayerIndex(FakeConnection("OSMLayers_Down", None, [])))
+
+        gqqueries.LAYER_INDEX = False
+        conn = FakeConnection("OSMLayers_Demo6a", ["osmlayer"], ["layer_member"])
+        self.assertFalse(gqqueries.hasLayerIndex(conn))
+        self.assertEqual(conn.calls, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+import numpy as np
+
+from h3 import h3
+
+import geoanalysis.geoqb.geoqb_tiling as gqtiling
+
+
+class FakeSophox:
+
+    # Records at random points, a tile query returns the records in its circle up to the LIMIT.
+
+    def __init__(self, center, radius_km, n):
+        rng = np.random.default_rng(7)
+        self.lat = center[0] + (rng.random(n) - 0.5) * 2.2 * radius_km / 111.0
+        self.lon = center[1] + (rng.random(n) - 0.5) * 2.2 * radius_km / 68.0
+        self.queries = []
+
+    def fetchTile(self, cell, radius_km, limit):
+        self.queries.append(cell)
+        lat, lon = h3.h3_to_geo(cell)
+        inside = np.flatnonzero(gqtiling._distanceKm(lat, lon, self.lat, self.lon) <= radius_km)
+        return [{"osmid": str(i), "tag": "amenity=cafe", "loc": "Point(%r %r)" % (float(self.lon[i]), float(self.lat[i]))}
+                for i in inside[:limit]]
+
+
+class TestTiling(unittest.TestCase):
+
+    def test_children_and_neighbours_cover_the_parent(self):
+        parent = h3.geo_to_h3(52.5, 13.4, 5)
+        tiles = set(gqtiling.splitTiles([parent]))
+        boundary = h3.h3_to_geo_boundary(parent)
+
+        rng = np.random.default_rng(1)
+        lats = rng.uniform(min(p[0] for p in boundary), max(p[0] for p in boundary), 5000)
+        lons = rng.uniform(min(p[1] for p in boundary), max(p[1] for p in boundary), 5000)
+        for lat, lon in zip(lats, lons):
+            if h3.geo_to_h3(lat, lon, 5) == parent:
+                self.assertIn(h3.geo_to_h3(lat, lon, 6), tiles)
+
+    def test_split_tiles_find_all_records(self):
+        center, radius_km = (52.52, 13.40), 20.0
+        sophox = FakeSophox(center, radius_km, 20000)
+
+        records = gqtiling.fetchTiledRecords(center, radius_km, sophox.fetchTile, targetCount=200, resolution=6, verbose=False)
+
+        expected = np.flatnonzero(gqtiling._distanceKm(center[0], center[1], sophox.lat, sophox.lon) <= radius_km)
+        self.assertGreater(len(sophox.queries), len(gqtiling.planTiles(center, radius_km, 6)))
+        self.assertEqual(sorted(int(r["osmid"]) for r in records), expected.tolist())
+        # each cell is queried once
+        self.assertEqual(len(sophox.queries), len(set(sophox.queries)))
+
+
+if __name__ == '__main__':
+    unittest.main()